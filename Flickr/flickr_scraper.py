@@ -3,6 +3,7 @@
 # Generated by Glenn Jocher (glenn.jocher@ultralytics.com) for https://github.com/ultralytics
 
 import argparse
+import os
 import time
 from pathlib import Path
 from flickrapi import FlickrAPI
@@ -10,6 +11,9 @@ from utils.general import download_uri
 from tqdm import tqdm
 import sys
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.ledger import DownloadLedger, ledger_path
+
 key = ""  
 secret = ""
 
@@ -33,6 +37,7 @@ def get_urls(search="honeybees on flowers", n=10, download=False, save_dir=None)
         else:
             dir_path = Path.cwd() / "images" / search.replace(" ", "_")
         dir_path.mkdir(parents=True, exist_ok=True)
+        ledger = DownloadLedger(ledger_path(dir_path))  # skip images finished in earlier runs
 
     # 创建进度条，使用更紧凑的格式
     pbar = tqdm(
@@ -55,7 +60,7 @@ def get_urls(search="honeybees on flowers", n=10, download=False, save_dir=None)
 
             if download:
                 try:
-                    if download_uri(url, dir_path):
+                    if download_uri(url, dir_path, ledger=ledger):
                         count += 1
                         pbar.update(1)
                 except Exception as e:
@@ -66,6 +71,8 @@ def get_urls(search="honeybees on flowers", n=10, download=False, save_dir=None)
             tqdm.write(f"[{search}] 错误: {str(e).split('。')[0]}")
             
     pbar.close()
+    if download:
+        ledger.close()
     # 下载完成后显示简短总结
     tqdm.write(f"[{search}] 完成: {count}/{n} 张图片 ({time.time() - t:.1f}s)")
     return count
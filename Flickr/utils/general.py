@@ -4,23 +4,29 @@
 # Written by Glenn Jocher (glenn.jocher@ultralytics.com) for https://github.com/ultralytics
 
 import os
+import sys
 from pathlib import Path
 
-import requests
 from PIL import Image
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from common.fetch import download_to
+from common.ledger import STATUS_DONE
 
-def download_uri(uri, dir="./"):
-    """Downloads file from URI using streaming to reduce memory usage."""
+
+def download_uri(uri, dir="./", ledger=None):
+    """
+    Downloads file from URI using streaming to reduce memory usage, skipping URIs the ledger marks as done.
+
+    Data is streamed into a .part file and renamed into place once complete, so interrupted transfers of large
+    originals resume with an HTTP Range request on the next run instead of starting over.
+    """
+    if ledger is not None and ledger.is_done(uri):
+        return True
     try:
         # Download using streaming
         f = Path(dir) / os.path.basename(uri)  # filename
-        with requests.get(uri, stream=True, timeout=10) as r:
-            r.raise_for_status()
-            with open(f, 'wb') as file:
-                for chunk in r.iter_content(chunk_size=8192):
-                    if chunk:
-                        file.write(chunk)
+        size, sha1, status = download_to(uri, str(f), timeout=10)
 
         # Rename (remove wildcard characters)
         src = str(f)  # original name
@@ -44,7 +50,9 @@ def download_uri(uri, dir="./"):
                 if os.path.exists(src):
                     os.remove(src)
                 raise e
-                
+
+        if ledger is not None:
+            ledger.record(uri, STATUS_DONE, size, sha1, str(f), status)
         return True
     except Exception as e:
         if os.path.exists(f):
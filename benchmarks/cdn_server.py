@@ -0,0 +1,151 @@
+"""
+本地模拟图片CDN，给下载引擎做离线基准测试
+/img/<编号>.jpg 返回合成的JPEG（带SOF段，探测可以解析出宽高），支持Range和keep-alive
+可配置：每个请求的延迟、单连接带宽、随机5xx的比例、周期性的429突发
+服务端记录每个请求的耗时（收到请求到最后一个字节写完）和状态码，供基准测试统计p50/p99
+"""
+import time
+import struct
+import random
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def synthetic_jpeg(size, width=1024, height=768, seed=0):
+    """指定字节数的合成JPEG，内容随机，只保证文件头合法"""
+    header = b"\xff\xd8" + b"\xff\xc0" + struct.pack(">HBHHB", 11, 8, height, width, 3) + b"\x01\x11\x00"
+    body = random.Random(seed).randbytes(max(size - len(header) - 2, 0))
+    return header + body + b"\xff\xd9"
+
+
+class CDNConfig:
+    def __init__(self, image_kb=200, latency=0.02, bandwidth=0, error_rate=0.0, burst_every=0, burst_length=0.0,
+                 seed=0):
+        """
+        image_kb: 每张图的大小
+        latency: 每个请求返回前等待的秒数
+        bandwidth: 单个连接每秒发送的字节数，0表示不限
+        error_rate: 随机返回500的比例
+        burst_every/burst_length: 每隔burst_every秒，有burst_length秒所有请求都返回429
+        """
+        self.image_kb = image_kb
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.burst_every = burst_every
+        self.burst_length = burst_length
+        self.seed = seed
+
+    def to_dict(self):
+        return dict(vars(self))
+
+
+class CDNHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, body=b"", extra=None):
+        self.send_response(status)
+        for key, value in (extra or {}).items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        sent = 0
+        bandwidth = self.server.config.bandwidth
+        chunk = 16 * 1024
+        while sent < len(body):
+            self.wfile.write(body[sent:sent + chunk])
+            sent += chunk
+            if bandwidth:
+                time.sleep(chunk / bandwidth)
+        return len(body)
+
+    def do_GET(self):
+        start = time.monotonic()
+        config = self.server.config
+        status, size = self._serve(config)
+        self.server.record(time.monotonic() - start, status, size)
+
+    def _serve(self, config):
+        if not self.path.startswith("/img/"):
+            return 404, self._reply(404)
+        if config.latency:
+            time.sleep(config.latency)
+        if self.server.in_burst():
+            return 429, self._reply(429, extra={"Retry-After": "1"})
+        if config.error_rate and self.server.roll() < config.error_rate:
+            return 500, self._reply(500)
+        data = self.server.image
+        value = self.headers.get("Range")
+        if value and value.startswith("bytes="):
+            first, _, last = value[6:].partition("-")
+            first = int(first or 0)
+            last = min(int(last), len(data) - 1) if last else len(data) - 1
+            if first >= len(data):
+                return 416, self._reply(416, extra={"Content-Range": f"bytes */{len(data)}"})
+            extra = {"Content-Type": "image/jpeg", "Content-Range": f"bytes {first}-{last}/{len(data)}"}
+            return 206, self._reply(206, data[first:last + 1], extra)
+        return 200, self._reply(200, data, {"Content-Type": "image/jpeg"})
+
+
+class CDNServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, config, host="127.0.0.1", port=0):
+        super().__init__((host, port), CDNHandler)
+        self.config = config
+        self.image = synthetic_jpeg(config.image_kb * 1024, seed=config.seed)
+        self.started = time.monotonic()
+        self._rng = random.Random(config.seed)
+        self._lock = threading.Lock()
+        self.requests = []
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def roll(self):
+        with self._lock:
+            return self._rng.random()
+
+    def in_burst(self):
+        config = self.config
+        if not config.burst_every or not config.burst_length:
+            return False
+        return (time.monotonic() - self.started) % config.burst_every < config.burst_length
+
+    def record(self, seconds, status, size):
+        with self._lock:
+            self.requests.append((seconds, status, size))
+
+    def reset(self):
+        """清空请求记录，429突发的周期从现在重新计算"""
+        with self._lock:
+            self.requests = []
+            self._rng = random.Random(self.config.seed)
+            self.started = time.monotonic()
+
+    def stats(self):
+        with self._lock:
+            requests = list(self.requests)
+        statuses = {}
+        for _, status, _ in requests:
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+        return {"requests": len(requests), "statuses": statuses,
+                "latencies": sorted(seconds for seconds, _, _ in requests)}
+
+
+def start_server(config, host="127.0.0.1", port=0):
+    """在后台线程启动服务，返回CDNServer，base_url为访问地址"""
+    server = CDNServer(config, host, port)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    server = CDNServer(CDNConfig(), port=8800)
+    print(server.base_url + "/img/1.jpg")
+    server.serve_forever()
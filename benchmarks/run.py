@@ -0,0 +1,260 @@
+"""
+下载引擎基准测试
+在本地模拟CDN（cdn_server.py）上依次运行各个下载路径，统计 图片/秒、MB/秒、服务端p50/p99耗时和峰值内存，输出json
+每个用例在单独的子进程中运行，峰值内存（ru_maxrss）互不影响；多进程引擎的子进程一并统计
+
+    python benchmarks/run.py --output result.json
+    python benchmarks/run.py --compare baseline.json            # 和保存的结果对比，有退化时返回1
+    python benchmarks/run.py --cases async,multi_download --images 500 --error-rate 0.05 --burst-every 5
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import resource
+import tempfile
+import subprocess
+import importlib.util
+from multiprocessing.pool import ThreadPool
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "search_engine"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from cdn_server import CDNConfig, start_server
+
+# 指标名 -> 数值越大越好
+METRICS = {
+    "images_per_s": True,
+    "mb_per_s": True,
+    "p50_ms": False,
+    "p99_ms": False,
+    "peak_rss_mb": False,
+}
+
+
+def load_module(name, path):
+    """按路径加载脚本，各目录下有同名的scraper.py"""
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def case_multi_download(urls, workdir, args):
+    from multi_download import multi_start
+    multi_start(workdir, urls, "bench", pool_num=args.processes, max_threads=args.threads)
+
+
+def case_async(urls, workdir, args):
+    from async_download import async_start
+    async_start(workdir, urls, "bench", concurrency=args.concurrency)
+
+
+def case_download_uri(urls, workdir, args):
+    general = load_module("flickr_general", os.path.join(ROOT, "Flickr", "utils", "general.py"))
+    from common.ledger import DownloadLedger, ledger_path
+
+    with DownloadLedger(ledger_path(workdir)) as ledger:
+        def fetch(url):
+            try:
+                return general.download_uri(url, workdir, ledger=ledger)
+            except Exception:
+                return False
+
+        for _ in ThreadPool(args.threads).imap_unordered(fetch, urls):
+            pass
+
+
+class FakeElement:
+    """只实现download_batch用到的部分的selenium元素"""
+
+    tag_name = "img"
+
+    def __init__(self, src):
+        self.src = src
+
+    def get_attribute(self, name):
+        return self.src if name == "src" else None
+
+
+def case_download_batch(urls, workdir, args):
+    scraper = load_module("eyeem_scraper", os.path.join(ROOT, "eyeem", "scraper.py"))
+    from common.batch import PageDownloader
+
+    # 不启动浏览器，只设置download_batch需要的属性
+    downloader = scraper.EyeemDownloader.__new__(scraper.EyeemDownloader)
+    downloader.download_dir = workdir
+    downloader.downloaded = 0
+    downloader.pbar = None
+    downloader.loader = PageDownloader(workdir, {}, args.threads)
+    page = 50
+    for i in range(0, len(urls), page):
+        downloader.download_batch([FakeElement(url) for url in urls[i:i + page]])
+    downloader.loader.finish()
+    downloader.loader.close()
+
+
+CASES = {
+    "multi_download": case_multi_download,
+    "async": case_async,
+    "download_uri": case_download_uri,
+    "download_batch": case_download_batch,
+}
+
+
+def count_images(workdir):
+    """统计下载完成的图片数和字节数，不算.part和台账"""
+    images, size = 0, 0
+    for root, _, files in os.walk(workdir):
+        for name in files:
+            if name.endswith(".jpg") and not name.startswith("."):
+                images += 1
+                size += os.path.getsize(os.path.join(root, name))
+    return images, size
+
+
+def peak_rss_mb():
+    """本进程和已结束子进程中的最大常驻内存，Linux下ru_maxrss单位为KB"""
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    if sys.platform == "darwin":
+        peak /= 1024
+    return round(peak / 1024, 1)
+
+
+def run_child(args):
+    """子进程：运行一个用例，把结果写入args.result"""
+    urls = [f"{args.base_url}/img/{i}.jpg" for i in range(args.images)]
+    start = time.perf_counter()
+    CASES[args.child](urls, args.workdir, args)
+    seconds = time.perf_counter() - start
+    images, size = count_images(args.workdir)
+    with open(args.result, "w") as f:
+        json.dump({"seconds": seconds, "images": images, "bytes": size, "peak_rss_mb": peak_rss_mb()}, f)
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+def run_case(name, server, args):
+    workdir = tempfile.mkdtemp(prefix=f"bench_{name}_") + "/"
+    result_path = os.path.join(workdir, "result.json")
+    command = [sys.executable, os.path.abspath(__file__), "--child", name, "--base-url", server.base_url,
+               "--workdir", workdir, "--result", result_path, "--images", str(args.images),
+               "--threads", str(args.threads), "--processes", str(args.processes),
+               "--concurrency", str(args.concurrency)]
+    server.reset()
+    output = None if args.verbose else subprocess.DEVNULL
+    try:
+        completed = subprocess.run(command, stdout=output, stderr=output if not args.verbose else None,
+                                   timeout=args.timeout)
+        if completed.returncode != 0 or not os.path.exists(result_path):
+            return {"error": f"exit code {completed.returncode}"}
+        with open(result_path) as f:
+            child = json.load(f)
+    except subprocess.TimeoutExpired:
+        return {"error": f"timeout after {args.timeout}s"}
+    finally:
+        stats = server.stats()
+        shutil.rmtree(workdir, ignore_errors=True)
+    latencies = stats["latencies"]
+    seconds = child["seconds"]
+    return {
+        "images": child["images"],
+        "seconds": round(seconds, 3),
+        "images_per_s": round(child["images"] / seconds, 2),
+        "mb_per_s": round(child["bytes"] / seconds / 1024 / 1024, 2),
+        "p50_ms": None if not latencies else round(percentile(latencies, 0.5) * 1000, 2),
+        "p99_ms": None if not latencies else round(percentile(latencies, 0.99) * 1000, 2),
+        "peak_rss_mb": child["peak_rss_mb"],
+        "requests": stats["requests"],
+        "statuses": stats["statuses"],
+    }
+
+
+def compare(current, baseline, threshold):
+    """逐项对比，变差超过threshold比例的记为退化，返回退化的个数"""
+    regressions = 0
+    if baseline.get("server") != current["server"] or baseline.get("images") != current["images"]:
+        print("注意：基线的服务端配置或图片数与本次不同，对比结果仅供参考")
+    for name, result in current["cases"].items():
+        base = baseline.get("cases", {}).get(name)
+        if not base or "error" in base or "error" in result:
+            print(f"{name}: 无法对比")
+            continue
+        for metric, higher_better in METRICS.items():
+            old, new = base.get(metric), result.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            worse = -change if higher_better else change
+            flag = "退化" if worse > threshold else ""
+            regressions += bool(flag)
+            print(f"{name:16s} {metric:14s} {old:>10} -> {new:>10} {change:+.1%} {flag}")
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="下载引擎离线基准测试")
+    parser.add_argument("--cases", default=",".join(CASES), help="逗号分隔的用例名")
+    parser.add_argument("--images", type=int, default=300)
+    parser.add_argument("--image-kb", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.02, help="每个请求的服务端延迟（秒）")
+    parser.add_argument("--bandwidth", type=int, default=0, help="单连接带宽（字节/秒），0为不限")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="随机500的比例")
+    parser.add_argument("--burst-every", type=float, default=0, help="429突发的周期（秒）")
+    parser.add_argument("--burst-length", type=float, default=0.5, help="每次429突发持续的秒数")
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--timeout", type=float, default=600)
+    parser.add_argument("--output", help="结果json的保存路径")
+    parser.add_argument("--compare", help="基线结果json，对比后有退化时返回1")
+    parser.add_argument("--threshold", type=float, default=0.1, help="对比时允许变差的比例")
+    parser.add_argument("--verbose", action="store_true", help="显示用例自身的输出")
+    # 以下参数由父进程传给子进程
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--base-url", help=argparse.SUPPRESS)
+    parser.add_argument("--workdir", help=argparse.SUPPRESS)
+    parser.add_argument("--result", help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.child:
+        run_child(args)
+        return 0
+    config = CDNConfig(image_kb=args.image_kb, latency=args.latency, bandwidth=args.bandwidth,
+                       error_rate=args.error_rate, burst_every=args.burst_every,
+                       burst_length=args.burst_length if args.burst_every else 0)
+    server = start_server(config)
+    report = {"server": config.to_dict(), "images": args.images, "threads": args.threads,
+              "processes": args.processes, "concurrency": args.concurrency, "cases": {}}
+    for name in args.cases.split(","):
+        if name not in CASES:
+            print(f"未知用例: {name}")
+            continue
+        print(f"运行 {name} ...", flush=True)
+        report["cases"][name] = run_case(name, server, args)
+        print(json.dumps(report["cases"][name], ensure_ascii=False), flush=True)
+    server.shutdown()
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(report, baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,298 @@
+"""
+按域名自适应的下载并发（AIMD）
+每个域名有一个并发窗口：请求正常且延迟不高时窗口加性增长（每完成一窗口的请求约+1），
+遇到429、5xx或超时时窗口乘性减半，一个延迟周期内只减一次
+异步代码用async_slot()，windows()返回各域名当前的窗口大小
+窗口上限由调用方的单域名并发上限决定，用make_controller(per_host)创建
+线程池下载用HostDispatcher：窗口已满或还没到限速时间的域名的任务排队，不占用线程，其他域名照常下载
+"""
+import time
+import socket
+import asyncio
+import threading
+from collections import deque
+from urllib.parse import urlsplit
+from .retry import status_of
+from .ratelimit import get_limiter
+
+
+def is_congestion(exc=None, status=None):
+    """429、5xx和超时视为对方过载"""
+    if exc is not None and status is None:
+        status = status_of(exc)
+    if status is not None and (status == 429 or status >= 500):
+        return True
+    if exc is not None:
+        if isinstance(exc, (TimeoutError, asyncio.TimeoutError, socket.timeout)):
+            return True
+        # requests的ConnectTimeout/ReadTimeout，aiohttp的ServerTimeoutError等
+        if "Timeout" in type(exc).__name__:
+            return True
+    return False
+
+
+class HostWindow:
+    def __init__(self, initial):
+        self.window = float(initial)
+        self.in_flight = 0
+        self.latency = None  # 延迟的指数滑动平均
+        self.last_decrease = 0.0
+
+
+class AIMDController:
+    def __init__(self, initial=4, minimum=1, maximum=64, increase=1.0, decrease=0.5, latency_limit=5.0):
+        """
+        initial/minimum/maximum: 单个域名窗口的初始值、下限和上限
+        increase: 每完成一窗口请求窗口增加的数量
+        decrease: 过载时窗口乘以的系数
+        latency_limit: 平均延迟超过该秒数时窗口不再增长
+        """
+        self.initial = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_limit = latency_limit
+        self._hosts = {}
+        self._cond = threading.Condition()
+        self._async_waiters = {}
+
+    @staticmethod
+    def host_of(url):
+        return (urlsplit(url).hostname or "").lower()
+
+    def _host(self, host):
+        if host not in self._hosts:
+            self._hosts[host] = HostWindow(self.initial)
+        return self._hosts[host]
+
+    def try_acquire(self, host):
+        with self._cond:
+            state = self._host(host)
+            if state.in_flight < int(state.window):
+                state.in_flight += 1
+                return True
+            return False
+
+    def acquire(self, host):
+        with self._cond:
+            state = self._host(host)
+            while state.in_flight >= int(state.window):
+                self._cond.wait()
+            state.in_flight += 1
+
+    async def acquire_async(self, host):
+        loop = asyncio.get_running_loop()
+        while not self.try_acquire(host):
+            future = loop.create_future()
+            with self._cond:
+                state = self._host(host)
+                if state.in_flight < int(state.window):
+                    continue
+                self._async_waiters.setdefault(host, []).append(future)
+            await future
+
+    def cancel(self, host):
+        """退还try_acquire占到、但没有发出请求的名额，不影响窗口"""
+        with self._cond:
+            state = self._host(host)
+            state.in_flight = max(state.in_flight - 1, 0)
+            self._cond.notify_all()
+            waiters = self._async_waiters.pop(host, [])
+        for future in waiters:
+            future.get_loop().call_soon_threadsafe(_resolve, future)
+
+    def release(self, host, congested=False, latency=None):
+        """一个请求结束，congested表示遇到了429/5xx/超时"""
+        now = time.monotonic()
+        with self._cond:
+            state = self._host(host)
+            state.in_flight = max(state.in_flight - 1, 0)
+            if latency is not None:
+                state.latency = latency if state.latency is None else state.latency * 0.8 + latency * 0.2
+            if congested:
+                # 同一批过载请求只减一次窗口
+                if now - state.last_decrease > max(state.latency or 0, 1.0):
+                    state.window = max(self.minimum, state.window * self.decrease)
+                    state.last_decrease = now
+            elif state.latency is None or state.latency <= self.latency_limit:
+                state.window = min(self.maximum, state.window + self.increase / state.window)
+            self._cond.notify_all()
+            waiters = self._async_waiters.pop(host, [])
+        for future in waiters:
+            future.get_loop().call_soon_threadsafe(_resolve, future)
+
+    def windows(self):
+        """各域名当前的并发窗口和在途请求数"""
+        with self._cond:
+            return {host: {"window": round(state.window, 2), "in_flight": state.in_flight,
+                           "latency": None if state.latency is None else round(state.latency, 3)}
+                    for host, state in self._hosts.items()}
+
+    def async_slot(self, url):
+        return _AsyncSlot(self, self.host_of(url))
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class _Slot:
+    """
+    占用一个并发名额，退出时按是否出现异常/状态码反馈给控制器
+    held为True表示名额已经用try_acquire占到，进入时不再等待
+    """
+
+    def __init__(self, controller, host, held=False):
+        self.controller = controller
+        self.host = host
+        self.held = held
+        self.status = None
+        self.start = None
+
+    def __enter__(self):
+        if not self.held:
+            self.controller.acquire(self.host)
+        self.start = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        congested = is_congestion(exc, self.status)
+        self.controller.release(self.host, congested, time.monotonic() - self.start)
+        return False
+
+
+class _AsyncSlot(_Slot):
+    async def __aenter__(self):
+        await self.controller.acquire_async(self.host)
+        self.start = time.monotonic()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return self.__exit__(exc_type, exc, tb)
+
+
+class HostDispatcher:
+    """
+    把下载任务交给线程池，线程不会停在某个域名的并发窗口或限速上
+    域名窗口有空位、令牌桶也有令牌时先占名额再提交；否则按域名排队，
+    同域名的任务结束、名额释放，或到了限速允许的时间后再提交
+    run(url, payload)在占着名额的线程里执行，抛出的异常照常反馈给控制器，再交给on_error(url, payload, exc)
+    limiter: common.ratelimit.HostRateLimiter，None时用进程内共用的限速器
+    """
+
+    def __init__(self, executor, run, on_error=None, controller=None, limiter=None):
+        self.executor = executor
+        self.run = run
+        self.on_error = on_error
+        self.controller = controller or get_controller()
+        self.limiter = limiter or get_limiter()
+        self.active = 0
+        self.deferred = 0
+        self._waiting = {}
+        # 各域名等待限速时已经安排的定时器的到期时间
+        self._timers = {}
+        self._cond = threading.Condition()
+
+    def __len__(self):
+        """已提交未结束和排队中的任务数"""
+        with self._cond:
+            return self.active + self.deferred
+
+    def submit(self, url, payload=None):
+        host = self.controller.host_of(url)
+        with self._cond:
+            # 同域名已有排队的任务时排在后面，保持先来先下
+            self._waiting.setdefault(host, deque()).append((url, payload))
+            self.deferred += 1
+        self.pump(host)
+
+    def _task(self, host, url, payload):
+        try:
+            with _Slot(self.controller, host, held=True):
+                self.run(url, payload)
+        except Exception as e:
+            if self.on_error is None:
+                raise
+            self.on_error(url, payload, e)
+        finally:
+            with self._cond:
+                self.active -= 1
+                self._cond.notify_all()
+            self.pump(host)
+
+    def _schedule(self, host, delay):
+        """限速时间到后再pump该域名，同一域名只保留最早的一个定时器"""
+        due = time.monotonic() + delay
+        with self._cond:
+            if self._timers.get(host, float("inf")) <= due:
+                return
+            self._timers[host] = due
+        timer = threading.Timer(delay, self._on_timer, args=(host, due))
+        timer.daemon = True
+        timer.start()
+
+    def _on_timer(self, host, due):
+        with self._cond:
+            if self._timers.get(host) == due:
+                del self._timers[host]
+        self.pump(host)
+
+    def pump(self, host=None):
+        """把排队的任务按空出来的名额和令牌提交，host为None时检查所有域名"""
+        started = []
+        delays = {}
+        with self._cond:
+            hosts = [host] if host is not None else list(self._waiting)
+            for name in hosts:
+                waiting = self._waiting.get(name)
+                while waiting and self.controller.try_acquire(name):
+                    # 先占名额再取令牌，取不到令牌时退还名额，不在线程里等待限速
+                    delay = self.limiter.try_take(waiting[0][0])
+                    if delay > 0:
+                        self.controller.cancel(name)
+                        delays[name] = delay
+                        break
+                    started.append((name,) + waiting.popleft())
+                    self.deferred -= 1
+                    self.active += 1
+                if not waiting:
+                    self._waiting.pop(name, None)
+        for name, delay in delays.items():
+            self._schedule(name, delay)
+        for name, url, payload in started:
+            self.executor.submit(self._task, name, url, payload)
+
+    def wait_below(self, limit, timeout=None):
+        """阻塞到任务数少于limit，返回是否等到"""
+        with self._cond:
+            return self._cond.wait_for(lambda: self.active + self.deferred < limit, timeout)
+
+    def join(self):
+        """等所有任务（含排队的）结束"""
+        while True:
+            self.pump()
+            with self._cond:
+                if not self.active and not self.deferred:
+                    return
+                self._cond.wait(0.5)
+
+
+_controller = None
+_controller_lock = threading.Lock()
+
+
+def make_controller(per_host):
+    """单个域名的窗口不超过per_host，从上限的四分之一开始增长"""
+    per_host = max(1, per_host)
+    return AIMDController(initial=max(1, per_host // 4), maximum=per_host)
+
+
+def get_controller():
+    """进程内共用的并发控制器，没有指定控制器的HostDispatcher使用它"""
+    global _controller
+    with _controller_lock:
+        if _controller is None:
+            _controller = AIMDController()
+        return _controller
@@ -0,0 +1,92 @@
+"""
+按页下载图片的共用流程，eyeem、freepik、istock的Selenium下载器每翻一页调用一次download_page
+台账中已完成的链接跳过；单个域名的并发由AIMD窗口决定，窗口满或还没到限速时间的链接排队，不占线程；
+永久失败直接记入台账，临时失败和限流按退避时间排队，到期后和下一页一起下载，翻页结束后finish做完剩下的重试
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from .transport import get_session, pool_stats
+from .ledger import DownloadLedger, ledger_path, STATUS_DONE, STATUS_FAILED
+from .fetch import download_to
+from .aimd import make_controller, HostDispatcher
+from .retry import RetryScheduler, status_of
+
+
+class PageDownloader:
+    def __init__(self, download_dir, headers=None, max_workers=32, timeout=(10, 30)):
+        """
+        download_dir: 图片和台账所在的目录
+        max_workers: 下载线程数上限，单个域名的实际并发由AIMD控制器调整
+        """
+        self.download_dir = download_dir
+        self.headers = headers or {}
+        self.max_workers = max_workers
+        self.timeout = timeout
+        # 进度条，设置后每成功一张update(1)一次
+        self.progress = None
+        self.downloaded = 0
+        # 进程内共用连接池
+        self.session = get_session(pool_size=max_workers)
+        self.ledger = DownloadLedger(ledger_path(download_dir))
+        self.retry = RetryScheduler()
+        self.controller = make_controller(max_workers)
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _succeeded(self):
+        with self._lock:
+            self.downloaded += 1
+        if self.progress is not None:
+            self.progress.update(1)
+
+    def _run(self, url, filename):
+        # 先写.part再改名，中断后下次运行可用Range续传
+        size, sha1, status = download_to(url, filename, session=self.session, headers=self.headers,
+                                         timeout=self.timeout)
+        self.ledger.record(url, STATUS_DONE, size, sha1, filename, status)
+        self.retry.forget(url)
+        self._succeeded()
+
+    def _on_error(self, url, filename, exc):
+        kind, delay = self.retry.schedule(url, exc, payload=filename)
+        if delay is None:
+            self.ledger.record(url, STATUS_FAILED, http_status=status_of(exc))
+        print(f"\n下载文件失败: {exc}, {kind}, URL: {url}")
+
+    def download_page(self, tasks):
+        """
+        下载一页的[(链接, 文件名)]，之前失败、已到重试时间的链接一起下载
+        返回本次成功的张数，台账中已完成的也算成功
+        """
+        before = self.downloaded
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            dispatcher = HostDispatcher(executor, self._run, self._on_error, controller=self.controller)
+            for url, filename in self.retry.pop_all_due():
+                dispatcher.submit(url, filename)
+            for url, filename in tasks:
+                if self.ledger.is_done(url):
+                    self._succeeded()
+                    continue
+                dispatcher.submit(url, filename)
+            dispatcher.join()
+        return self.downloaded - before
+
+    def finish(self):
+        """翻页结束后把剩下的重试做完，返回其中成功的张数"""
+        before = self.downloaded
+        while len(self.retry):
+            self.retry.wait_next()
+            self.download_page(())
+        self.ledger.flush()
+        return self.downloaded - before
+
+    def summary(self):
+        return f"连接复用统计: {pool_stats()}，并发窗口: {self.controller.windows()}"
+
+    def close(self):
+        self.ledger.close()
@@ -0,0 +1,113 @@
+"""
+浏览器采集时的资源屏蔽
+采集只读取DOM里的src/href，缩略图、视频、字体和统计脚本都不需要真的下载
+pyppeteer用请求拦截按资源类型和域名中止请求；Selenium用CDP的Network.setBlockedURLs按url通配符屏蔽
+页面渲染结果列表需要的文档、脚本、xhr和样式默认都放行，img的src属性不受影响，只是不再加载图片内容
+"""
+import asyncio
+from urllib.parse import urlsplit
+
+# 统计、广告和监控脚本的域名，按后缀匹配
+TRACKER_HOSTS = ("google-analytics.com", "googletagmanager.com", "googleadservices.com", "googlesyndication.com",
+                 "doubleclick.net", "adservice.google.com", "hm.baidu.com", "cpro.baidu.com", "pos.baidu.com",
+                 "cnzz.com", "51.la", "facebook.net", "connect.facebook.com", "hotjar.com", "scorecardresearch.com",
+                 "criteo.com", "criteo.net", "bat.bing.com", "clarity.ms", "nr-data.net", "sentry.io", "segment.io",
+                 "optimizely.com", "quantserve.com", "taboola.com", "outbrain.com")
+
+# pyppeteer的resourceType和对应的扩展名（Selenium只能按url匹配）
+RESOURCE_EXTENSIONS = {
+    "image": ("jpg", "jpeg", "png", "gif", "webp", "avif", "bmp", "ico", "svg"),
+    "media": ("mp4", "webm", "m3u8", "m4s", "mp3", "ogg", "mov"),
+    "font": ("woff", "woff2", "ttf", "otf", "eot"),
+    "stylesheet": ("css",),
+}
+
+
+class ResourcePolicy:
+    def __init__(self, images=True, media=True, fonts=True, trackers=True, stylesheets=False, extra_patterns=()):
+        """
+        各项为True表示屏蔽该类资源
+        stylesheets默认放行：部分站点的结果列表靠样式计算尺寸，触发懒加载和下一页
+        extra_patterns: 额外屏蔽的url通配符，格式同CDP的Network.setBlockedURLs，如"*://*.example.com/ads/*"
+        """
+        self.types = set()
+        for name, enabled in (("image", images), ("media", media), ("font", fonts), ("stylesheet", stylesheets)):
+            if enabled:
+                self.types.add(name)
+        self.trackers = trackers
+        self.extra_patterns = tuple(extra_patterns)
+
+    @property
+    def images(self):
+        return "image" in self.types
+
+    def _is_tracker(self, url):
+        host = (urlsplit(url).hostname or "").lower()
+        return any(host == tracker or host.endswith("." + tracker) for tracker in TRACKER_HOSTS)
+
+    def blocks(self, url, resource_type=None):
+        """请求是否应被屏蔽，resource_type为pyppeteer的request.resourceType"""
+        if resource_type in self.types:
+            return True
+        if self.trackers and self._is_tracker(url):
+            return True
+        path = urlsplit(url).path.lower()
+        extension = path.rsplit(".", 1)[-1] if "." in path.rsplit("/", 1)[-1] else ""
+        return any(extension in RESOURCE_EXTENSIONS[name] for name in self.types)
+
+    def url_patterns(self):
+        """Network.setBlockedURLs用的通配符列表"""
+        patterns = []
+        for name in sorted(self.types):
+            for extension in RESOURCE_EXTENSIONS[name]:
+                patterns += [f"*.{extension}", f"*.{extension}?*"]
+        if self.trackers:
+            for tracker in TRACKER_HOSTS:
+                patterns += [f"*://{tracker}/*", f"*://*.{tracker}/*"]
+        return patterns + list(self.extra_patterns)
+
+
+async def block_page_resources(page, policy):
+    """
+    给pyppeteer页面打开请求拦截，按policy中止请求
+    返回{"blocked": 个数, "allowed": 个数}，在页面使用过程中持续更新
+    """
+    stats = {"blocked": 0, "allowed": 0}
+
+    async def intercept(request):
+        try:
+            if policy.blocks(request.url, request.resourceType):
+                stats["blocked"] += 1
+                await request.abort()
+            else:
+                stats["allowed"] += 1
+                await request.continue_()
+        except Exception:
+            # 页面已关闭或请求已被处理
+            pass
+
+    await page.setRequestInterception(True)
+    page.on("request", lambda request: asyncio.ensure_future(intercept(request)))
+    return stats
+
+
+def block_driver_resources(driver, policy):
+    """
+    用CDP给Selenium的Chrome屏蔽资源，设置对之后的所有页面有效，policy为None时不屏蔽
+    webdriver.Chrome自带execute_cdp_cmd；webdriver.Remote连接chromedriver时先注册executeCdpCommand命令
+    """
+    if policy is None:
+        return []
+
+    def cdp(cmd, params):
+        if hasattr(driver, "execute_cdp_cmd"):
+            return driver.execute_cdp_cmd(cmd, params)
+        commands = driver.command_executor._commands
+        if "executeCdpCommand" not in commands:
+            commands["executeCdpCommand"] = ("POST", "/session/$sessionId/goog/cdp/execute")
+        return driver.execute("executeCdpCommand", {"cmd": cmd, "params": params})["value"]
+
+    patterns = policy.url_patterns()
+    cdp("Network.enable", {})
+    cdp("Network.setBlockedURLs", {"urls": patterns})
+    return patterns
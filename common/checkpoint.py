@@ -0,0 +1,91 @@
+"""
+分页采集的断点
+用位图记录已经完成的页，保存在关键词目录下；中断后重新运行只请求还没完成的页
+页写入清单之后才标记完成，崩溃时最多重复请求最近几页，清单本身会去重
+"""
+import os
+import json
+import time
+import base64
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+def checkpoint_path(dir_path, engine, keyword):
+    return os.path.join(dir_path, f"pages_{engine}_{keyword}.ckpt")
+
+
+class PageCheckpoint:
+    def __init__(self, path, total_pages, save_every=10, save_interval=5.0):
+        """
+        total_pages: 总页数，页码从1开始；和上次保存的总页数不同时保留重叠部分
+        save_every/save_interval: 标记多少页或隔多少秒写一次文件
+        """
+        self.path = path
+        self.total_pages = total_pages
+        self.save_every = save_every
+        self.save_interval = save_interval
+        self.bitmap = bytearray((total_pages + 8) // 8)
+        self._lock = threading.Lock()
+        self._unsaved = 0
+        self._saved_at = time.monotonic()
+        if os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    saved = base64.b64decode(json.load(f)["bitmap"])
+                size = min(len(saved), len(self.bitmap))
+                self.bitmap[:size] = saved[:size]
+            except (ValueError, KeyError):
+                print(f"断点文件损坏，从头开始: {path}")
+
+    def __len__(self):
+        """已完成的页数"""
+        return sum(self.done(page) for page in range(1, self.total_pages + 1))
+
+    def done(self, page):
+        return bool(self.bitmap[page >> 3] & (1 << (page & 7)))
+
+    def pending(self, start=1):
+        """start页之后还没完成的页码"""
+        return [page for page in range(start, self.total_pages + 1) if not self.done(page)]
+
+    def mark(self, page):
+        with self._lock:
+            self.bitmap[page >> 3] |= 1 << (page & 7)
+            self._unsaved += 1
+            if self._unsaved >= self.save_every or time.monotonic() - self._saved_at >= self.save_interval:
+                self._save()
+
+    def _save(self):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"total_pages": self.total_pages, "bitmap": base64.b64encode(bytes(self.bitmap)).decode()}, f)
+        os.replace(tmp_path, self.path)
+        self._unsaved = 0
+        self._saved_at = time.monotonic()
+
+    def save(self):
+        with self._lock:
+            self._save()
+
+
+def run_pages(pages, fetch_page, checkpoint, workers=4):
+    """
+    用workers个线程分担pages，fetch_page(page)返回True表示该页已完成并写入清单
+    返回本次完成的页数，结束时保存断点
+    """
+    def run(page):
+        try:
+            ok = fetch_page(page)
+        except Exception as e:
+            print(e, f"第{page}页出错")
+            return False
+        if ok:
+            checkpoint.mark(page)
+        return bool(ok)
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return sum(executor.map(run, pages))
+    finally:
+        checkpoint.save()
@@ -0,0 +1,49 @@
+"""
+搜索结果页的异步抓取
+各搜索引擎的采集协程共用：限制同时在途的请求数，按域名限速，临时失败按退避重试
+"""
+import asyncio
+import contextlib
+from .ratelimit import get_limiter
+from .retry import classify, PERMANENT, status_of
+
+
+class Blocked(IOError):
+    """页面提示访问异常，按限流处理"""
+    status = 429
+
+
+@contextlib.asynccontextmanager
+async def session_scope(session=None, **kwargs):
+    """传入session时直接使用，由调用方负责关闭；否则用kwargs新建一个，用完关闭"""
+    if session is not None:
+        yield session
+        return
+    import aiohttp
+    async with aiohttp.ClientSession(**kwargs) as session:
+        yield session
+
+
+async def fetch_text(session, url, semaphore, retry, headers=None, blocked_marker=None, **kwargs):
+    """
+    取一页文本，放弃时返回None
+    retry: common.retry.RetryScheduler，只用它的次数和退避参数
+    blocked_marker: 页面中出现该文字时视为被限流
+    """
+    for attempt in range(1, retry.max_attempts + 1):
+        async with semaphore:
+            await get_limiter().wait_async(url)
+            try:
+                async with session.get(url, headers=headers, **kwargs) as response:
+                    response.raise_for_status()
+                    text = await response.text()
+                if blocked_marker and blocked_marker in text:
+                    raise Blocked(blocked_marker)
+                return text
+            except Exception as e:
+                kind = classify(e)
+                if kind == PERMANENT or attempt == retry.max_attempts:
+                    print(e, kind, status_of(e), '访问出错', url)
+                    return None
+                delay = retry.backoff(kind, attempt, e)
+        await asyncio.sleep(delay)
@@ -0,0 +1,278 @@
+"""
+可续传的流式下载
+数据先写入同目录下的.part临时文件，下载完整后再原子改名为最终文件名，中途断开不会留下看似完整的图片
+.part文件名由链接决定，和最终文件名无关，下次运行时同一个链接可以接着用Range续传
+旁边的.part.json记下源文件的ETag/Last-Modified和总大小，续传时带If-Range并核对Content-Range，源文件变了就从头下载
+响应体通过readinto读进每个线程复用的预分配缓冲区，攒满一块再写盘，单个下载占用的内存与图片大小无关
+"""
+import os
+import json
+import hashlib
+import threading
+from .urls import canonical_url
+from .transport import get_session
+
+
+# 单次写盘的字节数
+BUFFER_SIZE = 256 * 1024
+
+_local = threading.local()
+
+
+class IncompleteDownload(IOError):
+    """收到的字节数少于Content-Length，.part文件保留用于续传"""
+
+
+def get_buffer(size=BUFFER_SIZE):
+    """当前线程复用的缓冲区，同一线程内的下载依次使用，不会同时读写"""
+    buffer = getattr(_local, "buffer", None)
+    if buffer is None or len(buffer) != size:
+        buffer = _local.buffer = bytearray(size)
+    return buffer
+
+
+class BufferPool:
+    """
+    异步下载用的缓冲区池，同一事件循环里的下载交替执行，不能共用一块缓冲区
+    用完放回池中，同时进行的下载数多大，最多就分配多少块
+    """
+
+    def __init__(self, size=64 * 1024):
+        self.size = size
+        self._free = []
+
+    def acquire(self):
+        return self._free.pop() if self._free else bytearray(self.size)
+
+    def release(self, buffer):
+        self._free.append(buffer)
+
+
+def copy_stream(raw, handle, sha1=None, buffer=None):
+    """
+    把urllib3的原始响应流写入handle，返回写入的字节数
+    raw.readinto直接填充缓冲区，填满或读完才写一次盘，避免逐块生成bytes对象
+    """
+    view = memoryview(buffer or get_buffer())
+    size = len(view)
+    total = 0
+    while True:
+        filled = 0
+        while filled < size:
+            n = raw.readinto(view[filled:])
+            if not n:
+                break
+            filled += n
+        if not filled:
+            return total
+        block = view[:filled]
+        handle.write(block)
+        if sha1 is not None:
+            sha1.update(block)
+        total += filled
+        if filled < size:
+            return total
+
+
+async def copy_stream_async(content, handle, sha1=None, buffer=None):
+    """
+    aiohttp版本，content为response.content
+    收到的数据先拷进缓冲区，攒满一块再写盘
+    """
+    view = memoryview(buffer or get_buffer())
+    size = len(view)
+    total = 0
+    filled = 0
+    while True:
+        data = await content.readany()
+        if not data:
+            break
+        start = 0
+        while start < len(data):
+            n = min(size - filled, len(data) - start)
+            view[filled:filled + n] = data[start:start + n]
+            filled += n
+            start += n
+            if filled == size:
+                handle.write(view)
+                if sha1 is not None:
+                    sha1.update(view)
+                total += filled
+                filled = 0
+    if filled:
+        block = view[:filled]
+        handle.write(block)
+        if sha1 is not None:
+            sha1.update(block)
+        total += filled
+    return total
+
+
+def part_path_for(file_path, url):
+    """链接对应的.part文件，与最终文件在同一目录下保证改名是原子操作"""
+    digest = hashlib.sha1(canonical_url(url).encode("utf-8")).hexdigest()[:20]
+    return os.path.join(os.path.dirname(file_path) or ".", f".{digest}.part")
+
+
+def hash_file(path, sha1, chunk_size=1024 * 1024):
+    with open(path, "rb") as f:
+        while True:
+            block = f.read(chunk_size)
+            if not block:
+                break
+            sha1.update(block)
+
+
+def parse_content_range(value):
+    """bytes 100-199/200 -> (100, 200)，bytes */200 -> (None, 200)，总大小为*时为None"""
+    try:
+        unit, _, rest = value.strip().partition(" ")
+        span, total = rest.rsplit("/", 1)
+        start = None if span == "*" else int(span.split("-", 1)[0])
+        return start, None if total == "*" else int(total)
+    except (AttributeError, IndexError, ValueError):
+        return None, None
+
+
+def total_from_content_range(value):
+    """bytes 100-199/200 或 bytes */200 -> 200"""
+    return parse_content_range(value)[1]
+
+
+def resume_offset(part_path):
+    return os.path.getsize(part_path) if os.path.exists(part_path) else 0
+
+
+def response_validator(headers):
+    """可用于If-Range的校验值：强ETag，没有时用Last-Modified"""
+    etag = headers.get("ETag")
+    if etag and not etag.startswith("W/"):
+        return etag
+    return headers.get("Last-Modified")
+
+
+def _state_path(part_path):
+    return part_path + ".json"
+
+
+def write_part_state(part_path, headers, total=None):
+    """开始写.part时记下源文件的校验值和总大小，续传时据此判断源文件有没有变"""
+    state = {"validator": response_validator(headers), "total": total}
+    with open(_state_path(part_path), "w", encoding="utf-8") as f:
+        json.dump(state, f)
+
+
+def read_part_state(part_path):
+    try:
+        with open(_state_path(part_path), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def discard_part(part_path):
+    for path in (part_path, _state_path(part_path)):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def finish_part(part_path, file_path):
+    """.part完整后改名为最终文件"""
+    os.replace(part_path, file_path)
+    if os.path.exists(_state_path(part_path)):
+        os.remove(_state_path(part_path))
+
+
+def resume_headers(headers, part_path, offset):
+    """续传请求头：Range从.part末尾开始，有校验值时带If-Range，源文件变了服务器会返回完整的200"""
+    request_headers = dict(headers or {})
+    if offset:
+        request_headers["Range"] = f"bytes={offset}-"
+        validator = read_part_state(part_path).get("validator")
+        if validator:
+            request_headers["If-Range"] = validator
+    return request_headers
+
+
+RESUME_FRESH = "fresh"
+RESUME_APPEND = "append"
+RESUME_COMPLETE = "complete"
+RESUME_RESTART = "restart"
+
+
+def resume_action(status, headers, offset, part_path):
+    """
+    按续传请求的响应决定怎么处理已有的.part
+    complete: 416且总大小等于.part的大小，上次其实已经下载完整，只是没来得及改名
+    restart: 416但总大小不符，或206的起点、总大小、校验值和.part对不上，删掉.part不带Range重新请求
+    append: 206且和.part一致，接着写
+    fresh: 没有.part，或服务器返回了完整内容，从头写
+    """
+    if not offset:
+        return RESUME_FRESH
+    if status == 416:
+        return RESUME_COMPLETE if total_from_content_range(headers.get("Content-Range")) == offset else RESUME_RESTART
+    if status != 206:
+        return RESUME_FRESH
+    start, total = parse_content_range(headers.get("Content-Range"))
+    state = read_part_state(part_path)
+    validator = response_validator(headers)
+    if start != offset or (state.get("total") and total != state["total"]) \
+            or (state.get("validator") and validator and validator != state["validator"]):
+        return RESUME_RESTART
+    return RESUME_APPEND
+
+
+def fresh_total(status, headers):
+    """从头下载时的总大小，压缩传输时未知"""
+    if headers.get("Content-Encoding") not in (None, "identity"):
+        return None
+    if status == 206:
+        return total_from_content_range(headers.get("Content-Range"))
+    length = headers.get("Content-Length")
+    return int(length) if length and length.isdigit() else None
+
+
+def download_to(url, file_path, session=None, headers=None, timeout=(8, 8), buffer_size=BUFFER_SIZE):
+    """
+    下载url到file_path，返回(字节数, sha1, http状态码)
+    .part已存在时带Range和If-Range续传，服务器返回与.part一致的206才在原有数据后追加，返回200则从头下载
+    .part和源文件对不上（416总大小不符、206起点或校验值不同）时删掉.part，立即不带Range重新下载
+    """
+    session = session or get_session()
+    part_path = part_path_for(file_path, url)
+    offset = resume_offset(part_path)
+    while True:
+        sha1 = hashlib.sha1()
+        with session.get(url, headers=resume_headers(headers, part_path, offset), timeout=timeout,
+                         stream=True) as response:
+            action = resume_action(response.status_code, response.headers, offset, part_path)
+            if action == RESUME_COMPLETE:
+                hash_file(part_path, sha1)
+                finish_part(part_path, file_path)
+                return offset, sha1.hexdigest(), response.status_code
+            if action == RESUME_RESTART:
+                discard_part(part_path)
+                offset = 0
+                continue
+            response.raise_for_status()
+            if action == RESUME_APPEND:
+                mode = "ab"
+                hash_file(part_path, sha1)
+            else:
+                offset = 0
+                mode = "wb"
+                write_part_state(part_path, response.headers,
+                                 fresh_total(response.status_code, response.headers))
+            expected = response.headers.get("Content-Length")
+            # 和iter_content一样按Content-Encoding解压
+            response.raw.decode_content = True
+            with open(part_path, mode) as handle:
+                size = copy_stream(response.raw, handle, sha1, get_buffer(buffer_size))
+            status = response.status_code
+        break
+    if expected is not None and response.headers.get("Content-Encoding") in (None, "identity") \
+            and size < int(expected):
+        raise IncompleteDownload(f"收到{size}字节，应为{expected}字节: {url}")
+    finish_part(part_path, file_path)
+    return offset + size, sha1.hexdigest(), status
@@ -0,0 +1,112 @@
+"""
+下载台账
+用SQLite（WAL模式）记录每个链接的下载结果，键为规范化后的链接
+重新运行时先查台账，已经下载完成且文件还在的链接直接跳过，不再访问网络
+多个进程可以各自打开同一个台账文件，写入按批提交
+"""
+import os
+import time
+import sqlite3
+import threading
+from .urls import canonical_url
+
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+# 下载前探测发现不是图片、分辨率太小或文件太大
+STATUS_SKIPPED = "skipped"
+
+
+def ledger_path(dir_path):
+    """下载目录对应的台账文件"""
+    return os.path.join(dir_path, "download_ledger.db")
+
+
+class DownloadLedger:
+    def __init__(self, db_path, batch_size=100):
+        """batch_size: 攒够多少条记录提交一次"""
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS downloads (
+                url TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                bytes INTEGER,
+                sha1 TEXT,
+                path TEXT,
+                http_status INTEGER,
+                updated REAL
+            )
+        """)
+        self._conn.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def get(self, url):
+        """返回链接的记录（dict），没有记录时返回None"""
+        key = canonical_url(url)
+        with self._lock:
+            row = self._pending.get(key)
+            if row is None:
+                cursor = self._conn.execute(
+                    "SELECT url, status, bytes, sha1, path, http_status, updated FROM downloads WHERE url = ?", (key,))
+                row = cursor.fetchone()
+        if row is None:
+            return None
+        return dict(zip(("url", "status", "bytes", "sha1", "path", "http_status", "updated"), row))
+
+    def is_done(self, url):
+        """已经下载完成，且记录的文件仍在磁盘上"""
+        row = self.get(url)
+        if row is None or row["status"] != STATUS_DONE:
+            return False
+        return not row["path"] or os.path.exists(row["path"])
+
+    def settled(self, url):
+        """已经下载完成，或者探测时已被过滤，不需要再请求"""
+        row = self.get(url)
+        if row is not None and row["status"] == STATUS_SKIPPED:
+            return True
+        return self.is_done(url)
+
+    def record(self, url, status, size=None, sha1=None, path=None, http_status=None):
+        key = canonical_url(url)
+        with self._lock:
+            self._pending[key] = (key, status, size, sha1, path, http_status, time.time())
+            if len(self._pending) >= self.batch_size:
+                self._flush()
+
+    def _flush(self):
+        if not self._pending:
+            return
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO downloads (url, status, bytes, sha1, path, http_status, updated) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)", list(self._pending.values()))
+        self._conn.commit()
+        self._pending.clear()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def stats(self):
+        """各状态的链接数"""
+        self.flush()
+        with self._lock:
+            return dict(self._conn.execute("SELECT status, COUNT(*) FROM downloads GROUP BY status").fetchall())
+
+    def close(self):
+        with self._lock:
+            if self._conn is None:
+                return
+            self._flush()
+            self._conn.close()
+            self._conn = None
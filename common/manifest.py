@@ -0,0 +1,246 @@
+"""
+图片链接清单
+每行一条json: {"url": ..., "engine": ..., "page": ...}，采集端每页只追加新出现的链接
+文件名以.zst结尾时按zstd压缩（需要安装zstandard），每次追加写成一个独立的zstd帧
+旧版的单行json文件（{"关键词": ..., "图片数量": ..., "图片链接列表": [...]}）同样可以读取
+去重都按common.urls.dedup_key进行，缩略图、http/https、统计参数不同的等价链接只保留第一个
+已见的链接保存在common.seenset.SeenSet中，每个链接只占8字节左右
+"""
+import io
+import os
+import json
+import threading
+from .urls import dedup_key
+from .seenset import SeenSet
+
+MANIFEST_SUFFIXES = (".jsonl", ".jsonl.zst", ".txt")
+# 为True时新建的清单使用zstd压缩
+COMPRESS = False
+# 所有清单新写入的链接都会交给它，采集和下载流水线并行时由start_pic_main设置
+_default_sink = None
+
+
+def set_sink(sink):
+    """
+    设置进程内默认的sink(urls, engine)，None表示取消
+    sink在事件循环中被调用时不能阻塞；有drain协程时，ManifestWriter.drain会等待它
+    """
+    global _default_sink
+    _default_sink = sink
+
+
+def manifest_path(dir_path, engine, keyword, compress=None):
+    """关键词目录下某个搜索引擎的清单路径"""
+    compress = COMPRESS if compress is None else compress
+    return os.path.join(dir_path, f"pic_{engine}_{keyword}.jsonl" + (".zst" if compress else ""))
+
+
+class _HeadReader(io.RawIOBase):
+    """只读文件的前limit个字节"""
+
+    def __init__(self, raw, limit):
+        self.raw = raw
+        self.remaining = limit
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        view = memoryview(buffer)[:self.remaining]
+        n = self.raw.readinto(view)
+        self.remaining -= n
+        return n
+
+    def close(self):
+        self.raw.close()
+        super().close()
+
+
+def _open_read(path, limit=None):
+    """limit: 只读前limit个字节，用于读取某一时刻之前写入的内容"""
+    raw = open(path, "rb")
+    if limit is not None:
+        raw = io.BufferedReader(_HeadReader(raw, limit))
+    if path.endswith(".zst"):
+        import zstandard
+        reader = zstandard.ZstdDecompressor().stream_reader(raw, read_across_frames=True, closefd=True)
+        return io.TextIOWrapper(reader, encoding="utf-8")
+    return io.TextIOWrapper(raw, encoding="utf-8")
+
+
+def _engine_from_name(path):
+    """pic_bing_jojo.txt -> bing"""
+    name = os.path.basename(path)
+    parts = name.split("_")
+    return parts[1] if len(parts) > 2 and parts[0] == "pic" else None
+
+
+def iter_manifest(path, limit=None):
+    """
+    逐行读取清单，返回{"url", "engine", "page"}，旧版单行json按文件名推断搜索引擎
+    limit: 只读前limit个字节
+    """
+    engine = _engine_from_name(path)
+    with _open_read(path, limit) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # 写入中途被打断时最后一行可能不完整
+                continue
+            if "url" in record:
+                yield record
+            else:
+                for url in record.get("图片链接列表") or []:
+                    yield {"url": url, "engine": engine, "page": None}
+
+
+def list_manifests(dir_path):
+    """关键词目录下所有清单文件，跳过pic等子目录"""
+    result = []
+    for file_name in sorted(os.listdir(dir_path)):
+        path = os.path.join(dir_path, file_name)
+        if file_name.startswith("pic_") and file_name.endswith(MANIFEST_SUFFIXES) and os.path.isfile(path):
+            result.append(path)
+    return result
+
+
+def manifest_sizes(dir_path):
+    """目录下各清单当前的字节数，配合iter_dir_urls只读这一时刻之前写入的链接"""
+    return {path: os.path.getsize(path) for path in list_manifests(dir_path)}
+
+
+def iter_dir_urls(dir_path, sizes=None):
+    """
+    流式读取目录下所有清单，按出现顺序返回去重后的链接
+    读完后按引擎打印留下的链接数和与前面等价的重复链接数
+    sizes: manifest_sizes的结果，传入时只读其中的清单、每个只读到当时的长度，之后追加的链接不返回
+    """
+    seen = SeenSet()
+    stats = {}
+    paths = list_manifests(dir_path) if sizes is None else sorted(sizes)
+    for path in paths:
+        limit = None if sizes is None else sizes[path]
+        for record in iter_manifest(path, limit):
+            url = record["url"]
+            if not url:
+                continue
+            counts = stats.setdefault(record.get("engine") or _engine_from_name(path) or "unknown", [0, 0])
+            key = dedup_key(url)
+            if key in seen:
+                counts[1] += 1
+                continue
+            seen.add(key)
+            counts[0] += 1
+            yield url
+    for engine, (count, duplicates) in stats.items():
+        print(f"{engine}: {count}个链接, 重复{duplicates}个")
+
+
+def iter_engine_urls(dir_path, engine, keyword):
+    """读取单个搜索引擎的链接，新旧两种格式的文件都存在时一并读取"""
+    seen = SeenSet()
+    paths = [manifest_path(dir_path, engine, keyword, compress=False),
+             manifest_path(dir_path, engine, keyword, compress=True),
+             os.path.join(dir_path, f"pic_{engine}_{keyword}.txt")]
+    for path in paths:
+        if not os.path.exists(path):
+            continue
+        for record in iter_manifest(path):
+            key = dedup_key(record["url"])
+            if key not in seen:
+                seen.add(key)
+                yield record["url"]
+
+
+class ManifestWriter:
+    """
+    追加写入清单，只写入本文件中还没有的链接，seen和shared中保存的是dedup_key
+    文件已存在时先读一遍已有链接，重新运行时不会重复追加
+    add可以在多个线程中同时调用
+    sink(urls, engine)在每次写入新链接后调用，默认使用set_sink设置的全局sink
+    协程中的采集端在add之后await drain()，下游跟不上时在这里让出事件循环，不阻塞其他引擎
+    shared: 多个引擎共用的SeenSet，已被其他引擎采集到的链接不再写入本清单，也不交给sink
+    add的返回值仍按本引擎自己的结果计算；清单里原有的链接不算新链接，各引擎判断翻页是否还有新图时按本次运行见过的链接
+    """
+
+    def __init__(self, path, engine, sink=None, shared=None):
+        self.path = path
+        self.engine = engine
+        self.sink = sink
+        self.shared = shared
+        # 本引擎采集到、但其他引擎已经采集过的链接数
+        self.duplicates = 0
+        self.seen = SeenSet()
+        if os.path.exists(path):
+            for record in iter_manifest(path):
+                self.seen.add(dedup_key(record["url"]))
+        if shared is not None:
+            shared.update(self.seen)
+        self._raw = open(path, "ab")
+        self._lock = threading.Lock()
+        self._compressor = None
+        if path.endswith(".zst"):
+            import zstandard
+            self._compressor = zstandard.ZstdCompressor()
+
+    def __len__(self):
+        return len(self.seen)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def add(self, urls, page=None):
+        """追加一批链接，返回其中新出现的链接"""
+        with self._lock:
+            new_urls = []
+            keys = []
+            for url in urls:
+                if not url:
+                    continue
+                key = dedup_key(url)
+                if key not in self.seen:
+                    self.seen.add(key)
+                    new_urls.append(url)
+                    keys.append(key)
+            fresh_urls = new_urls
+            if self.shared is not None:
+                fresh_urls = []
+                for url, key in zip(new_urls, keys):
+                    # 检查和加入在SeenSet的锁内一次完成，其他线程同时往shared里加链接时不会两边都算新链接
+                    if self.shared.add(key):
+                        fresh_urls.append(url)
+                self.duplicates += len(new_urls) - len(fresh_urls)
+            if fresh_urls:
+                data = "".join(json.dumps({"url": url, "engine": self.engine, "page": page}, ensure_ascii=False) + "\n"
+                               for url in fresh_urls).encode("utf-8")
+                if self._compressor is not None:
+                    data = self._compressor.compress(data)
+                self._raw.write(data)
+                self._raw.flush()
+        # 在锁外调用，线程中的sink阻塞（下游队列已满）时不影响其他线程读取len
+        sink = self.sink or _default_sink
+        if fresh_urls and sink is not None:
+            sink(fresh_urls, self.engine)
+        return new_urls
+
+    async def drain(self):
+        """sink有drain协程时等待下游腾出空间，没有时直接返回"""
+        drain = getattr(self.sink or _default_sink, "drain", None)
+        if drain is not None:
+            await drain()
+
+    def close(self):
+        """关闭文件；和其他引擎共用链接集合时打印被其他引擎抢先采到、没有写入本清单的链接数"""
+        with self._lock:
+            if self._raw.closed:
+                return
+            self._raw.close()
+        if self.shared is not None:
+            print(f"{self.engine}: 其他引擎已采集过、未写入清单的链接{self.duplicates}个")
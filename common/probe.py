@@ -0,0 +1,197 @@
+"""
+下载前的探测
+用Range只请求开头几KB，检查Content-Type和文件头，并从JPEG/PNG/GIF/WebP/BMP的文件头解析宽高
+不是图片、分辨率太小或文件太大的链接在完整下载之前就过滤掉
+探测通过且服务器支持Range时，读到的开头直接写入.part文件，完整下载从这里接着续传，不会重复传输
+"""
+import os
+from .fetch import total_from_content_range, write_part_state
+from .transport import get_session
+
+# 探测读取的字节数，大部分JPEG的SOF段在EXIF之后，16KB以内
+PROBE_BYTES = 16 * 1024
+
+# 明确不是图片的Content-Type
+REJECT_TYPES = ("text/", "application/json", "application/javascript", "application/xml", "application/xhtml")
+
+
+def _be(data, start, end):
+    return int.from_bytes(data[start:end], "big")
+
+
+def _le(data, start, end):
+    return int.from_bytes(data[start:end], "little")
+
+
+def sniff(head):
+    """按文件头判断图片格式，不是图片返回None"""
+    if head[:3] == b"\xff\xd8\xff":
+        return "jpeg"
+    if head[:8] == b"\x89PNG\r\n\x1a\n":
+        return "png"
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return "gif"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    if head[:2] == b"BM":
+        return "bmp"
+    if head[:4] in (b"II*\x00", b"MM\x00*"):
+        return "tiff"
+    if head[4:8] == b"ftyp" and head[8:12] in (b"avif", b"avis", b"heic", b"heix", b"mif1", b"msf1"):
+        return "heif"
+    return None
+
+
+def _jpeg_size(data):
+    i = 2
+    while i + 9 <= len(data):
+        if data[i] != 0xFF:
+            i += 1
+            continue
+        marker = data[i + 1]
+        if marker == 0xFF:
+            i += 1
+            continue
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:
+            i += 2
+            continue
+        # SOF0-SOF15，C4/C8/CC不是帧头
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            return _be(data, i + 7, i + 9), _be(data, i + 5, i + 7)
+        i += 2 + _be(data, i + 2, i + 4)
+    return None
+
+
+def _webp_size(data):
+    chunk = data[12:16]
+    if chunk == b"VP8 " and len(data) >= 30:
+        return _le(data, 26, 28) & 0x3FFF, _le(data, 28, 30) & 0x3FFF
+    if chunk == b"VP8L" and len(data) >= 25:
+        bits = _le(data, 21, 25)
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    if chunk == b"VP8X" and len(data) >= 30:
+        return _le(data, 24, 27) + 1, _le(data, 27, 30) + 1
+    return None
+
+
+def image_size(head):
+    """返回(格式, 宽, 高)，解析不出宽高时宽高为None"""
+    kind = sniff(head)
+    size = None
+    if kind == "jpeg":
+        size = _jpeg_size(head)
+    elif kind == "png" and len(head) >= 24:
+        size = _be(head, 16, 20), _be(head, 20, 24)
+    elif kind == "gif" and len(head) >= 10:
+        size = _le(head, 6, 8), _le(head, 8, 10)
+    elif kind == "webp":
+        size = _webp_size(head)
+    elif kind == "bmp" and len(head) >= 26:
+        size = _le(head, 18, 22), abs(int.from_bytes(head[22:26], "little", signed=True))
+    if size is None:
+        return kind, None, None
+    return kind, size[0], size[1]
+
+
+class ProbeResult:
+    def __init__(self, ok, reason, status=None, content_type=None, kind=None, width=None, height=None, size=None):
+        self.ok = ok
+        self.reason = reason
+        self.status = status
+        self.content_type = content_type
+        self.kind = kind
+        self.width = width
+        self.height = height
+        self.size = size
+
+    def __repr__(self):
+        return (f"ProbeResult(ok={self.ok}, reason={self.reason!r}, kind={self.kind}, "
+                f"width={self.width}, height={self.height}, size={self.size})")
+
+
+class ProbePolicy:
+    def __init__(self, min_width=0, min_height=0, max_bytes=None, probe_bytes=PROBE_BYTES, timeout=(5, 5)):
+        """
+        min_width/min_height: 最小分辨率，解析不出宽高的图片不过滤
+        max_bytes: 文件大小上限，None表示不限制
+        probe_bytes: 探测读取的字节数
+        """
+        self.min_width = min_width
+        self.min_height = min_height
+        self.max_bytes = max_bytes
+        self.probe_bytes = probe_bytes
+        self.timeout = timeout
+
+    def check(self, status, content_type, head, total):
+        """按响应头和读到的开头判断，返回ProbeResult"""
+        content_type = (content_type or "").split(";")[0].strip().lower()
+        if content_type.startswith(REJECT_TYPES):
+            return ProbeResult(False, "content-type", status, content_type, size=total)
+        kind, width, height = image_size(head)
+        if kind is None:
+            return ProbeResult(False, "not-image", status, content_type, size=total)
+        result = ProbeResult(True, "ok", status, content_type, kind, width, height, total)
+        if width is not None and (width < self.min_width or height < self.min_height):
+            result.ok, result.reason = False, "too-small"
+        elif self.max_bytes is not None and total is not None and total > self.max_bytes:
+            result.ok, result.reason = False, "too-large"
+        return result
+
+    def request_headers(self, headers=None):
+        request_headers = dict(headers or {})
+        request_headers["Range"] = f"bytes=0-{self.probe_bytes - 1}"
+        return request_headers
+
+
+def _total(status, headers):
+    if status == 206:
+        return total_from_content_range(headers.get("Content-Range"))
+    length = headers.get("Content-Length")
+    return int(length) if length and length.isdigit() else None
+
+
+def _keep_head(part_path, status, headers, head):
+    """206且未压缩时把开头写成.part，之后的完整下载从这里续传"""
+    if part_path and status == 206 and headers.get("Content-Encoding") in (None, "identity") \
+            and (headers.get("Content-Range") or "").startswith("bytes 0-") and not os.path.exists(part_path):
+        with open(part_path, "wb") as handle:
+            handle.write(head)
+        write_part_state(part_path, headers, total_from_content_range(headers.get("Content-Range")))
+
+
+def probe(url, policy, session=None, headers=None, part_path=None):
+    """
+    同步探测，http错误照常抛出异常，交给调用方的重试逻辑处理
+    part_path: 探测通过后保存开头的.part文件，一般为common.fetch.part_path_for的结果
+    """
+    session = session or get_session()
+    with session.get(url, headers=policy.request_headers(headers), timeout=policy.timeout, stream=True) as response:
+        response.raise_for_status()
+        response.raw.decode_content = True
+        head = response.raw.read(policy.probe_bytes)
+        result = policy.check(response.status_code, response.headers.get("Content-Type"), head,
+                              _total(response.status_code, response.headers))
+        if result.ok:
+            _keep_head(part_path, response.status_code, response.headers, head)
+    return result
+
+
+async def probe_async(session, url, policy, headers=None, part_path=None):
+    """aiohttp版本的探测"""
+    timeout = None
+    if policy.timeout:
+        import aiohttp
+        timeout = aiohttp.ClientTimeout(sock_connect=policy.timeout[0], sock_read=policy.timeout[1])
+    async with session.get(url, headers=policy.request_headers(headers), timeout=timeout) as response:
+        response.raise_for_status()
+        head = b""
+        while len(head) < policy.probe_bytes:
+            data = await response.content.read(policy.probe_bytes - len(head))
+            if not data:
+                break
+            head += data
+        result = policy.check(response.status, response.headers.get("Content-Type"), head,
+                              _total(response.status, response.headers))
+        if result.ok:
+            _keep_head(part_path, response.status, response.headers, head)
+    return result
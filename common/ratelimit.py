@@ -0,0 +1,133 @@
+"""
+按域名限速的令牌桶
+搜索结果页所在的域名会限制访问频率，按规则给这些域名配置速率；图片CDN默认不限速
+同步代码调用wait()，异步代码调用wait_async()，线程池调度用不等待的try_take()，几者共用同一组令牌桶
+"""
+import time
+import asyncio
+import fnmatch
+import threading
+from urllib.parse import urlsplit
+
+# (域名通配符, 每秒请求数, 突发数)，按顺序匹配第一条
+DEFAULT_RULES = [
+    # 必应的async分页是轻量的片段请求，并发翻页时给多一点余量
+    ("cn.bing.com", 3, 4),
+    ("*.bing.com", 1.5, 2),
+    ("image.so.com", 0.5, 1),
+    ("pic.sogou.com", 4, 4),
+    ("www.123rf.com", 1.5, 2),
+    ("www.shutterstock.com", 2, 2),
+    ("www.google.com", 0.5, 1),
+    ("image.baidu.com", 0.5, 1),
+    ("www.gettyimages.com", 0.2, 1),
+    ("www.istockphoto.com", 0.4, 1),
+    ("www.eyeem.com", 0.5, 1),
+    ("www.freepik.com", 1, 1),
+]
+
+
+class TokenBucket:
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """预订一个令牌，返回需要等待的秒数；令牌可以透支，后来者排在后面等待"""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            self.tokens -= 1
+            return 0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def try_take(self):
+        """有令牌时取走一个并返回0；没有时不透支，返回还要等待的秒数"""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+
+class HostRateLimiter:
+    def __init__(self, rules=None, default_rate=None, default_burst=1):
+        """
+        rules: [(域名通配符, 每秒请求数, 突发数)]，None时使用DEFAULT_RULES
+        default_rate: 没有匹配到规则的域名的速率，None表示不限速
+        """
+        self.rules = list(DEFAULT_RULES if rules is None else rules)
+        self.default_rate = default_rate
+        self.default_burst = default_burst
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def set_rate(self, pattern, rate, burst=1):
+        """新增或修改一条规则，已经创建的令牌桶按新规则重建"""
+        with self._lock:
+            self.rules = [rule for rule in self.rules if rule[0] != pattern]
+            self.rules.insert(0, (pattern, rate, burst))
+            self._buckets.clear()
+
+    def bucket_for(self, host):
+        with self._lock:
+            if host in self._buckets:
+                return self._buckets[host]
+            bucket = None
+            for pattern, rate, burst in self.rules:
+                if fnmatch.fnmatch(host, pattern):
+                    bucket = TokenBucket(rate, burst) if rate else None
+                    break
+            else:
+                if self.default_rate:
+                    bucket = TokenBucket(self.default_rate, self.default_burst)
+            self._buckets[host] = bucket
+            return bucket
+
+    def delay(self, url):
+        host = (urlsplit(url).hostname or "").lower()
+        bucket = self.bucket_for(host)
+        return bucket.reserve() if bucket else 0
+
+    def try_take(self, url):
+        """不等待的版本，给线程池调度用：返回0表示可以立即发出，否则为还要等待的秒数，此时没有占用令牌"""
+        host = (urlsplit(url).hostname or "").lower()
+        bucket = self.bucket_for(host)
+        return bucket.try_take() if bucket else 0
+
+    def wait(self, url):
+        """阻塞到该链接所在域名允许发出下一个请求"""
+        delay = self.delay(url)
+        if delay > 0:
+            time.sleep(delay)
+
+    async def wait_async(self, url):
+        delay = self.delay(url)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_limiter():
+    """进程内共用的限速器"""
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = HostRateLimiter()
+        return _limiter
+
+
+def configure(rules=None, default_rate=None, default_burst=1):
+    """替换进程内共用的限速器"""
+    global _limiter
+    _limiter = HostRateLimiter(rules, default_rate, default_burst)
+    return _limiter
@@ -0,0 +1,138 @@
+"""
+下载失败的分类与重试调度
+失败分为三类：永久失败（404等4xx、非法链接）直接记入台账不再重试；
+临时失败（超时、连接重置、5xx、数据不完整）按带抖动的指数退避重试；
+限流（429、503）退避更久，服务器给了Retry-After时按它等待
+待重试的链接放在按到期时间排序的堆里，下载循环随时取出到期的链接，和新链接交替执行
+"""
+import time
+import heapq
+import random
+import threading
+
+PERMANENT = "permanent"
+TRANSIENT = "transient"
+THROTTLED = "throttled"
+
+# 重试也不会成功的异常，requests和aiohttp里同名
+PERMANENT_ERRORS = ("InvalidURL", "MissingSchema", "InvalidSchema", "InvalidHeader", "TooManyRedirects")
+
+
+def status_of(exc):
+    """从requests/aiohttp的异常中取http状态码"""
+    response = getattr(exc, "response", None)
+    status = getattr(response, "status_code", None)
+    if status is None:
+        status = getattr(exc, "status", None)
+    return status if isinstance(status, int) else None
+
+
+def retry_after(exc):
+    """Retry-After头给出的等待秒数，只支持秒数格式"""
+    response = getattr(exc, "response", None)
+    value = getattr(response, "headers", None) or getattr(exc, "headers", None) or {}
+    try:
+        return float(value.get("Retry-After"))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+def classify(exc=None, status=None):
+    """返回PERMANENT、TRANSIENT或THROTTLED"""
+    if status is None and exc is not None:
+        status = status_of(exc)
+    if status is not None:
+        if status in (429, 503):
+            return THROTTLED
+        if status in (408, 425) or status >= 500:
+            return TRANSIENT
+        if status >= 400:
+            return PERMANENT
+    if exc is not None and type(exc).__name__ in PERMANENT_ERRORS:
+        return PERMANENT
+    return TRANSIENT
+
+
+class RetryScheduler:
+    def __init__(self, max_attempts=4, base_delay=1.0, max_delay=60.0, throttle_delay=10.0):
+        """
+        max_attempts: 单个链接最多下载的次数（含第一次）
+        base_delay/max_delay: 临时失败第一次重试的等待秒数和等待上限，之后每次翻倍
+        throttle_delay: 被限流时第一次重试的等待秒数
+        """
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.throttle_delay = throttle_delay
+        self._heap = []
+        self._attempts = {}
+        self._seq = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._heap)
+
+    def backoff(self, kind, attempt, exc=None):
+        """第attempt次失败后的等待秒数，在指数退避的一半到全部之间随机取值，避免同时重试"""
+        if kind == THROTTLED:
+            wait = retry_after(exc)
+            if wait is not None:
+                return min(wait, self.max_delay)
+            delay = self.throttle_delay
+        else:
+            delay = self.base_delay
+        delay = min(self.max_delay, delay * 2 ** (attempt - 1))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def schedule(self, url, exc=None, status=None, payload=None):
+        """
+        记录一次失败，返回(失败类型, 等待秒数)
+        等待秒数为None表示不再重试（永久失败或次数用完），调用方应记入台账
+        payload随链接一起保存，pop_due时原样返回，比如要写入的文件名
+        """
+        kind = classify(exc, status)
+        with self._lock:
+            attempt = self._attempts.get(url, 0) + 1
+            if kind == PERMANENT or attempt >= self.max_attempts:
+                self._attempts.pop(url, None)
+                return kind, None
+            self._attempts[url] = attempt
+            delay = self.backoff(kind, attempt, exc)
+            self._seq += 1
+            heapq.heappush(self._heap, (time.monotonic() + delay, self._seq, url, payload))
+            return kind, delay
+
+    def forget(self, url):
+        """下载成功后清除该链接的失败次数"""
+        with self._lock:
+            self._attempts.pop(url, None)
+
+    def pop_due(self):
+        """取出一个已到期的链接，返回(url, payload)，没有到期的返回None"""
+        with self._lock:
+            if self._heap and self._heap[0][0] <= time.monotonic():
+                _, _, url, payload = heapq.heappop(self._heap)
+                return url, payload
+            return None
+
+    def pop_all_due(self):
+        result = []
+        while True:
+            item = self.pop_due()
+            if item is None:
+                return result
+            result.append(item)
+
+    def next_delay(self):
+        """距离最早一个重试到期的秒数，没有待重试的链接时返回None"""
+        with self._lock:
+            if not self._heap:
+                return None
+            return max(self._heap[0][0] - time.monotonic(), 0)
+
+    def wait_next(self, limit=1.0):
+        """阻塞到下一个重试到期，最多等limit秒"""
+        delay = self.next_delay()
+        time.sleep(limit if delay is None else min(delay, limit))
+
@@ -0,0 +1,226 @@
+"""
+省内存的已见链接集合
+每个链接只保存64位哈希：已合并的部分是排好序的uint64数组（持久化时为mmap映射的文件），
+新加入的先放在一个小集合里，积累到一定数量后归并进数组；前面放一个布隆过滤器，大部分新链接不用二分查找
+百万级链接约占8MB加上布隆过滤器的1.2MB，而同样数量的url字符串集合要上百MB
+调用方自己决定放入的字符串，清单和采集都放common.urls.dedup_key的结果
+"""
+import os
+import math
+import mmap
+import heapq
+import bisect
+import struct
+import hashlib
+import threading
+from array import array
+
+_BLOOM_HEADER = struct.Struct("<QQQ")
+
+
+def seen_path(dir_path):
+    """关键词目录下所有引擎共用的已见链接文件"""
+    return os.path.join(dir_path, "seen_urls.idx")
+
+
+def string_hash(text):
+    """字符串的64位哈希，跨进程、跨运行保持不变"""
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+class BloomFilter:
+    """
+    分块布隆过滤器：每个元素只落在一个64位字里，k个位都在这个字中，一次取字就能判断
+    比标准布隆过滤器误判率略高，但纯Python下快得多
+    """
+
+    def __init__(self, capacity, error_rate=0.01):
+        """capacity个元素时误判率约为error_rate，超出后误判率升高，但结果仍由数组确认"""
+        self.capacity = max(1, capacity)
+        bits = max(64, int(-self.capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.words = (bits + 63) // 64
+        # 高32位每6位选一个位，最多5个
+        self.hashes = min(5, max(1, round(bits / self.capacity * math.log(2))))
+        self.bits = array("Q", bytes(self.words * 8))
+
+    @property
+    def size(self):
+        return self.words * 64
+
+    def slot(self, value):
+        """(字的下标, 掩码)"""
+        mask = 0
+        rest = value >> 32
+        for _ in range(self.hashes):
+            mask |= 1 << (rest & 63)
+            rest >>= 6
+        return (value & 0xFFFFFFFF) % self.words, mask
+
+    def test(self, slot):
+        index, mask = slot
+        return self.bits[index] & mask == mask
+
+    def set(self, slot):
+        index, mask = slot
+        self.bits[index] |= mask
+
+    def add(self, value):
+        self.set(self.slot(value))
+
+    def __contains__(self, value):
+        return self.test(self.slot(value))
+
+
+class SeenSet:
+    def __init__(self, path=None, capacity=1 << 20, error_rate=0.01, merge_min=1 << 16):
+        """
+        path: 持久化文件，None表示只在内存中；同目录下的path + ".bloom"保存布隆过滤器，缺失时重建
+        capacity: 布隆过滤器的初始容量，元素数超过时在下次归并时翻倍重建
+        merge_min: 新加入的哈希至少积累多少个才归并进数组，数组越大归并间隔越长
+        """
+        self.path = path
+        self.error_rate = error_rate
+        self.merge_min = merge_min
+        self._lock = threading.RLock()
+        self._file = None
+        self._mmap = None
+        self._base = array("Q")
+        self._pending = set()
+        if path and os.path.exists(path) and os.path.getsize(path):
+            self._map()
+        self._bloom = self._load_bloom(max(capacity, len(self._base) * 2))
+
+    def _map(self):
+        self._file = open(self.path, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._base = memoryview(self._mmap).cast("Q")
+
+    def _unmap(self):
+        if self._mmap is not None:
+            self._base.release()
+            self._mmap.close()
+            self._file.close()
+            self._file = self._mmap = None
+            self._base = array("Q")
+
+    def _load_bloom(self, capacity):
+        bloom_path = self.path + ".bloom" if self.path else None
+        if bloom_path and os.path.exists(bloom_path):
+            with open(bloom_path, "rb") as f:
+                count, bloom_capacity, size = _BLOOM_HEADER.unpack(f.read(_BLOOM_HEADER.size))
+                bloom = BloomFilter(bloom_capacity, self.error_rate)
+                if count == len(self._base) and size == bloom.size:
+                    bloom.bits = array("Q", f.read(bloom.words * 8))
+                    if len(bloom.bits) == bloom.words:
+                        return bloom
+        return self._build_bloom(capacity)
+
+    def _build_bloom(self, capacity):
+        bloom = BloomFilter(capacity, self.error_rate)
+        for value in self._base:
+            bloom.add(value)
+        for value in self._pending:
+            bloom.add(value)
+        return bloom
+
+    def __len__(self):
+        with self._lock:
+            return len(self._base) + len(self._pending)
+
+    def __iter__(self):
+        """返回所有哈希值"""
+        with self._lock:
+            items = list(self._pending)
+            base = array("Q", self._base)
+        yield from base
+        yield from items
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _has(self, value, slot):
+        if not self._bloom.test(slot):
+            return False
+        if value in self._pending:
+            return True
+        base = self._base
+        i = bisect.bisect_left(base, value)
+        return i < len(base) and base[i] == value
+
+    def contains_hash(self, value):
+        with self._lock:
+            return self._has(value, self._bloom.slot(value))
+
+    def add_hash(self, value):
+        """加入一个哈希，原来没有时返回True"""
+        with self._lock:
+            slot = self._bloom.slot(value)
+            if self._has(value, slot):
+                return False
+            self._pending.add(value)
+            self._bloom.set(slot)
+            if len(self._pending) >= max(self.merge_min, len(self._base) // 4):
+                self._merge()
+            return True
+
+    def __contains__(self, text):
+        return self.contains_hash(string_hash(text))
+
+    def add(self, text):
+        return self.add_hash(string_hash(text))
+
+    def update(self, items):
+        """加入多个字符串，或另一个SeenSet的全部哈希"""
+        if isinstance(items, SeenSet):
+            for value in items:
+                self.add_hash(value)
+        else:
+            for text in items:
+                self.add(text)
+
+    def _merge(self):
+        """把新加入的哈希归并进有序数组，持久化时写入新文件再替换"""
+        if not self._pending:
+            return
+        merged = heapq.merge(self._base, sorted(self._pending))
+        if self.path:
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                chunk = array("Q")
+                for value in merged:
+                    chunk.append(value)
+                    if len(chunk) >= 1 << 16:
+                        chunk.tofile(f)
+                        chunk = array("Q")
+                chunk.tofile(f)
+            self._unmap()
+            os.replace(tmp_path, self.path)
+            self._map()
+        else:
+            self._base = array("Q", merged)
+        self._pending = set()
+        if len(self._base) > self._bloom.capacity:
+            self._bloom = self._build_bloom(self._bloom.capacity * 2)
+
+    def save(self):
+        """归并并写入文件和布隆过滤器，只在内存中时只做归并"""
+        with self._lock:
+            self._merge()
+            if not self.path:
+                return
+            if not os.path.exists(self.path):
+                open(self.path, "wb").close()
+            bloom = self._bloom
+            tmp_path = self.path + ".bloom.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(_BLOOM_HEADER.pack(len(self._base), bloom.capacity, bloom.size))
+                bloom.bits.tofile(f)
+            os.replace(tmp_path, self.path + ".bloom")
+
+    def close(self):
+        with self._lock:
+            self.save()
+            self._unmap()
@@ -0,0 +1,66 @@
+"""
+进程内共用的HTTP连接池
+同一进程内的所有下载共用一个Session，相同域名的请求复用keep-alive连接，省去每张图一次的TCP和TLS握手
+fork出来的子进程会按自己的pid重新建Session，不会和父进程共用socket
+"""
+import os
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+
+
+_lock = threading.Lock()
+_state = {"pid": None, "session": None, "pool_size": 0}
+
+
+def _mount_adapter(session, pool_size, pool_hosts):
+    # pool_connections为缓存的域名连接池个数，pool_maxsize为单个域名保持的连接数
+    adapter = HTTPAdapter(pool_connections=pool_hosts, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+
+def get_session(pool_size=10, pool_hosts=100):
+    """
+    获取当前进程共用的Session
+    pool_size: 单个域名保持的连接数，应不小于同时下载的线程数，已有的连接池更小时换上更大的连接池
+    pool_hosts: 同时缓存连接池的域名数
+    扩大连接池时Session本身不变，已经保存了这个Session的对象继续可用
+    """
+    with _lock:
+        pid = os.getpid()
+        if _state["pid"] != pid or _state["session"] is None:
+            _state["session"] = requests.Session()
+            _state["pid"] = pid
+            _state["pool_size"] = 0
+        session = _state["session"]
+        if pool_size > _state["pool_size"]:
+            old_adapters = set(session.adapters.values())
+            _mount_adapter(session, pool_size, pool_hosts)
+            _state["pool_size"] = pool_size
+            # 旧连接池上在途的请求照常完成，空闲连接随之关闭
+            for adapter in old_adapters:
+                adapter.close()
+        return session
+
+
+def pool_stats():
+    """
+    连接池命中统计
+    requests: 发出的请求数, connections: 新建的连接数, reused: 复用已有连接的请求数
+    只统计当前仍缓存着的域名连接池
+    """
+    stats = {"requests": 0, "connections": 0, "reused": 0}
+    session = _state["session"]
+    if session is None or _state["pid"] != os.getpid():
+        return stats
+    for adapter in set(session.adapters.values()):
+        pools = adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            stats["requests"] += pool.num_requests
+            stats["connections"] += pool.num_connections
+    stats["reused"] = max(stats["requests"] - stats["connections"], 0)
+    return stats
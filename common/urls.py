@@ -0,0 +1,88 @@
+"""
+链接规范化
+同一张图的链接常有大小写、默认端口、锚点等写法差异，规范化后作为台账和去重的键
+dedup_key进一步去掉utm_统计参数，并按各搜索引擎CDN的规则归一缩略图写法，只用于下载前的去重
+"""
+import re
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+_DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def canonical_url(url):
+    """协议和域名转小写，去掉默认端口和#锚点，路径和查询参数保持原样"""
+    url = url.strip()
+    try:
+        parts = urlsplit(url)
+    except ValueError:
+        return url
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    try:
+        port = parts.port
+    except ValueError:
+        port = None
+    netloc = host
+    if port and port != _DEFAULT_PORTS.get(scheme):
+        netloc = f"{host}:{port}"
+    if parts.username:
+        netloc = f"{parts.username}{':' + parts.password if parts.password else ''}@{netloc}"
+    return urlunsplit((scheme, netloc, parts.path or "/", parts.query, ""))
+
+
+# 所有域名都去掉的统计参数前缀；src、from、ts之类的参数在有些站点上决定返回哪张图，只在下面的域名规则里去掉
+TRACKING_PREFIX = "utm_"
+
+# 各搜索引擎结果里常见的缩略图写法：(域名正则, 归一后的域名, 路径替换列表, 要去掉的尺寸和统计参数)
+# 按出现的域名匹配，不限于产生它的引擎，比如必应的结果里也会有百度的缩略图
+THUMBNAIL_RULES = {
+    # https://img1.baidu.com/it/u=1,2&fm=253&fmt=auto?w=500&h=281，参数写在路径里，u=之后的都是尺寸和格式
+    "baidu": [(re.compile(r"img\d*\.baidu\.com$"), "img.baidu.com", [(re.compile(r"^(/it/u=[^&]+)&.*$"), r"\1")],
+               {"w", "h", "fmt", "app", "size", "q", "f", "fr", "from", "ie", "oe"})],
+    # https://p0.ssl.qhimgs1.com/sdr/400__/t01abc.jpg -> p.ssl.qhimg.com/t01abc.jpg
+    "360": [(re.compile(r"p\d+\.(ssl\.)?qhimgs?\d*\.com$"), "p.ssl.qhimg.com",
+             [(re.compile(r"^/(sdr|bdr|dmfd|dmt|dr)/[\w_]+/"), "/")], {"src", "from"})],
+    # https://tse3-mm.cn.bing.net/th?id=OIP.abc&w=300&h=200&c=7&rs=1&pid=ImgDetMain
+    "bing": [(re.compile(r"tse\d*(\.|-)mm\.(cn\.)?bing\.net$"), "tse.mm.bing.net", [],
+              {"w", "h", "c", "rs", "pid", "o", "dpr", "qlt", "rm", "r"})],
+    # https://encrypted-tbn0.gstatic.com/images?q=tbn:abc&usqp=CAU
+    "google": [(re.compile(r"encrypted-tbn\d*\.gstatic\.com$"), "encrypted-tbn.gstatic.com", [], {"usqp"})],
+    # https://i02piccdn.sogoucdn.com/abc
+    "sogou": [(re.compile(r"i\d*piccdn\.sogoucdn\.com$"), "piccdn.sogoucdn.com", [], {"src", "from", "ts"})],
+}
+
+# 尺寸后缀：photo-300x200.jpg、photo_640x480.jpg，只在确定是同一张图缩放版本的地方去掉
+_SIZE_SUFFIX = re.compile(r"[-_]\d{2,4}x\d{2,4}(\.\w{3,4})$")
+# WordPress生成的缩略图在wp-content/uploads下，以及它的图片CDN
+SIZE_SUFFIX_HOSTS = [re.compile(r"i\d\.wp\.com$"), re.compile(r"[\w-]+\.files\.wordpress\.com$")]
+SIZE_SUFFIX_PATHS = ["/wp-content/uploads/"]
+
+
+def _strip_size_suffix(host, path):
+    if any(pattern.match(host) for pattern in SIZE_SUFFIX_HOSTS) or any(p in path for p in SIZE_SUFFIX_PATHS):
+        return _SIZE_SUFFIX.sub(r"\1", path)
+    return path
+
+
+def dedup_key(url):
+    """
+    去重用的键，等价的链接得到同一个键：协议不区分http/https，去掉utm_统计参数，查询参数排序，
+    已知的缩略图域名和尺寸写法归一；只用于判断重复，下载仍使用原链接
+    """
+    url = canonical_url(url)
+    try:
+        parts = urlsplit(url)
+    except ValueError:
+        return url
+    host, path = parts.netloc, parts.path
+    query = [(key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+             if not key.lower().startswith(TRACKING_PREFIX)]
+    for rules in THUMBNAIL_RULES.values():
+        for host_pattern, new_host, path_rules, drop_params in rules:
+            if host_pattern.match(host):
+                host = new_host
+                for pattern, replacement in path_rules:
+                    path = pattern.sub(replacement, path)
+                query = [(key, value) for key, value in query if key.lower() not in drop_params]
+    path = _strip_size_suffix(host, path)
+    return f"//{host}{path}" + ("?" + urlencode(sorted(query)) if query else "")
@@ -6,18 +6,23 @@ from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.chrome.service import Service
 import argparse
 import os
-import time
+import sys
 import requests
+import time
 from urllib.parse import quote
 import random
 import subprocess
 from tqdm import tqdm
-import concurrent.futures
 from datetime import datetime
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.ratelimit import get_limiter
+from common.batch import PageDownloader
+from common.blocking import ResourcePolicy, block_driver_resources
 
 class EyeemDownloader:
-    def __init__(self, keyword, save_path):
+    def __init__(self, keyword, save_path, resource_policy=None):
         self.keyword = keyword
+        self.resource_policy = resource_policy
         self.downloaded = 0
         self.max_pages = 100
         self.download_dir = os.path.join(save_path, keyword)
@@ -26,6 +31,7 @@ class EyeemDownloader:
         os.chmod(self.download_dir, 0o755)
         
         self.pbar = None
+        self.max_workers = 32  # 下载线程数上限，单个域名的实际并发由AIMD控制器调整
         self._setup_chrome_options()
         self._init_webdriver()
         self._setup_session()
@@ -58,6 +64,8 @@ class EyeemDownloader:
             )
             
             self.wait = WebDriverWait(self.driver, 5)
+
+            block_driver_resources(self.driver, self.resource_policy)
             
         except Exception as e:
             print(f"\n初始化WebDriver失败: {str(e)}")
@@ -69,15 +77,20 @@ class EyeemDownloader:
             raise
 
     def _setup_session(self):
-        self.session = requests.Session()
         self.headers = {
             'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
             'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8',
             'Accept-Language': 'zh-CN,zh;q=0.9,en;q=0.8',
             'Referer': 'https://www.eyeem.com/',
         }
+        self.loader = PageDownloader(self.download_dir, self.headers, self.max_workers)
 
     def __del__(self):
+        if hasattr(self, 'loader'):
+            try:
+                self.loader.close()
+            except:
+                pass
         if hasattr(self, 'driver'):
             try:
                 self.driver.quit()
@@ -96,53 +109,33 @@ class EyeemDownloader:
             except:
                 pass
 
-    def download_file(self, url, filename):
-        try:
-            response = self.session.get(url, headers=self.headers)
-            if response.status_code == 200:
-                with open(filename, 'wb') as f:
-                    f.write(response.content)
-                return True
-            else:
-                return False
-                
-        except Exception as e:
-            print(f"\n下载文件失败: {str(e)}, URL: {url}")
-            return False
-
     def download_batch(self, items):
-        successful_downloads = 0
-        
-        with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
-            futures = []
-            for item in items:
-                try:
-                    img_url = item.get_attribute('src')
-                    if not img_url:
-                        continue
-                    
-                    # 获取更大尺寸的图片
-                    img_url = img_url.replace('/w/300', '/w/1200')
-                    
-                    # 提取原始文件名（图片ID-时间戳）
-                    # 例如：从 https://cdn.eyeem.com/thumb/7ad248b908f64b2fab12fb588f57993a2c648f6b-1535213669029/w/1200
-                    # 提取 7ad248b908f64b2fab12fb588f57993a2c648f6b-1535213669029
-                    img_id = img_url.split('/thumb/')[-1].split('/w/')[0]
-                    if not img_id.lower().endswith(('.jpg', '.jpeg', '.png')):
-                        img_id += '.jpg'
-                    
-                    filename = os.path.join(self.download_dir, img_id)
-                    futures.append(executor.submit(self.download_file, img_url, filename))
-                except Exception as e:
-                    print(f"\n处理图片URL时出错: {str(e)}")
+        tasks = []
+        for item in items:
+            try:
+                img_url = item.get_attribute('src')
+                if not img_url:
                     continue
-            
-            for future in concurrent.futures.as_completed(futures):
-                if future.result():
-                    successful_downloads += 1
-                    self.downloaded += 1
-                    if self.pbar:
-                        self.pbar.update(1)
+                
+                # 获取更大尺寸的图片
+                img_url = img_url.replace('/w/300', '/w/1200')
+                
+                # 提取原始文件名（图片ID-时间戳）
+                # 例如：从 https://cdn.eyeem.com/thumb/7ad248b908f64b2fab12fb588f57993a2c648f6b-1535213669029/w/1200
+                # 提取 7ad248b908f64b2fab12fb588f57993a2c648f6b-1535213669029
+                img_id = img_url.split('/thumb/')[-1].split('/w/')[0]
+                if not img_id.lower().endswith(('.jpg', '.jpeg', '.png')):
+                    img_id += '.jpg'
+                
+                filename = os.path.join(self.download_dir, img_id)
+                tasks.append((img_url, filename))
+            except Exception as e:
+                print(f"\n处理图片URL时出错: {str(e)}")
+                continue
+        
+        # 之前失败、已到重试时间的图片和本页一起下载
+        successful_downloads = self.loader.download_page(tasks)
+        self.downloaded += successful_downloads
         
         return successful_downloads
 
@@ -154,12 +147,15 @@ class EyeemDownloader:
         self.pbar = tqdm(total=0, desc=f"下载进度 - 当前页面: {page}/{self.max_pages}",
                         unit="张",
                         bar_format='{desc} [{elapsed}<{remaining}, {rate_fmt}]')
+        self.loader.progress = self.pbar
         
         while page <= self.max_pages:
             try:
                 url = f'https://www.eyeem.com/search/pictures/{quote(self.keyword)}?collection=mixed&marketScore[]=great&marketStatus=commercial&page={page}&q={quote(self.keyword)}&replaceQuery=true&sort=relevance'
 
                 
+                # 搜索页按域名限速
+                get_limiter().wait(url)
                 self.driver.get(url)
                 
                 try:
@@ -195,7 +191,6 @@ class EyeemDownloader:
                     
                     self.pbar.set_description(f"下载进度 - 当前页面: {page}/{self.max_pages}")
                     page += 1
-                    time.sleep(random.uniform(1.5, 2.5))
                     
                 except Exception as e:
                     print(f"\n处理页面时发生错误: {str(e)}")
@@ -205,20 +200,25 @@ class EyeemDownloader:
                 print(f"\n访问页面时发生错误: {str(e)}")
                 break
         
+        # 翻页结束后把剩下的重试做完
+        self.downloaded += self.loader.finish()
         if self.pbar:
             self.pbar.close()
+        print(f"\n爬取完成，共下载 {self.downloaded} 张图片，{self.loader.summary()}")
 
 def main():
     parser = argparse.ArgumentParser(description='Eyeem资源下载工具')
     parser.add_argument('keyword', help='搜索关键词')
     parser.add_argument('--save-path', default='downloads', help='保存路径，默认为 downloads 目录')
+    parser.add_argument('--block-resources', action='store_true', help='屏蔽图片、视频、字体和统计脚本，只读取页面中的链接')
     args = parser.parse_args()
 
     try:
         os.makedirs(args.save_path, exist_ok=True)
         os.chmod(args.save_path, 0o755)
         
-        downloader = EyeemDownloader(args.keyword, args.save_path)
+        downloader = EyeemDownloader(args.keyword, args.save_path,
+                                      resource_policy=ResourcePolicy() if args.block_resources else None)
         downloader.get_download_urls()
         
     except Exception as e:
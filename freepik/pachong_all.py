@@ -6,18 +6,23 @@ from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.chrome.service import Service
 import argparse
 import os
-import time
+import sys
 import requests
+import time
 from urllib.parse import quote
 import random
 import subprocess
 from tqdm import tqdm
-import concurrent.futures
 from datetime import datetime
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.ratelimit import get_limiter
+from common.batch import PageDownloader
+from common.blocking import ResourcePolicy, block_driver_resources
 
 class FreepikDownloader:
-    def __init__(self, keyword, save_path):
+    def __init__(self, keyword, save_path, resource_policy=None):
         self.keyword = keyword
+        self.resource_policy = resource_policy
         self.downloaded = 0
         self.max_pages = 100  # 最大页数限制
         
@@ -27,6 +32,7 @@ class FreepikDownloader:
         os.chmod(self.download_dir, 0o755)
         
         self.pbar = None
+        self.max_workers = 32  # 下载线程数上限，单个域名的实际并发由AIMD控制器调整
         
         # 设置Chrome选项
         chrome_options = Options()
@@ -70,17 +76,23 @@ class FreepikDownloader:
             raise
             
         self.wait = WebDriverWait(self.driver, 5)
+
+        block_driver_resources(self.driver, self.resource_policy)
         
-        # 用于文件下载的session
-        self.session = requests.Session()
         self.headers = {
             'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
             'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8',
             'Accept-Language': 'zh-CN,zh;q=0.9,en;q=0.8',
             'Referer': 'https://www.freepik.com/',
         }
+        self.loader = PageDownloader(self.download_dir, self.headers, self.max_workers)
 
     def __del__(self):
+        if hasattr(self, 'loader'):
+            try:
+                self.loader.close()
+            except:
+                pass
         if hasattr(self, 'driver'):
             try:
                 self.driver.quit()
@@ -97,44 +109,28 @@ class FreepikDownloader:
             except:
                 pass
 
-    def download_file(self, url, filename):
-        try:
-            response = self.session.get(url, headers=self.headers)
-            if response.status_code == 200:
-                with open(filename, 'wb') as f:
-                    f.write(response.content)
-                return True
-        except Exception as e:
-            print(f"下载失败详细信息: {str(e)}")
-        return False
-
     def download_batch(self, items):
-        successful_downloads = 0
-        with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
-            futures = []
-            for item in items:
-                try:
-                    img = item if item.tag_name == 'img' else item.find_element(By.CSS_SELECTOR, 'img')
-                    img_url = img.get_attribute('src')
-                    
-                    if not img_url:
-                        continue
-                    
-                    img_id = img_url.split('/')[-1].split('?')[0]
-                    if not img_id.lower().endswith(('.jpg', '.jpeg', '.png')):
-                        img_id += '.jpg'
-                    
-                    filename = os.path.join(self.download_dir, img_id)
-                    futures.append(executor.submit(self.download_file, img_url, filename))
-                except:
+        tasks = []
+        for item in items:
+            try:
+                img = item if item.tag_name == 'img' else item.find_element(By.CSS_SELECTOR, 'img')
+                img_url = img.get_attribute('src')
+                
+                if not img_url:
                     continue
                 
-            for future in concurrent.futures.as_completed(futures):
-                if future.result():
-                    successful_downloads += 1
-                    self.downloaded += 1
-                    if self.pbar:
-                        self.pbar.update(1)
+                img_id = img_url.split('/')[-1].split('?')[0]
+                if not img_id.lower().endswith(('.jpg', '.jpeg', '.png')):
+                    img_id += '.jpg'
+                
+                filename = os.path.join(self.download_dir, img_id)
+                tasks.append((img_url, filename))
+            except:
+                continue
+            
+        # 之前失败、已到重试时间的图片和本页一起下载
+        successful_downloads = self.loader.download_page(tasks)
+        self.downloaded += successful_downloads
         
         return successful_downloads
 
@@ -147,10 +143,13 @@ class FreepikDownloader:
         self.pbar = tqdm(total=0, desc=f"下载进度 - 当前页面: {page}/{self.max_pages}", 
                         unit="张", 
                         bar_format='{desc} [{elapsed}<{remaining}, {rate_fmt}]')
+        self.loader.progress = self.pbar
         
         while page <= self.max_pages:
             try:
                 url = f'https://www.freepik.com/search?format=search&last_filter=page&last_value={page}&page={page}&query={quote(self.keyword)}&sort=relevance'
+                # 搜索页按域名限速
+                get_limiter().wait(url)
                 self.driver.get(url)
                 
                 try:
@@ -187,7 +186,6 @@ class FreepikDownloader:
                     self.pbar.set_description(f"下载进度 - 当前页面: {page}/{self.max_pages}")
                     
                     page += 1
-                    time.sleep(random.uniform(0.5,1.5))
                     
                 except Exception as e:
                     print(f"\n处理页面时发生错误: {str(e)}")
@@ -197,14 +195,17 @@ class FreepikDownloader:
                 print(f"\n访问页面时发生错误: {str(e)}")
                 break
         
+        # 翻页结束后把剩下的重试做完
+        self.downloaded += self.loader.finish()
         if self.pbar:
             self.pbar.close()
-        print(f"\n爬取完成，共下载 {self.downloaded} 张图片")
+        print(f"\n爬取完成，共下载 {self.downloaded} 张图片，{self.loader.summary()}")
 
 def main():
     parser = argparse.ArgumentParser(description='Freepik资源下载工具')
     parser.add_argument('keyword', help='搜索关键词')
     parser.add_argument('--save-path', default='downloads', help='保存路径，默认为 downloads 目录')
+    parser.add_argument('--block-resources', action='store_true', help='屏蔽图片、视频、字体和统计脚本，只读取页面中的链接')
     args = parser.parse_args()
 
     # 确保保存路径存在
@@ -212,7 +213,8 @@ def main():
     os.chmod(args.save_path, 0o755)
 
     try:
-        downloader = FreepikDownloader(args.keyword, args.save_path)
+        downloader = FreepikDownloader(args.keyword, args.save_path,
+                                       resource_policy=ResourcePolicy() if args.block_resources else None)
         downloader.get_download_urls()
     except Exception as e:
         print(f"\n程序运行出错: {str(e)}")
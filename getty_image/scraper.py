@@ -1,5 +1,6 @@
 import requests
 import os
+import sys
 import time
 import re
 import random
@@ -8,6 +9,9 @@ from bs4 import BeautifulSoup
 from fake_useragent import UserAgent
 from requests.adapters import HTTPAdapter
 from requests.packages.urllib3.util.retry import Retry
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.ratelimit import get_limiter
+from common.fetch import copy_stream
 
 class GettyImageScraper:
     def __init__(self):
@@ -39,21 +43,19 @@ class GettyImageScraper:
             'Referer': 'https://www.gettyimages.com/'
         }
     
-    def _random_delay(self):
-        time.sleep(random.uniform(3, 7))
-    
-    def _make_request(self, url, retry_count=0):
+    def _make_request(self, url, retry_count=0, stream=False):
         try:
-            self._random_delay()
+            # 按域名限速，搜索页限速，图片CDN不等待
+            get_limiter().wait(url)
             self.headers['User-Agent'] = UserAgent().random
-            response = self.session.get(url, headers=self.headers, timeout=10)
+            response = self.session.get(url, headers=self.headers, timeout=10, stream=stream)
             response.raise_for_status()
             return response
         except requests.exceptions.RequestException as e:
             if retry_count < 3:
                 print(f"请求失败，正在重试 ({retry_count + 1}/3)...")
                 time.sleep(random.uniform(5, 10))
-                return self._make_request(url, retry_count + 1)
+                return self._make_request(url, retry_count + 1, stream)
             else:
                 print(f"请求失败: {str(e)}")
                 return None
@@ -105,15 +107,17 @@ class GettyImageScraper:
                             if not image_url.startswith('http'):
                                 image_url = 'https:' + image_url
                             
-                            img_response = self._make_request(image_url)
+                            img_response = self._make_request(image_url, stream=True)
                             if not img_response:
                                 continue
                             
                             alt = self._clean_filename(image.get('alt', 'untitled'))
                             filename = f"{dir_name}/{alt}.jpg"
                             
-                            with open(filename, 'wb') as f:
-                                f.write(img_response.content)
+                            # 流式写盘，不把整张图读进内存
+                            img_response.raw.decode_content = True
+                            with img_response, open(filename, 'wb') as f:
+                                copy_stream(img_response.raw, f)
                             print(f"已保存: {filename}")
                             
                         except Exception as e:
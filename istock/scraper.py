@@ -1,4 +1,5 @@
 import os
+import sys
 import time
 import random
 from selenium import webdriver
@@ -7,7 +8,11 @@ from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.chrome.options import Options
-import requests
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.transport import get_session
+from common.ledger import DownloadLedger, ledger_path, STATUS_DONE
+from common.fetch import download_to
+from common.ratelimit import get_limiter
 
 def setup_driver():
     chrome_options = Options()
@@ -53,6 +58,9 @@ def scrap(term, max_images, choice, page=1):
     
     driver = setup_driver()
     wait = WebDriverWait(driver, 10)
+    # 下载台账，重新运行时跳过已下载的图片
+    ledger = DownloadLedger(ledger_path('images'))
+    file_index = 1
     
     try:
         # 首先访问主页
@@ -65,6 +73,7 @@ def scrap(term, max_images, choice, page=1):
             search_url = f'{base_url}/search/2/image?phrase={term}&page={page}'
             print(f"\n正在访问页面: {search_url}")
             
+            get_limiter().wait(search_url)
             driver.get(search_url)
             time.sleep(random.uniform(3, 5))
             
@@ -105,6 +114,9 @@ def scrap(term, max_images, choice, page=1):
                         
                     if src.startswith('//'):
                         src = 'https:' + src
+
+                    if ledger.is_done(src):
+                        continue
                     
                     print(f"\n尝试下载图片 {counter} - URL: {src}")
                     
@@ -114,21 +126,19 @@ def scrap(term, max_images, choice, page=1):
                         'Referer': driver.current_url
                     }
                     
-                    img_response = requests.get(src, headers=headers)
-                    img_response.raise_for_status()
-                    
-                    filename = f'images/image{counter}.jpg'
-                    with open(filename, 'wb') as f:
-                        f.write(img_response.content)
+                    # 跳过上次运行已经占用的文件名
+                    while os.path.exists(f'images/image{file_index}.jpg'):
+                        file_index += 1
+                    filename = f'images/image{file_index}.jpg'
+                    get_limiter().wait(src)
+                    size, sha1, status = download_to(src, filename, session=get_session(), headers=headers, timeout=(10, 30))
+                    ledger.record(src, STATUS_DONE, size, sha1, filename, status)
                     print(f'成功下载图片 {counter} 到 {filename}')
                     
                     if max_images <= counter:
                         return
                     counter += 1
                     
-                    # 随机延迟
-                    time.sleep(random.uniform(1, 3))
-                    
                 except Exception as e:
                     print(f"下载图片时出错: {str(e)}")
                     continue
@@ -139,6 +149,7 @@ def scrap(term, max_images, choice, page=1):
         print(f"发生错误: {str(e)}")
     
     finally:
+        ledger.close()
         driver.quit()
 
 term = input('Enter Search Term: ').strip().replace(" ", "%20") # Encode Spaces
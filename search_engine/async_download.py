@@ -0,0 +1,142 @@
+import os
+import asyncio
+import hashlib
+import datetime
+import aiohttp
+from multi_download import headers, FileNamer
+from common.ledger import DownloadLedger, ledger_path, STATUS_DONE, STATUS_FAILED, STATUS_SKIPPED
+from common.ratelimit import get_limiter
+from common.aimd import make_controller
+from common.retry import RetryScheduler, status_of
+from common.fetch import part_path_for, resume_offset, hash_file, IncompleteDownload, copy_stream_async, BufferPool, \
+    resume_headers, resume_action, write_part_state, discard_part, finish_part, fresh_total, RESUME_APPEND, \
+    RESUME_COMPLETE, RESUME_RESTART
+from common.probe import probe_async
+
+# 事件循环内所有下载共用的缓冲区池
+buffer_pool = BufferPool()
+
+
+async def single_download(session, file_path, image_url, timeout):
+    """
+    单张图片下载，流式写入.part文件，完整后改名，返回(字节数, sha1, http状态码)
+    .part已存在时带Range和If-Range续传，与common.fetch.download_to的规则一致
+    """
+    part_path = part_path_for(file_path, image_url)
+    offset = resume_offset(part_path)
+    while True:
+        sha1 = hashlib.sha1()
+        async with session.get(image_url, headers=resume_headers(headers, part_path, offset),
+                               timeout=timeout) as response:
+            action = resume_action(response.status, response.headers, offset, part_path)
+            if action == RESUME_COMPLETE:
+                hash_file(part_path, sha1)
+                finish_part(part_path, file_path)
+                return offset, sha1.hexdigest(), response.status
+            if action == RESUME_RESTART:
+                discard_part(part_path)
+                offset = 0
+                continue
+            response.raise_for_status()
+            if action == RESUME_APPEND:
+                mode = 'ab'
+                hash_file(part_path, sha1)
+            else:
+                offset = 0
+                mode = 'wb'
+                write_part_state(part_path, response.headers, fresh_total(response.status, response.headers))
+            buffer = buffer_pool.acquire()
+            try:
+                with open(part_path, mode) as handle:
+                    size = await copy_stream_async(response.content, handle, sha1, buffer)
+            finally:
+                buffer_pool.release(buffer)
+            expected = response.content_length
+            if expected is not None and response.headers.get("Content-Encoding") in (None, "identity") \
+                    and size < expected:
+                raise IncompleteDownload(f"收到{size}字节，应为{expected}字节: {image_url}")
+            status = response.status
+        break
+    finish_part(part_path, file_path)
+    return offset + size, sha1.hexdigest(), status
+
+
+async def worker(session, url_iter, namer, ledger, retry, timeout, state, controller, probe_policy=None):
+    """
+    从共享迭代器中取链接，单个事件循环内由多个worker并发消费
+    到期的重试优先于新链接；新链接取完后，只要还有在途请求或待重试的链接就继续等待
+    """
+    while True:
+        item = retry.pop_due()
+        if item is not None:
+            image_url = item[0]
+        else:
+            image_url = next(url_iter, None)
+            if image_url is None:
+                if not state["active"] and not len(retry):
+                    return
+                delay = retry.next_delay()
+                await asyncio.sleep(0.5 if delay is None else min(delay, 0.5))
+                continue
+            if ledger.settled(image_url):
+                continue
+        state["active"] += 1
+        try:
+            await get_limiter().wait_async(image_url)
+            # 单个域名的实际并发由AIMD窗口决定，per_host只是上限
+            async with controller.async_slot(image_url):
+                if probe_policy is not None:
+                    part_path = part_path_for(namer.dir_path + "pic/", image_url)
+                    result = await probe_async(session, image_url, probe_policy, headers=headers, part_path=part_path)
+                    if not result.ok:
+                        ledger.record(image_url, STATUS_SKIPPED, size=result.size, http_status=result.status)
+                        state["filtered"] += 1
+                        continue
+                file_path = namer.next()
+                if namer.num % 500 == 0:
+                    print(f'开始第{namer.num}张图片下载, {datetime.datetime.now()}')
+                size, sha1, status = await single_download(session, file_path, image_url, timeout)
+            ledger.record(image_url, STATUS_DONE, size, sha1, file_path, status)
+            retry.forget(image_url)
+        except Exception as e:
+            kind, delay = retry.schedule(image_url, e)
+            if delay is None:
+                state["failed"].add(image_url)
+                ledger.record(image_url, STATUS_FAILED, http_status=status_of(e))
+                print(e, kind, '放弃下载, 失败个数：', len(state["failed"]))
+            else:
+                print(e, kind, f'{delay:.1f}秒后重试, 待重试个数：', len(retry))
+        finally:
+            state["active"] -= 1
+
+
+async def download(dir_path, image_set, keyword, concurrency=500, per_host=64, timeout=(8, 8), probe_policy=None):
+    """
+    异步下载引擎
+    image_set: 链接集合或按顺序产出链接的迭代器
+    concurrency: 全局同时在途的请求数
+    per_host: 单个域名同时在途的请求数上限，实际并发由AIMD控制器按域名调整
+    probe_policy: common.probe.ProbePolicy，下载前先用Range探测，None表示不探测
+    """
+    if not os.path.exists(dir_path + "pic"):
+        os.mkdir(dir_path + "pic")
+    client_timeout = aiohttp.ClientTimeout(sock_connect=timeout[0], sock_read=timeout[1])
+    connector = aiohttp.TCPConnector(limit=concurrency, limit_per_host=per_host)
+    namer = FileNamer(dir_path, keyword)
+    retry = RetryScheduler()
+    state = {"active": 0, "failed": set(), "filtered": 0}
+    controller = make_controller(per_host)
+    with DownloadLedger(ledger_path(dir_path)) as ledger:
+        async with aiohttp.ClientSession(connector=connector) as session:
+            url_iter = iter(image_set)
+            workers = [worker(session, url_iter, namer, ledger, retry, client_timeout, state, controller, probe_policy)
+                       for _ in range(concurrency)]
+            await asyncio.gather(*workers)
+    print(f'下载结束，失败{len(state["failed"])}张，探测过滤{state["filtered"]}张', datetime.datetime.now())
+    print('并发窗口:', controller.windows())
+    return state["failed"]
+
+
+def async_start(dir_path, image_set, keyword, concurrency=500, per_host=64, probe_policy=None):
+    return asyncio.run(download(dir_path, image_set, keyword, concurrency=concurrency, per_host=per_host,
+                                probe_policy=probe_policy))
@@ -0,0 +1,166 @@
+"""
+pyppeteer浏览器池
+保持几个Chromium常驻，每个关键词分到一个新的无痕上下文，不用每个关键词都启动一次浏览器，同一个浏览器的磁盘缓存也能复用
+浏览器打开的页面数达到上限或内存超过上限后不再分配，等手上的页面都关闭后退出，之后按需启动新的
+浏览器和创建它的事件循环绑定，池要在同一个事件循环里使用
+"""
+import os
+import shutil
+import asyncio
+import tempfile
+from pyppeteer import launch
+
+# 用户数据保存目录，池中每个浏览器使用其下单独的子目录；None时每个浏览器用tempfile.mkdtemp()新建一个
+# 不传userDataDir的话，chrome会自动新建一个临时目录使用，在浏览器退出的时候会自动删除临时目录
+# 在删除的时候可能会删除失败（不知道为什么会出现权限问题，我用的windows） 导致浏览器退出失败
+# 然后chrome进程就会一直没有退出 CPU就会狂飙到99%；所以临时目录由池自己创建，浏览器关闭后再删除
+USER_DATA_DIR = None
+
+LAUNCH_ARGS = [
+    # 最大化窗口
+    "--start-maximized",
+    # 取消沙盒模式 沙盒模式下权限太小
+    "--no-sandbox",
+    # 不显示信息栏  比如 chrome正在受到自动测试软件的控制 ...
+    "--disable-infobars",
+    # log等级设置 在某些不是那么完整的系统里 如果使用默认的日志等级 可能会出现一大堆的warning信息
+    "--log-level=3",
+    # 设置UA
+    "--user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, "
+    "like Gecko) Chrome/71.0.3578.98 Safari/537.36",
+]
+
+
+async def launch_browser(user_data_dir):
+    return await launch(headless=True, dumpio=True, args=LAUNCH_ARGS, userDataDir=user_data_dir)
+
+
+def browser_rss_mb(browser):
+    """浏览器主进程和全部子进程的常驻内存（MB），需要psutil，取不到时返回None"""
+    try:
+        import psutil
+    except ImportError:
+        return None
+    process = getattr(browser, "process", None)
+    if process is None:
+        return None
+    try:
+        root = psutil.Process(process.pid)
+        return sum(p.memory_info().rss for p in [root] + root.children(recursive=True)) / 1024 / 1024
+    except psutil.Error:
+        return None
+
+
+class _Slot:
+    def __init__(self, browser, number, temp_dir=None):
+        self.browser = browser
+        self.number = number
+        # 池自己创建的用户数据目录，浏览器关闭后删除
+        self.temp_dir = temp_dir
+        self.pages = 0
+        self.active = 0
+        self.retired = False
+
+
+class BrowserLease:
+    """池分配的一个无痕上下文和其中的页面，close关闭上下文并把浏览器还给池，用法和browser.close一样"""
+
+    def __init__(self, pool, slot, context, page):
+        self.pool = pool
+        self.slot = slot
+        self.context = context
+        self.page = page
+
+    async def close(self):
+        try:
+            await self.context.close()
+        except Exception as e:
+            print(e, '关闭无痕上下文出错')
+        finally:
+            await self.pool.release(self.slot)
+
+
+class BrowserPool:
+    def __init__(self, size=2, max_pages=50, max_rss_mb=None, launcher=launch_browser, user_data_dir=USER_DATA_DIR):
+        """
+        size: 常驻的浏览器数，多个关键词可以同时分到同一个浏览器的不同上下文
+        max_pages: 一个浏览器累计打开多少个页面后退役重启
+        max_rss_mb: 浏览器进程树的内存上限，超过后退役重启，需要安装psutil
+        user_data_dir: 用户数据目录，每个浏览器使用其下的pool_N子目录；None时每个浏览器一个临时目录
+        """
+        self.size = size
+        self.max_pages = max_pages
+        self.max_rss_mb = max_rss_mb
+        self.launcher = launcher
+        self.user_data_dir = user_data_dir
+        self.slots = []
+        self.launched = 0
+        self._lock = asyncio.Lock()
+
+    async def _launch(self):
+        self.launched += 1
+        temp_dir = None
+        if self.user_data_dir is None:
+            user_data_dir = temp_dir = tempfile.mkdtemp(prefix="browser_pool_")
+        else:
+            user_data_dir = os.path.join(self.user_data_dir, f"pool_{self.launched % (self.size * 2)}")
+        try:
+            browser = await self.launcher(user_data_dir)
+        except Exception:
+            if temp_dir is not None:
+                shutil.rmtree(temp_dir, ignore_errors=True)
+            raise
+        slot = _Slot(browser, self.launched, temp_dir)
+        self.slots.append(slot)
+        print(f"浏览器池启动第{slot.number}个浏览器")
+        return slot
+
+    async def acquire(self):
+        """分配一个新的无痕上下文，优先用正在使用的页面最少的浏览器，都忙且未满size个时启动新的"""
+        async with self._lock:
+            live = [slot for slot in self.slots if not slot.retired]
+            idle = [slot for slot in live if slot.active == 0]
+            if idle:
+                slot = idle[0]
+            elif len(live) < self.size:
+                slot = await self._launch()
+            else:
+                slot = min(live, key=lambda item: item.active)
+            slot.active += 1
+            slot.pages += 1
+            if slot.pages >= self.max_pages:
+                slot.retired = True
+        try:
+            context = await slot.browser.createIncognitoBrowserContext()
+            page = await context.newPage()
+        except Exception:
+            slot.retired = True
+            await self.release(slot)
+            raise
+        return BrowserLease(self, slot, context, page)
+
+    async def release(self, slot):
+        async with self._lock:
+            slot.active -= 1
+            if not slot.retired and self.max_rss_mb:
+                rss = browser_rss_mb(slot.browser)
+                if rss is not None and rss > self.max_rss_mb:
+                    print(f"浏览器{slot.number}内存{rss:.0f}MB超过上限，退役")
+                    slot.retired = True
+            if slot.retired and slot.active == 0:
+                await self._close_slot(slot)
+
+    async def _close_slot(self, slot):
+        self.slots.remove(slot)
+        try:
+            await slot.browser.close()
+        except Exception as e:
+            print(e, '关闭浏览器出错')
+        if slot.temp_dir is not None:
+            shutil.rmtree(slot.temp_dir, ignore_errors=True)
+        print(f"浏览器池关闭第{slot.number}个浏览器, 共打开过{slot.pages}个页面")
+
+    async def close(self):
+        async with self._lock:
+            for slot in list(self.slots):
+                await self._close_slot(slot)
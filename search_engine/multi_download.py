@@ -1,105 +1,222 @@
-import json
-import requests
-import os, datetime
-import math, time, random
-from multiprocessing import Pool, Process
+import os, sys, datetime
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import Process, Queue
 from copyheaders import headers_raw_to_dict
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.transport import get_session, pool_stats
+from common.manifest import iter_dir_urls
+from common.ledger import DownloadLedger, ledger_path, STATUS_DONE, STATUS_FAILED, STATUS_SKIPPED
+from common.fetch import download_to, part_path_for
+from common.probe import probe
+from common.aimd import make_controller, HostDispatcher
+from common.retry import RetryScheduler, status_of
 
 
 to_headers = b"""
     user-agent: Mozilla/5.0 (Windows NT 6.1; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/67.0.3396.87 Safari/537.36
     """
-headers = headers_raw_to_dict(to_headers)
+# copyheaders解析出的键值是bytes，requests和aiohttp两个引擎都用str
+headers = {k.decode(): v.decode() for k, v in headers_raw_to_dict(to_headers).items()}
 
 def get_url_set(dir_path):
-    image_set = set()
-    file_name_list = os.listdir(dir_path)
-    for file_name in file_name_list:
-        # if file_name.split('_')[-1].replace(".txt", "").strip() in keyword_list:
-        #     print('@@@', file_name)
-        image_str = []
-        with open(dir_path+file_name, "r", encoding='utf-8') as f:
-            for line in f:
-                image_str.append(line)
-        image_dict = json.loads(image_str[0])
-        image_list = image_dict.get("图片链接列表")
-        # print('$$$', len(image_list))
-        image_set = image_set | set(image_list)
-        print(len(image_set), file_name)
+    image_set = set(iter_dir_urls(dir_path))
     print("已获取所有下载链接")
     return image_set
 
 
-def single_download(file_path, image_url):
+def single_download(file_path, image_url, session=None):
+    """下载单张图片，先写.part再改名，中断后可续传，返回(字节数, sha1, http状态码)"""
+    session = session or get_session()
+    return download_to(image_url, file_path, session=session, headers=headers, timeout=(8, 8))
 
-    with open(file_path, 'wb') as handle:
-        response = requests.get(url=image_url, headers=headers, timeout=(8, 8))
-        for block in response.iter_content(1024):
-            if not block:
-                break
-            handle.write(block)
+
+def next_file_path(dir_path, keyword, pid_num, num):
+    """跳过磁盘上已有的文件名，重新运行时不会覆盖上一次下载的图片"""
+    file_path = dir_path + f"pic/{keyword}_{pid_num}_{num}.jpg"
+    while os.path.exists(file_path):
+        num += 1
+        file_path = dir_path + f"pic/{keyword}_{pid_num}_{num}.jpg"
+    return file_path, num
+
+
+class FileNamer:
+    """分配不重复的文件编号，跳过磁盘上已有的文件，多个线程或协程共用"""
+
+    def __init__(self, dir_path, keyword, pid_num=0):
+        self.dir_path = dir_path
+        self.keyword = keyword
+        self.pid_num = pid_num
+        self.num = 1
+        self._lock = threading.Lock()
+
+    def next(self):
+        with self._lock:
+            file_path, self.num = next_file_path(self.dir_path, self.keyword, self.pid_num, self.num)
+            self.num += 1
+            return file_path
 
 
-def download(dir_path, image_set, pid_num, keyword):
-    num = 1
-    undownload_set = set()
+def fetch_one(image_url, session, namer, ledger, probe_policy=None):
+    """
+    下载一张图并记入台账，调用方（common.aimd.HostDispatcher）已占用该域名的并发名额并按限速取到了令牌
+    给了probe_policy时先探测，不是图片、太小或太大的链接记为skipped，返回False
+    """
+    if probe_policy is not None:
+        part_path = part_path_for(namer.dir_path + "pic/", image_url)
+        result = probe(image_url, probe_policy, session=session, headers=headers, part_path=part_path)
+        if not result.ok:
+            ledger.record(image_url, STATUS_SKIPPED, size=result.size, http_status=result.status)
+            return False
+    file_path = namer.next()
+    size, sha1, status = single_download(file_path, image_url, session=session)
+    ledger.record(image_url, STATUS_DONE, size, sha1, file_path, status)
+    return True
+
+
+def download(dir_path, url_queue, pid_num, keyword, max_threads=16, probe_policy=None, max_pending=None):
+    """
+    从共享队列中按批取链接，队列取空（收到None）后退出，台账中已完成的链接直接跳过
+    进程内最多max_threads个线程同时下载，单个域名实际的并发由AIMD控制器根据429/5xx/超时动态调整
+    窗口已满或还没到限速时间的域名的链接排队，不占线程，其他域名照常下载
+    失败的链接按类型处理：永久失败直接记入台账，临时失败和限流按指数退避排队，到期后和新链接交替下载
+    probe_policy: common.probe.ProbePolicy，None表示不探测直接下载
+    max_pending: 已领取未完成（含排队）的链接数上限，达到后暂停从队列领取，默认max_threads * 32
+    """
+    skip_num = 0
+    failed_num = 0
+    filtered_num = 0
+    state_lock = threading.Lock()
+    max_pending = max_pending or max_threads * 32
     if not os.path.exists(dir_path + "pic"):
-        os.mkdir(dir_path + "pic")
-    for image_url in image_set:
-        try:
-            print(f'开始第{num}张图片下载,共有{len(image_set)}, 进程编号:{pid_num}')
-            file_path = dir_path + f"pic/{keyword}_{pid_num}_{num}.jpg"
-            single_download(file_path, image_url)
-            time.sleep(random.uniform(0.1, 0.3))
-        except Exception as e:
-            undownload_set.add(image_url)
-            print(e, '未爬取集合个数：',len(undownload_set))
-        finally:
-            num += 1
-    while undownload_set:
-        print(f'开始补完计划，第{num}张图片下载,共有{len(undownload_set)}, 进程编号:{pid_num}')
-        image_url = undownload_set.pop()
-        try:
-            file_path = dir_path + f"pic/{keyword}_{pid_num}_{num}.jpg"
-            single_download(file_path, image_url)
-            time.sleep(random.uniform(0.8, 1.1))
-        except Exception as e:
-            print(e)
-        finally:
-            num += 1
+        os.makedirs(dir_path + "pic", exist_ok=True)
+    ledger = DownloadLedger(ledger_path(dir_path))
+    namer = FileNamer(dir_path, keyword, pid_num)
+    session = get_session(pool_size=max_threads)
+    retry = RetryScheduler()
+    # 单个域名的窗口不超过线程数
+    controller = make_controller(max_threads)
+
+    def run(image_url, payload):
+        nonlocal filtered_num
+        if not fetch_one(image_url, session, namer, ledger, probe_policy):
+            with state_lock:
+                filtered_num += 1
+        retry.forget(image_url)
+
+    def on_error(image_url, payload, e):
+        nonlocal failed_num
+        kind, delay = retry.schedule(image_url, e)
+        if delay is None:
+            ledger.record(image_url, STATUS_FAILED, http_status=status_of(e))
+            with state_lock:
+                failed_num += 1
+            print(e, kind, '放弃下载')
+        else:
+            print(e, kind, f'{delay:.1f}秒后重试, 待重试个数:', len(retry))
+
+    def submit_due():
+        for image_url, _ in retry.pop_all_due():
+            dispatcher.submit(image_url)
+
+    with ThreadPoolExecutor(max_workers=max_threads) as executor:
+        dispatcher = HostDispatcher(executor, run, on_error, controller=controller)
+        while True:
+            submit_due()
+            # 领取的链接太多时先等一等，排队的链接按域名名额陆续提交
+            if not dispatcher.wait_below(max_pending, timeout=1):
+                dispatcher.pump()
+                continue
+            try:
+                batch = url_queue.get(timeout=1)
+            except queue.Empty:
+                continue
+            if batch is None:
+                break
+            for image_url in batch:
+                if ledger.settled(image_url):
+                    skip_num += 1
+                    continue
+                dispatcher.submit(image_url)
+            print(f'第{namer.num}张图片已提交, 进程编号:{pid_num}, 并发窗口:', controller.windows())
+        # 新链接已取完，等剩下的下载和重试全部结束
+        while True:
+            submit_due()
+            dispatcher.pump()
+            if not len(dispatcher) and not len(retry):
+                break
+            retry.wait_next(limit=0.5)
+    ledger.close()
+    print(f'进程编号:{pid_num}, 跳过已下载{skip_num}张, 探测过滤{filtered_num}张, 放弃{failed_num}张, 连接复用统计:', pool_stats())
 
 
 def list_split(items, n):
-    total_num = len(items)
+    """把列表尽量均匀地切成n份，数量不足n时只返回非空的部分"""
+    size, rest = divmod(len(items), n)
     result = []
-    for time, i in enumerate(range(0, total_num, math.floor(total_num/n))):
-        if time == n-1:
-            result.append(items[i:total_num])
-            return result
-        else:
-            result.append(items[i:i + math.floor(total_num / n)])
-
-
-def multi_start(dir_path, image_set, keyword):
-    pool_num = 4
-    p = Pool(pool_num)
-    image_list = list(image_set)
-    total_list = list_split(image_list, pool_num)
-    for i in range(pool_num):
-        print('multi:', len(total_list[i]))
-        p.apply_async(func=download, args=(dir_path, set(total_list[i]), i, keyword,))
-    p.close()
-    p.join()
+    start = 0
+    for i in range(n):
+        end = start + size + (1 if i < rest else 0)
+        if end > start:
+            result.append(items[start:end])
+        start = end
+    return result
+
+
+def multi_start(dir_path, image_set, keyword, pool_num=4, batch_size=50, max_threads=16, probe_policy=None):
+    """
+    image_set: 链接集合或按顺序产出链接的迭代器
+    pool_num: 下载进程数
+    max_threads: 每个进程的下载线程数上限
+    probe_policy: 下载前探测的规则，None表示不探测
+    batch_size: 每个进程每次从队列中领取的链接数，进程做完一批再领下一批，慢的域名不会拖住其他进程
+    队列有长度上限，链接边读边分发，不会一次全部堆在内存里
+    """
+    pool_num = max(1, pool_num)
+    url_queue = Queue(maxsize=pool_num * 4)
+    process_list = [Process(target=download, args=(dir_path, url_queue, i, keyword, max_threads, probe_policy))
+                    for i in range(pool_num)]
+    for p in process_list:
+        p.start()
+    total = 0
+    batch = []
+    for image_url in image_set:
+        batch.append(image_url)
+        if len(batch) >= batch_size:
+            url_queue.put(batch)
+            total += len(batch)
+            batch = []
+    if batch:
+        url_queue.put(batch)
+        total += len(batch)
+    for _ in range(pool_num):
+        url_queue.put(None)
+    print('multi:', total, '进程数:', pool_num)
+    for p in process_list:
+        p.join()
     print('end', datetime.datetime.now())
 
 
-def main(data_path, keyword):
+def main(data_path, keyword, engine="process", concurrency=500, per_host=64, pool_num=4, max_threads=16,
+         probe_policy=None):
+    """
+    engine: process为多进程下载，async为单事件循环的异步下载
+    pool_num/max_threads: 多进程下载的进程数和每个进程的线程数上限
+    probe_policy: common.probe.ProbePolicy，比如ProbePolicy(min_width=256, min_height=256, max_bytes=20 << 20)
+    """
     try:
         path = data_path + keyword + "/"
         if not os.path.exists(path):
             raise ValueError("没有读取到关键词目录")
-        total_set = get_url_set(path)
-        multi_start(path, total_set, keyword)
+        total_set = iter_dir_urls(path)
+        if engine == "async":
+            from async_download import async_start
+            async_start(path, total_set, keyword, concurrency=concurrency, per_host=per_host,
+                        probe_policy=probe_policy)
+        else:
+            multi_start(path, total_set, keyword, pool_num=pool_num, max_threads=max_threads,
+                        probe_policy=probe_policy)
         print(path, '$$$')
     except Exception as e:
         print(e)
@@ -1,14 +1,24 @@
-import requests
-import json, os
-import time,datetime
-import random
-from lxml import html, etree
+import os, sys
+import datetime
+from lxml import etree
 import multi_download
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.manifest import ManifestWriter, manifest_path
+from common.ratelimit import get_limiter
+from common.transport import get_session
+from common.checkpoint import PageCheckpoint, checkpoint_path, run_pages
 
 
-def get_pic(keyword):
-    """本网站仅限英文关键词查询"""
-    pic_url_set = set()
+def get_pic(keyword, data_path, workers=4):
+    """
+    本网站仅限英文关键词查询
+    首页取得总页数后，剩余的页由workers个线程分担，已完成的页记在断点文件中，中断后重新运行从断点继续
+    """
+    data_path = data_path + keyword + "/"
+    if not os.path.exists(data_path):
+        os.makedirs(data_path, exist_ok=True)
+    writer = ManifestWriter(manifest_path(data_path, "123rf", keyword), engine="123rf")
+    session = get_session(pool_size=workers)
     headers = {"User-Agent": "Mozilla/5.0 (Windows NT 10.0; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) "
                              "Chrome/51.0.2704.103 Safari/537.36",
                "content-type": "text/html; charset=utf-8",
@@ -17,7 +27,8 @@ def get_pic(keyword):
                 f"{'+'.join(keyword.split(' '))}&sti=%7Cnbj2ejxvp09bhvvozs&imgtype=1"
     print(first_url)
     # 开始爬取后面的页面
-    re = requests.get(first_url, headers=headers)
+    get_limiter().wait(first_url)
+    re = session.get(first_url, headers=headers, timeout=(10, 15))
     datas = etree.HTML(re.text)
     total_page = datas.xpath("//span[@class='padding-mini horizontal-right']//text()")
     if not total_page:  # 如果未获取到页数
@@ -30,38 +41,35 @@ def get_pic(keyword):
             print(f"页数转换失败,设置默认值为1")
             total_page = 1
     first_img_list = datas.xpath("//div[@id='main_container_mosaic']/div/a/div/img/@src")
-    for img_url in first_img_list:
-        pic_url_set.add(img_url)
-    print(f"开始访问关键词为{keyword}的123rf页面,共有{total_page}页")
-    for i in range(2, total_page + 1):
-        try:
-            print(f"第{i}页,累计有{len(pic_url_set)}张图,共有{total_page}页")
-            url = f"https://www.123rf.com/stock-photo/{'_'.join(keyword.split(' '))}.html?oriSearch=" \
-                f"{'+'.join(keyword.split(' '))}&start={i*110}&sti=%7Cnbj2ejxvp09bhvvozs&imgtype=1"
-            web_data = requests.get(url, headers=headers, timeout=(10, 15))
-            if web_data.status_code == 200:
-                datas = etree.HTML(web_data.text)
-                img_list = datas.xpath("//div[@id='main_container_mosaic']/div/a/div/img/@src")
-                for img_url in img_list:
-                    pic_url_set.add(img_url)
-                # print(len(pic_url_set), pic_url_set)
-            else:
-                print(f"返回状态异常：{web_data.status_code}")
-        except Exception as e:
-            print(e)
-        time.sleep(random.randint(3, 10)/10)
-        pic_dict = {"关键词": keyword, "图片数量": len(pic_url_set), "图片链接列表": list(pic_url_set)}
-        if not os.path.exists(data_path):
-            os.mkdir(data_path)
-        with open(data_path+f"pic_123rf2_{keyword}.txt", "w", encoding='utf-8') as f:
-            f.write(json.dumps(pic_dict, ensure_ascii=False))
-    print(f"图片保存完毕，共{len(pic_url_set)}张，{datetime.datetime.now()}")
+    writer.add(first_img_list, page=1)
+    checkpoint = PageCheckpoint(checkpoint_path(data_path, "123rf", keyword), total_page)
+    checkpoint.mark(1)
+    pages = checkpoint.pending(start=2)
+    print(f"开始访问关键词为{keyword}的123rf页面,共有{total_page}页,剩余{len(pages)}页")
+
+    def fetch_page(i):
+        url = f"https://www.123rf.com/stock-photo/{'_'.join(keyword.split(' '))}.html?oriSearch=" \
+            f"{'+'.join(keyword.split(' '))}&start={i*110}&sti=%7Cnbj2ejxvp09bhvvozs&imgtype=1"
+        get_limiter().wait(url)
+        web_data = session.get(url, headers=headers, timeout=(10, 15))
+        if web_data.status_code != 200:
+            print(f"第{i}页返回状态异常：{web_data.status_code}")
+            return False
+        datas = etree.HTML(web_data.text)
+        img_list = datas.xpath("//div[@id='main_container_mosaic']/div/a/div/img/@src")
+        writer.add(img_list, page=i)
+        print(f"第{i}页,累计有{len(writer)}张图,共有{total_page}页")
+        return True
+
+    run_pages(pages, fetch_page, checkpoint, workers=workers)
+    writer.close()
+    print(f"图片保存完毕，共{len(writer)}张，已完成{len(checkpoint)}/{total_page}页，{datetime.datetime.now()}")
 
 
 if __name__ == '__main__':
-    data_path = "/home/weiziang/image-scraper/Fast-picture-crawler/download"
+    data_path = "/home/weiziang/image-scraper/Fast-picture-crawler/download/"
     keyword_list = ["traffic"]
     for word in keyword_list:
-        get_pic(word)
-    multi_download.main(data_path)
+        get_pic(word, data_path)
+        multi_download.main(data_path, word)
 
@@ -1,72 +1,128 @@
-import requests
 import json
-import time
-import random, traceback
-import os
+import asyncio
+import os, sys
+from collections import deque
+import aiohttp
 from lxml import etree
 from copyheaders import headers_raw_to_dict
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.manifest import ManifestWriter, manifest_path
+from common.urls import dedup_key
+from common.retry import RetryScheduler
+from common.collect import fetch_text, session_scope
 
 
-def get_360_pic(keyword, data_path):
+HEADERS_360 = b"""
+        user-agent: Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/84.0.4147.135 Safari/537.36
+        """
+BLOCKED_MARKER = "您的电脑或所在局域网络对本站有异常访问"
+# 3种缩放 × 默认/白色/黑色，共9个变体，每个变体79页
+VARIANTS = [(zoom_type, color) for color in ("", "white", "black") for zoom_type in range(1, 4)]
+PAGES_360 = 79
+
+
+def variant_url(keyword, variant, i):
+    """第0页是搜索页，之后是json分页接口"""
+    zoom_type, color = variant
+    color_arg = f"&color={color}" if color else ""
+    if i == 0:
+        return f"http://image.so.com/i?q={keyword}&src=srp&zoom={zoom_type}{color_arg}"
+    return f"https://image.so.com/j?q={keyword}&pd=1&pn=60&correct={keyword}" \
+           f"&adstar=0&tab=all&sid=2e488cafefd0f95cc08342c9a979c788&ras=0&cn=0&gn=0&kn=50&crn=0&bxn=0&cuben=0&src=srp&zoom={zoom_type}{color_arg}&sn={50+60*i}&pn=60"
+
+
+def parse_items(web_data, first_page):
+    """返回本页的图片链接列表"""
+    if first_page:
+        first_datas = etree.HTML(web_data)
+        datas = json.loads(first_datas.xpath("//script[@id='initData']/text()")[0])
+    else:
+        datas = json.loads(web_data)
+    return [data["img"] for data in datas.get("list") or []]
+
+
+class VariantYield:
+    """
+    记录每个变体最近几页带来的新链接比例
+    连续window页的新链接比例都低于min_ratio时，该变体的结果基本被其他变体覆盖，不再请求
+    """
+
+    def __init__(self, window=3, min_ratio=0.05):
+        self.window = window
+        self.min_ratio = min_ratio
+        self.recent = {variant: deque(maxlen=window) for variant in VARIANTS}
+        self.pages = {variant: 0 for variant in VARIANTS}
+        self.new = {variant: 0 for variant in VARIANTS}
+
+    def record(self, variant, new_count, total_count):
+        self.recent[variant].append(new_count / total_count if total_count else 0)
+        self.pages[variant] += 1
+        self.new[variant] += new_count
+
+    def active(self, variant):
+        recent = self.recent[variant]
+        return len(recent) < self.window or max(recent) >= self.min_ratio
+
+    def summary(self):
+        return {f"zoom={variant[0]},color={variant[1] or 'default'}": (self.pages[variant], self.new[variant])
+                for variant in VARIANTS}
+
+
+async def collect_variant(session, keyword, variant, headers, writer, tracker, seen, semaphore, retry):
+    """
+    按顺序翻一个变体的页，没有结果或新链接太少时停止
+    seen: 本次运行各变体已取到的链接键，新链接比例按它计算，不受清单中已有链接的影响
+    """
+    for i in range(PAGES_360 + 1):
+        if not tracker.active(variant):
+            print(f"360变体{variant}最近{tracker.window}页新图太少，停止于第{i}页, 有{len(writer)}张图")
+            return
+        web_data = await fetch_text(session, variant_url(keyword, variant, i), semaphore, retry, headers,
+                                    blocked_marker=BLOCKED_MARKER)
+        if web_data is None:
+            continue
+        try:
+            items = parse_items(web_data, first_page=i == 0)
+        except Exception as e:
+            print(e, '解析出错', variant, i)
+            continue
+        if not items:
+            print(f"360变体{variant}第{i}页没有结果，停止, 有{len(writer)}张图")
+            return
+        writer.add(items, page=i)
+        await writer.drain()
+        keys = {dedup_key(url) for url in items} - seen
+        seen |= keys
+        tracker.record(variant, len(keys), len(items))
+
+
+async def get_360_pic_async(keyword, data_path, concurrency=3, min_ratio=0.05, session=None, shared=None):
+    """
+    9个变体并发翻页，同时在途的请求不超过concurrency，请求频率由image.so.com的限速规则控制
+    每个变体按最近几页的新链接比例决定是否继续，请求留给还能带来新图的变体
+    session/shared: 和其他引擎共用的aiohttp会话和链接集合，不传时单独创建
+    """
     data_path = data_path + keyword + "/"
     if not os.path.exists(data_path):
         os.mkdir(data_path)
-    to_headers = b"""
-        user-agent: Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/84.0.4147.135 Safari/537.36
-        """
-    headers = headers_raw_to_dict(to_headers)
-    pic_url_set = set()
-    first_url_list = [f"http://image.so.com/i?q={keyword}&src=srp&zoom={zoom_type}" for zoom_type in range(1, 4)]
-    white_url_list = [url + "&color=white" for url in first_url_list]
-    black_url_list = [url + "&color=black" for url in first_url_list]
-    first_url_list = first_url_list + white_url_list + black_url_list
-    try:
-        for first_url in first_url_list:
-            # print(proxies)
-            first_webdata = requests.get(first_url, headers=headers, proxies=proxies).text
-            first_datas = etree.HTML(first_webdata)
-            xpath_datas = json.loads(first_datas.xpath("//script[@id='initData']/text()")[0])
-            for data in xpath_datas["list"]:
-                pic_url_set.add(data["img"])
-            time.sleep(random.randint(5, 10) / 10)
-    except Exception as e:
-        print(e)
-    for i in range(1, 80):
-        print(f"第{i}页,有{len(pic_url_set)}张图")
-        # url_list = [f"http://image.so.com/j?q={keyword}&src=srp=srp&correct={keyword}&pn=60" \
-        #       f"&ch=&sn={50+60*i}&ran=0&ras=6&cn=0&gn=0&kn=50"]
-        url_list = [f"https://image.so.com/j?q={keyword}&pd=1&pn=60&correct={keyword}" \
-              f"&adstar=0&tab=all&sid=2e488cafefd0f95cc08342c9a979c788&ras=0&cn=0&gn=0&kn=50&crn=0&bxn=0&cuben=0&src=srp&zoom={zoom_type}&sn={50+60*i}&pn=60" for zoom_type in range(1, 4)]
-        white_url = [f"https://image.so.com/j?q={keyword}&pd=1&pn=60&correct={keyword}" \
-              f"&adstar=0&tab=all&sid=2e488cafefd0f95cc08342c9a979c788&ras=0&cn=0&gn=0&kn=50&crn=0&bxn=0&cuben=0&src=srp&zoom={zoom_type}&color=white&sn={50+60*i}&pn=60" for zoom_type in range(1, 4)]
-        black_url = [f"https://image.so.com/j?q={keyword}&pd=1&pn=60&correct={keyword}" \
-                     f"&adstar=0&tab=all&sid=2e488cafefd0f95cc08342c9a979c788&ras=0&cn=0&gn=0&kn=50&crn=0&bxn=0&cuben=0&src=srp&zoom={zoom_type}&color=black_url&sn={50 + 60 * i}&pn=60" for zoom_type in range(1, 4)]
-        url_list = url_list + white_url +black_url
-        def url_process(url, proxies):
-            url_set = set()
-            web_data = requests.get(url, headers=headers).text
-            if "您的电脑或所在局域网络对本站有异常访问" in web_data:
-                raise InterruptedError("访问异常")
-            datas = json.loads(web_data)
-            for data in datas["list"]:
-                url_set.add(data["img"])
-            return url_set
-        for url in url_list:
-            try:
-                pic_url_set = pic_url_set | url_process(url)
-            except InterruptedError:
-                print("您的电脑或所在局域网络对本站有异常访问")
-
-                pic_url_set = pic_url_set | url_process(url)
-            except TimeoutError:
-                print('换代理ip')
-                pic_url_set = pic_url_set | url_process(url)
-            except Exception as e:
-                traceback.print_exc()
-            time.sleep(random.randint(20, 25)/10)
-            pic_dict = {"关键词": keyword, "图片数量": len(pic_url_set), "图片链接列表": list(pic_url_set)}
-            with open(data_path+f"pic_360_{keyword}.txt", "w", encoding='utf-8') as f:
-                f.write(json.dumps(pic_dict, ensure_ascii=False))
+    headers = {k.decode(): v.decode() for k, v in headers_raw_to_dict(HEADERS_360).items()}
+    tracker = VariantYield(min_ratio=min_ratio)
+    seen = set()
+    semaphore = asyncio.Semaphore(concurrency)
+    # 被提示异常访问时按限流退避
+    retry = RetryScheduler(max_attempts=3, throttle_delay=10.0)
+    timeout = aiohttp.ClientTimeout(sock_connect=5, sock_read=10)
+    with ManifestWriter(manifest_path(data_path, "360", keyword), engine="360", shared=shared) as writer:
+        async with session_scope(session, timeout=timeout) as session:
+            await asyncio.gather(*(collect_variant(session, keyword, variant, headers, writer, tracker, seen, semaphore,
+                                                   retry)
+                                   for variant in VARIANTS))
+        print(f"360爬取结束, 有{len(writer)}张图, 各变体(页数, 新图数):", tracker.summary())
+        return len(writer)
+
+
+def get_360_pic(keyword, data_path, concurrency=3):
+    return asyncio.run(get_360_pic_async(keyword, data_path, concurrency))
 
 
 if __name__ == "__main__":
@@ -1,12 +1,14 @@
-import time
 import asyncio
 import random
-import json
 import datetime
-import os
-import requests
+import os, sys
 
 from pyppeteer import launch
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.transport import get_session
+from common.blocking import block_page_resources
+from common.manifest import ManifestWriter, manifest_path, iter_engine_urls
+from common.fetch import download_to
 
 """需确保create_page中的本地地址有文件夹，翻页数量可自定义，翻页设置在normal_login下"""
 js1 = '''() =>{
@@ -42,46 +44,49 @@ Object.defineProperty(navigator, 'plugins', {
   });
         }'''
 
-pic_url_set = set()
-
-
 async def create_semaphore(task_count):
     semaphore = asyncio.Semaphore(task_count)
     return semaphore
 
 
-async def create_page(semaphore):
+async def create_page(semaphore, pool=None):
+    """pool为browser_pool.BrowserPool时从池中取一个无痕上下文，返回的browser.close()只关闭上下文"""
     page = None
     async with semaphore:
-        browser = await launch(headless=True,
-                               dumpio=True,
-                               args=[
-                                   # 最大化窗口
-                                   "--start-maximized",
-                                   # 取消沙盒模式 沙盒模式下权限太小
-                                   "--no-sandbox",
-                                   # 不显示信息栏  比如 chrome正在受到自动测试软件的控制 ...
-                                   "--disable-infobars",
-                                   # "--proxy-server=47.52.61.227:8888",
-                                   # '--proxy-server={}'.format(proxy_ip),
-                                   # log等级设置 在某些不是那么完整的系统里 如果使用默认的日志等级 可能会出现一大堆的warning信息
-                                   "--log-level=3",
-                                   # 设置UA
-                                   "--user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, "
-                                   "like Gecko) Chrome/71.0.3578.98 Safari/537.36",
-                               ],
-                               # 用户数据保存目录 这个最好也自己指定一个目录
-                               # 如果不指定的话，chrome会自动新建一个临时目录使用，在浏览器退出的时候会自动删除临时目录
-                               # 在删除的时候可能会删除失败（不知道为什么会出现权限问题，我用的windows） 导致浏览器退出失败
-                               # 然后chrome进程就会一直没有退出 CPU就会狂飙到99%
-                               userDataDir=r'D:\test',
-                               # executablePath=r'/opt/google/chrome/google-chrome',
-                               # executablePath=r'C:\Program Files (x86)\Google\Chrome\Application\chrome.exe',
-                               )
+        if pool is not None:
+            browser = await pool.acquire()
+            page = browser.page
+        else:
+            browser = await launch(headless=True,
+                                   dumpio=True,
+                                   args=[
+                                       # 最大化窗口
+                                       "--start-maximized",
+                                       # 取消沙盒模式 沙盒模式下权限太小
+                                       "--no-sandbox",
+                                       # 不显示信息栏  比如 chrome正在受到自动测试软件的控制 ...
+                                       "--disable-infobars",
+                                       # "--proxy-server=47.52.61.227:8888",
+                                       # '--proxy-server={}'.format(proxy_ip),
+                                       # log等级设置 在某些不是那么完整的系统里 如果使用默认的日志等级 可能会出现一大堆的warning信息
+                                       "--log-level=3",
+                                       # 设置UA
+                                       "--user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, "
+                                       "like Gecko) Chrome/71.0.3578.98 Safari/537.36",
+                                   ],
+                                   # 用户数据保存目录 这个最好也自己指定一个目录
+                                   # 如果不指定的话，chrome会自动新建一个临时目录使用，在浏览器退出的时候会自动删除临时目录
+                                   # 在删除的时候可能会删除失败（不知道为什么会出现权限问题，我用的windows） 导致浏览器退出失败
+                                   # 然后chrome进程就会一直没有退出 CPU就会狂飙到99%
+                                   userDataDir=r'D:\test',
+                                   # executablePath=r'/opt/google/chrome/google-chrome',
+                                   # executablePath=r'C:\Program Files (x86)\Google\Chrome\Application\chrome.exe',
+                                   )
         try:
-            # 使用无痕模式登陆
-            browser_context = await browser.createIncognitoBrowserContext()
-            page = await browser_context.newPage()
+            if pool is None:
+                # 使用无痕模式登陆
+                browser_context = await browser.createIncognitoBrowserContext()
+                page = await browser_context.newPage()
             # page = await browser.newPage()
             width, height = 1920, 1080
             await page.setViewport({
@@ -136,32 +141,55 @@ async def filter_page(page, num):
         print(e)
 
 
-async def save_pics(page, keyword, dir_path):
-    print(f"开始保存图片地址")
+# 在页面内取出还没读过的jpg图片链接，读过的img把当时的src记在data-pic-seen里，src不变时不再返回
+# 占位图、懒加载还没填上src、不是jpg的不打标记，下次再看；节点被复用换了新的src时重新返回
+# scroll为true时取完顺带下拉一屏
+collect_new_src = '''(scroll) => {
+    const result = [];
+    for (const img of document.querySelectorAll("ul li img")) {
+        const src = img.src;
+        if (src && src.includes(".jpg") && img.getAttribute("data-pic-seen") !== src) {
+            img.setAttribute("data-pic-seen", src);
+            result.push(src);
+        }
+    }
+    if (scroll) {
+        window.scrollBy(0, window.innerHeight);
+    }
+    return result;
+}'''
+
+
+async def save_pics(page, writer, page_num=None, scroll=False, seen=None):
+    """
+    一次evaluate取回上次之后新出现的jpg图片链接并写入清单，scroll为True时同时下拉一屏
+    seen: 本次运行已取到的链接集合，取到的链接同时加入其中
+    """
     try:
-        pic_element = await page.xpath("//ul/li//img")
-        for i in pic_element:
-            url_str = await (await i.getProperty('src')).jsonValue()
-            # print(url_str)
-            if url_str not in pic_url_set and ".jpg" in url_str:
-                pic_url_set.add(url_str)
-        # print('&&&', len(pic_url_set))
-        pic_dict = {"关键词": keyword, "图片数量": len(pic_url_set), "图片链接列表": list(pic_url_set)}
-        # if num > 3:
-        with open(dir_path+f"pic_baidu_{keyword}.txt", "w", encoding='utf-8') as f:
-            f.write(json.dumps(pic_dict, ensure_ascii=False))
+        url_list = await page.evaluate(collect_new_src, scroll)
+        writer.add(url_list, page=page_num)
+        if seen is not None:
+            seen.update(url_list)
+        await writer.drain()
     except Exception as e:
         print(e)
     finally:
         return page
 
 
-async def normal_login(semaphore, keyword, data_path):
-    """此处设置翻页"""
+async def normal_login(semaphore, keyword, data_path, shared=None, pool=None, resource_policy=None):
+    """
+    此处设置翻页，shared为和其他引擎共用的链接集合，pool为浏览器池
+    resource_policy: common.blocking.ResourcePolicy，屏蔽图片、字体等只读取链接时用不到的资源
+    """
     data_path = data_path + keyword + "/"
     if not os.path.exists(data_path):
         os.mkdir(data_path)
-    browser, page = await create_page(semaphore)
+    browser, page = await create_page(semaphore, pool)
+    blocked = None
+    if resource_policy is not None and page is not None:
+        blocked = await block_page_resources(page, resource_policy)
+    writer = ManifestWriter(manifest_path(data_path, "baidu", keyword), engine="baidu", shared=shared)
     try:
         login_url = f"https://image.baidu.com/"
         print(f"开始访问关键词首页")
@@ -169,15 +197,26 @@ async def normal_login(semaphore, keyword, data_path):
         page = await login(page, keyword)
         for size_num in [2, 3, 9]:
             page = await filter_page(page, size_num)
-            page = await save_pics(page, keyword, data_path)
-            for i in range(81):  # 翻页数设置
-                await page.evaluate('_ => {window.scrollBy(0, window.innerHeight);}')
-                page = await save_pics(page, keyword, data_path)
-                print(f"第{i}页,有{len(pic_url_set)}张图")
+            idle = 0
+            # 这个尺寸本次运行取到的链接，清单里原有的链接不影响是否到底的判断
+            size_urls = set()
+            # 第0次读筛选后的首屏，之后每次读上一次下拉加载出的图片再继续下拉，共下拉81次
+            for i in range(82):  # 翻页数设置
+                before = len(size_urls)
+                page = await save_pics(page, writer, i, scroll=i < 81, seen=size_urls)
+                print(f"第{i}页,有{len(writer)}张图")
+                # 连续几屏都没有新图，说明已经到底
+                idle = idle + 1 if len(size_urls) == before else 0
+                if idle >= 6:
+                    print(f"尺寸{size_num}连续{idle}屏没有新图，停止下拉")
+                    break
                 await asyncio.sleep(0.5)
     except Exception as e:
         print(e)
     finally:
+        if blocked is not None:
+            print(f"{keyword}请求拦截统计:", blocked)
+        writer.close()
         await browser.close()
 
 
@@ -196,22 +235,12 @@ def main(task_count, keyword, data_path):
 
 
 def down_load(dir_path, keyword):
-    image_str = []
-    with open(f"pic_baidu_{keyword}.txt", "r", encoding='utf-8') as f:
-        for line in f:
-            image_str.append(line)
-    image_dict = json.loads(image_str[0])
-    image_list = image_dict.get("图片链接列表")
+    image_list = iter_engine_urls("./", "baidu", keyword)
     num = 1
     for image_url in image_list:
         print(f'开始第{num}张图片下载')
         file_path = dir_path + f"pic/baidu_{num}.jpg"
-        with open(file_path, 'wb') as handle:
-            response = requests.get(url=image_url)
-            for block in response.iter_content(1024):
-                if not block:
-                    break
-                handle.write(block)
+        download_to(image_url, file_path, session=get_session())
         num += 1
 
 
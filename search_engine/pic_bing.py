@@ -1,20 +1,70 @@
-import requests
-import time,datetime
+import datetime
+import asyncio
 import json
-import random
-import re, os
-import traceback
+import re, os, sys
 from urllib.parse import unquote
+import aiohttp
 from lxml import etree
 from copyheaders import headers_raw_to_dict
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.transport import get_session
+from common.manifest import ManifestWriter, manifest_path, iter_engine_urls
+from common.fetch import download_to
+from common.retry import RetryScheduler
+from common.collect import fetch_text, session_scope
 
 
-def get_bing_pic(keyword, data_path):
-    data_path = data_path + keyword + "/"
-    if not os.path.exists(data_path):
-        os.mkdir(data_path)
-    pic_url_set = set()
-    to_headers = b"""
+MEDIAURL_PATTERN = re.compile(r'mediaurl=(\S+)&exph')
+
+
+def extract_iusc(html):
+    """结果页中所有iusc链接的(href, m属性)"""
+    datas = etree.HTML(html)
+    if datas is None:
+        return []
+    return [(a.get("href"), a.get("m")) for a in datas.xpath("//a[@class='iusc']")]
+
+
+def decode_media_url(href, m=None):
+    """优先取m属性json中的murl，没有时从href的mediaurl参数解码"""
+    if m:
+        try:
+            murl = json.loads(m).get("murl")
+            if murl:
+                return murl
+        except (ValueError, AttributeError):
+            pass
+    match = MEDIAURL_PATTERN.search(href or "")
+    return unquote(match.group(1)) if match else None
+
+
+class BingResults:
+    """增量收集结果，每个href只解码一次，add返回本页新出现的图片链接"""
+
+    def __init__(self):
+        self.hrefs = set()
+        self.urls = set()
+
+    def __len__(self):
+        return len(self.urls)
+
+    def add(self, html):
+        return self.add_items(extract_iusc(html))
+
+    def add_items(self, items):
+        new_urls = []
+        for href, m in items:
+            if not href or href in self.hrefs:
+                continue
+            self.hrefs.add(href)
+            url = decode_media_url(href, m)
+            if url and url not in self.urls:
+                self.urls.add(url)
+                new_urls.append(url)
+        return new_urls
+
+
+BING_HEADERS = b"""
     accept: text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,image/apng,*/*;q=0.8,application/signed-exchange;v=b3;q=0.9
 
     accept-language: zh-CN,zh;q=0.9,en;q=0.8
@@ -22,84 +72,88 @@ def get_bing_pic(keyword, data_path):
     upgrade-insecure-requests: 1
     user-agent: Mozilla/5.0 (Windows NT 6.1; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/67.0.3396.87 Safari/537.36
     """
-    headers = headers_raw_to_dict(to_headers)
-    first_url = f"https://cn.bing.com/images/search?q={keyword}"
-    try:
-        response = requests.get(first_url, headers=headers, verify=False, timeout=(5, 5))
-        first_webdata = response.content
-        first_webdata = str(first_webdata.strip(), encoding="utf-8")
-        first_datas = etree.HTML(first_webdata)
-        xpath_datas = first_datas.xpath("//a[@class='iusc']/@href")
-        for data in xpath_datas:
-            img_url = "https://cn.bing.com" + data
-            pic_url_set.add(img_url)
-        # print('首页', pic_url_list)
-    except Exception as e:
-        print(e, traceback.print_exc())
-
-    url_list = [f"https://cn.bing.com/images/async?q={keyword}&first={int(38 + (i - 1) * 35)}&count=35&relp=35&cw=1119&ch=920&scenario=ImageBasicHover&datsrc=I&layout=RowBased_Landscape&mmasync=1&dgState=x*828_y*1350_h*181_c*3_i*211_r*49&IG=759CCA8CB46F4CB5B5EF345AB570E81A&SFX={i}&iid=images.5523" for i in range(1, 42)]
-    medium_url = [f"https://cn.bing.com/images/async?q={keyword}&first={int(38 + (i - 1) * 35)}&count=35&relp=35&qft=+filterui%3aimagesize-medium&cw=1119&ch=920&scenario=ImageBasicHover&datsrc=I&layout=RowBased_Landscape&mmasync=1&dgState=x*828_y*1350_h*181_c*3_i*211_r*49&IG=759CCA8CB46F4CB5B5EF345AB570E81A&SFX={i}&iid=images.5523" for i in range(1, 42)]
-    large_url = [f"https://cn.bing.com/images/async?q={keyword}&first={int(38 + (i - 1) * 35)}&count=35&relp=35&qft=+filterui%3aimagesize-large&cw=1119&ch=920&scenario=ImageBasicHover&datsrc=I&layout=RowBased_Landscape&mmasync=1&dgState=x*828_y*1350_h*181_c*3_i*211_r*49&IG=759CCA8CB46F4CB5B5EF345AB570E81A&SFX={i}&iid=images.5523" for i in range(1, 42)]
-    url_list = url_list + medium_url + large_url
-    undownload_url_set = set()
-    number = 1
-    for url in url_list:
-        print(f'第{number}个网址必应爬取, 共有{len(pic_url_set)}张图,{datetime.datetime.now()}')
-        try:
-            web_data = requests.get(url, headers=headers, verify=False, timeout=(5, 5)).text
-        except Exception as e:
-            print(e, '访问出错')
-            undownload_url_set.add(url)
-        datas = etree.HTML(web_data)
-        xpath_datas = datas.xpath("//a[@class='iusc']/@href")
-        for pic_url in xpath_datas:
-            img_url = "https://cn.bing.com" + pic_url
-            pic_url_set.add(img_url)
-        time.sleep(random.randint(5, 10) / 10)
-        pic_url_list = [unquote(re.findall('mediaurl=(\S+)&exph', i)[0]) for i in pic_url_set]
-        # print(pic_url_list)
-        pic_dict = {"关键词": keyword, "图片数量": len(pic_url_list), "图片链接列表": pic_url_list}
-        with open(data_path + f"pic_bing_{keyword}.txt", "w", encoding='utf-8') as f:
-            f.write(json.dumps(pic_dict, ensure_ascii=False))
-        number += 1
-    while undownload_url_set:
-        print(f'开始补完计划，第{number}个网址必应爬取, 共有{len(pic_url_set)}张图,{datetime.datetime.now()}')
-        try:
-            url = undownload_url_set.pop()
-            web_data = requests.get(url, headers=headers, proxies=proxies, verify=False, timeout=(5, 5)).text
-        except Exception as e:
-            print(e, '访问出错')
-        datas = etree.HTML(web_data)
-        xpath_datas = datas.xpath("//a[@class='iusc']/@href")
-        for pic_url in xpath_datas:
-            img_url = "https://cn.bing.com" + pic_url
-            pic_url_set.add(img_url)
-        time.sleep(random.randint(5, 10) / 10)
-        pic_url_list = [unquote(re.findall('mediaurl=(\S+)&exph', i)[0]) for i in pic_url_set]
-        # print(pic_url_list)
-        pic_dict = {"关键词": keyword, "图片数量": len(pic_url_list), "图片链接列表": pic_url_list}
-        with open(data_path + f"pic_bing_{keyword}.txt", "w", encoding='utf-8') as f:
-            f.write(json.dumps(pic_dict, ensure_ascii=False))
-        number += 1
+
+# 默认、中图、大图三个尺寸族，每族41页
+BING_FAMILIES = [
+    ("default", ""),
+    ("medium", "&qft=+filterui%3aimagesize-medium"),
+    ("large", "&qft=+filterui%3aimagesize-large"),
+]
+BING_PAGES = 41
+
+
+def bing_page_url(keyword, i, qft=""):
+    return f"https://cn.bing.com/images/async?q={keyword}&first={int(38 + (i - 1) * 35)}&count=35&relp=35{qft}&cw=1119&ch=920&scenario=ImageBasicHover&datsrc=I&layout=RowBased_Landscape&mmasync=1&dgState=x*828_y*1350_h*181_c*3_i*211_r*49&IG=759CCA8CB46F4CB5B5EF345AB570E81A&SFX={i}&iid=images.5523"
+
+
+async def collect_family(session, keyword, index, headers, results, writer, semaphore, retry, window):
+    """
+    按顺序每次并发取window页，逐页解析并写入清单
+    某一页没有本尺寸族本次运行新出现的iusc链接时，说明后面的分页也是重复结果，停止这个尺寸族
+    只看本族本次见过的href，不受清单中已有链接和其他尺寸族结果的影响
+    """
+    name, qft = BING_FAMILIES[index]
+    family_hrefs = set()
+    page = 1
+    while page <= BING_PAGES:
+        batch = list(range(page, min(page + window, BING_PAGES + 1)))
+        pages = await asyncio.gather(*(fetch_text(session, bing_page_url(keyword, i, qft), semaphore, retry, headers,
+                                                  ssl=False)
+                                       for i in batch))
+        for i, web_data in zip(batch, pages):
+            if web_data is None:
+                continue
+            items = extract_iusc(web_data)
+            writer.add(results.add_items(items), page=index * BING_PAGES + i)
+            await writer.drain()
+            fresh = {href for href, _ in items if href} - family_hrefs
+            family_hrefs |= fresh
+            if not fresh:
+                print(f'必应{name}第{i}页没有新图片，停止该尺寸, 共有{len(results)}张图,{datetime.datetime.now()}')
+                return
+        page += window
+    print(f'必应{name}全部{BING_PAGES}页爬取完成, 共有{len(results)}张图,{datetime.datetime.now()}')
+
+
+async def get_bing_pic_async(keyword, data_path, concurrency=6, session=None, shared=None):
+    """
+    三个尺寸族并行翻页，同时在途的请求不超过concurrency，请求频率由cn.bing.com的限速规则控制
+    每页解析完立即追加到清单
+    session/shared: 和其他引擎共用的aiohttp会话和链接集合，不传时单独创建
+    """
+    data_path = data_path + keyword + "/"
+    if not os.path.exists(data_path):
+        os.mkdir(data_path)
+    headers = {k.decode(): v.decode() for k, v in headers_raw_to_dict(BING_HEADERS).items()}
+    results = BingResults()
+    semaphore = asyncio.Semaphore(concurrency)
+    retry = RetryScheduler(max_attempts=3, max_delay=10.0)
+    timeout = aiohttp.ClientTimeout(sock_connect=5, sock_read=5)
+    with ManifestWriter(manifest_path(data_path, "bing", keyword), engine="bing", shared=shared) as writer:
+        async with session_scope(session, timeout=timeout) as session:
+            first_url = f"https://cn.bing.com/images/search?q={keyword}"
+            first_webdata = await fetch_text(session, first_url, semaphore, retry, headers, ssl=False)
+            if first_webdata:
+                writer.add(results.add(first_webdata), page=0)
+                await writer.drain()
+            await asyncio.gather(*(collect_family(session, keyword, index, headers, results, writer, semaphore, retry,
+                                                  window=concurrency)
+                                   for index in range(len(BING_FAMILIES))))
+    print(f'必应爬取结束, 共有{len(results)}张图,{datetime.datetime.now()}')
+    return len(results)
+
+
+def get_bing_pic(keyword, data_path, concurrency=6):
+    return asyncio.run(get_bing_pic_async(keyword, data_path, concurrency))
 
 
 def down_load(dir_path, keyword):
-    image_str = []
-    with open(f"pic_bing_{keyword}.txt", "r", encoding='utf-8') as f:
-        for line in f:
-            image_str.append(line)
-    image_dict = json.loads(image_str[0])
-    image_list = image_dict.get("图片链接列表")
+    image_list = iter_engine_urls("./", "bing", keyword)
     num = 1
     for image_url in image_list:
         print(f'开始第{num}张图片下载')
         file_path = dir_path + f"/bing_{num}.jpg"
-        with open(file_path, 'wb') as handle:
-            response = requests.get(url=image_url, timeout=(5, 5))
-            for block in response.iter_content(1024):
-                if not block:
-                    break
-                handle.write(block)
+        download_to(image_url, file_path, session=get_session(), timeout=(5, 5))
         num += 1
 
 
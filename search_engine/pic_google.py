@@ -1,12 +1,13 @@
+import os, sys
 import requests
 import urllib3
 import chardet
-import time
-import random
 import re
 import json
 from lxml import etree
 from copyheaders import headers_raw_to_dict
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.ratelimit import get_limiter
 
 
 def get_pic(keyword):
@@ -28,6 +29,7 @@ def get_pic(keyword):
                 "f.req": f'''[[["HoAMBc","[null,null,[{i},null,450,1,1136,[[\\"afoGhI8s2Mo5mM\\",259,194,16875390]],[],[],null,null,null,533,104,[]],null,null,null,null,null,null,null,null,null,null,null,null,null,null,null,null,null,null,null,null,null,null,null,null,null,[\\"{keyword}\\"]]",null,"generic"]]]''',
                 "at": "ABrGKkQG7-biHRiEhI_oXQdNS6VP:1594696749986"
             }
+            get_limiter().wait(url)
             web_data = requests.get(url, headers=headers).text
             datas = etree.HTML(web_data)
             xpath_datas = datas.xpath("//table[@class='GpQGbf']//td/a//img/@src")
@@ -36,7 +38,6 @@ def get_pic(keyword):
                 pic_url_list.append(url)
         except Exception as e:
             print(e)
-        time.sleep(random.randint(1, 10)/10)
     print(pic_url_list)
     pic_dict = {"关键词": keyword, "图片数量": len(pic_url_list), "图片链接列表": pic_url_list}
     with open(f"pic_google_{keyword}.txt", "w", encoding='utf-8') as f:
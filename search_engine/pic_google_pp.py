@@ -1,13 +1,11 @@
-import time
 import asyncio
-import random
-import json
 import datetime
-import re, os, traceback
+import os, traceback
 import sys
-import requests
-from urllib.parse import unquote
 from pyppeteer import launch
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.blocking import block_page_resources
+from common.manifest import ManifestWriter, manifest_path
 
 
 js1 = '''() =>{
@@ -49,38 +47,44 @@ async def create_semaphore(task_count):
     return semaphore
 
 
-async def create_page(semaphore):
+async def create_page(semaphore, pool=None):
+    """pool为browser_pool.BrowserPool时从池中取一个无痕上下文，返回的browser.close()只关闭上下文"""
     page = None
     async with semaphore:
-        browser = await launch(headless=True,
-                               dumpio=True,
-                               args=[
-                                   # 最大化窗口
-                                   "--start-maximized",
-                                   # 取消沙盒模式 沙盒模式下权限太小
-                                   "--no-sandbox",
-                                   # 不显示信息栏  比如 chrome正在受到自动测试软件的控制 ...
-                                   "--disable-infobars",
-                                   # "--proxy-server=47.52.61.227:8888",
-                                   # '--proxy-server={}'.format(proxy_ip),
-                                   # log等级设置 在某些不是那么完整的系统里 如果使用默认的日志等级 可能会出现一大堆的warning信息
-                                   "--log-level=3",
-                                   # 设置UA
-                                   "--user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, "
-                                   "like Gecko) Chrome/71.0.3578.98 Safari/537.36",
-                               ],
-                               # 用户数据保存目录 这个最好也自己指定一个目录
-                               # 如果不指定的话，chrome会自动新建一个临时目录使用，在浏览器退出的时候会自动删除临时目录
-                               # 在删除的时候可能会删除失败（不知道为什么会出现权限问题，我用的windows） 导致浏览器退出失败
-                               # 然后chrome进程就会一直没有退出 CPU就会狂飙到99%
-                               userDataDir=r'D:\test',
-                               # executablePath=r'/opt/google/chrome/google-chrome',
-                               # executablePath=r'C:\Program Files (x86)\Google\Chrome\Application\chrome.exe',
-                               )
+        if pool is not None:
+            browser = await pool.acquire()
+            page = browser.page
+        else:
+            browser = await launch(headless=True,
+                                   dumpio=True,
+                                   args=[
+                                       # 最大化窗口
+                                       "--start-maximized",
+                                       # 取消沙盒模式 沙盒模式下权限太小
+                                       "--no-sandbox",
+                                       # 不显示信息栏  比如 chrome正在受到自动测试软件的控制 ...
+                                       "--disable-infobars",
+                                       # "--proxy-server=47.52.61.227:8888",
+                                       # '--proxy-server={}'.format(proxy_ip),
+                                       # log等级设置 在某些不是那么完整的系统里 如果使用默认的日志等级 可能会出现一大堆的warning信息
+                                       "--log-level=3",
+                                       # 设置UA
+                                       "--user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, "
+                                       "like Gecko) Chrome/71.0.3578.98 Safari/537.36",
+                                   ],
+                                   # 用户数据保存目录 这个最好也自己指定一个目录
+                                   # 如果不指定的话，chrome会自动新建一个临时目录使用，在浏览器退出的时候会自动删除临时目录
+                                   # 在删除的时候可能会删除失败（不知道为什么会出现权限问题，我用的windows） 导致浏览器退出失败
+                                   # 然后chrome进程就会一直没有退出 CPU就会狂飙到99%
+                                   userDataDir=r'D:\test',
+                                   # executablePath=r'/opt/google/chrome/google-chrome',
+                                   # executablePath=r'C:\Program Files (x86)\Google\Chrome\Application\chrome.exe',
+                                   )
         try:
-            # 使用无痕模式登陆
-            browser_context = await browser.createIncognitoBrowserContext()
-            page = await browser_context.newPage()
+            if pool is None:
+                # 使用无痕模式登陆
+                browser_context = await browser.createIncognitoBrowserContext()
+                page = await browser_context.newPage()
             # page = await browser.newPage()
             width, height = 1920, 1080
             await page.setViewport({
@@ -109,79 +113,113 @@ async def request_url(page, url):
         return page
 
 
-async def click_right(page):
-    try:
-        ele = await page.xpath(f'//a[@class="wXeWr islib nfEiy mM5pbd"]')
-        for i in ele:
-            await i.click(options={
-                'button': 'right',
-                'clickCount': 1,  # 1 or 2
-                # 'delay': 300,  # 毫秒
-            })
-        # await asyncio.sleep(0.1)
-    except Exception as e:
-        print(e)
-    finally:
-        return page
-
-async def save_pics(page, keyword, data_path):
+# 谷歌结果网格中的锚点，旧版class和新版data-ri/isv-r布局都覆盖
+result_anchors = "a.wXeWr, a.islib, div.isv-r a, div[data-ri] a"
+
+# 下拉两屏；"显示更多"的按钮条可见（style中没有display）时直接点击；返回结果锚点数，判断是否还在加载
+scroll_step = '''() => {
+    window.scrollBy(0, window.innerHeight * 2);
+    const bar = document.querySelector("div[jsname='i3y3Ic']");
+    const more = document.querySelector("input[type='button']");
+    if (bar && more && (bar.getAttribute("style") || "").indexOf("display") < 0) {
+        more.click();
+    }
+    return document.querySelectorAll("%s").length;
+}''' % result_anchors
+
+# 在页面内一次取出全部原图链接：
+# 1. 还没有imgurl的结果锚点派发一次右键mousedown，由谷歌自己的脚本填上href，再统一读取imgurl参数
+# 2. 页面内嵌的结果数据里 ["原图地址",高,宽] 形式的条目，跳过gstatic的缩略图
+harvest_imgurls = '''async () => {
+    for (const a of document.querySelectorAll("%s")) {
+        if (a.href.indexOf("imgurl=") < 0) {
+            a.dispatchEvent(new MouseEvent("mousedown", {bubbles: true, button: 2}));
+        }
+    }
+    await new Promise(resolve => setTimeout(resolve, 500));
+    const urls = new Set();
+    for (const a of document.querySelectorAll("a[href*='imgurl=']")) {
+        const value = new URL(a.href, location.href).searchParams.get("imgurl");
+        if (value) {
+            urls.add(value);
+        }
+    }
+    const pattern = /\["(https?:\/\/[^"]+?)",(\d+),(\d+)\]/g;
+    for (const script of document.querySelectorAll("script")) {
+        const text = script.textContent;
+        let match;
+        while ((match = pattern.exec(text)) !== null) {
+            let url = match[1];
+            try {
+                url = JSON.parse('"' + url + '"');
+            } catch (e) {
+            }
+            if (url.indexOf("gstatic.com") < 0) {
+                urls.add(url);
+            }
+        }
+    }
+    return Array.from(urls);
+}''' % result_anchors
+
+
+async def scroll_results(page, max_steps=60, idle_steps=3, interval=1.0):
+    """下拉到结果不再增加为止，每步一次evaluate，最多max_steps步"""
+    last, idle = -1, 0
+    for i in range(max_steps):
+        count = await page.evaluate(scroll_step)
+        idle = idle + 1 if count == last else 0
+        last = count
+        if idle >= idle_steps:
+            print(f"下拉{i}次，结果数{count}不再增加")
+            break
+        await asyncio.sleep(interval)
+    return page
+
+
+async def save_pics(page, writer):
+    """一次evaluate取回全部原图链接，写入本关键词的清单"""
     print(f"开始保存图片地址")
     try:
-        pic_url_list = []
-        pic_element = await page.xpath("//a[@class='wXeWr islib nfEiy mM5pbd']")
-        for i in pic_element:
-            url_str = await (await i.getProperty('href')).jsonValue()
-            # print(url_str)
-            if 'imgurl=' in url_str and url_str not in pic_url_list:
-                url_str = re.findall("imgurl=(\S+)&imgrefurl", url_str)[0]
-                url_str = unquote(url_str)
-                pic_url_list.append(url_str)
-        print('&&&', len(pic_url_list), pic_url_list[1])
-        pic_dict = {"关键词": keyword, "图片数量": len(pic_url_list), "图片链接列表": pic_url_list}
-        if not os.path.exists(data_path):
-            os.mkdir(data_path)
-        with open(data_path+f"pic_google_{keyword}.txt", "w", encoding='utf-8') as f:
-            f.write(json.dumps(pic_dict, ensure_ascii=False))
+        pic_url_list = await page.evaluate(harvest_imgurls)
+        print('&&&', len(pic_url_list))
+        writer.add(pic_url_list)
+        await writer.drain()
     except Exception as e:
         print(e)
     finally:
         return page
 
 
-async def normal_login(semaphore, keyword, data_path):
-    """正常登录流程"""
+async def normal_login(semaphore, keyword, data_path, shared=None, pool=None, resource_policy=None):
+    """
+    正常登录流程，shared为和其他引擎共用的链接集合，pool为浏览器池
+    resource_policy: common.blocking.ResourcePolicy，屏蔽图片、字体等只读取链接时用不到的资源
+    """
     data_path = data_path + keyword + "/"
     if not os.path.exists(data_path):
         os.mkdir(data_path)
-    browser, page = await create_page(semaphore)
+    browser, page = await create_page(semaphore, pool)
+    blocked = None
+    if resource_policy is not None and page is not None:
+        blocked = await block_page_resources(page, resource_policy)
+    writer = ManifestWriter(manifest_path(data_path, "google", keyword), engine="google", shared=shared)
     try:
         login_url = f"https://www.google.com/search?&tbm=isch&q={keyword}"
         print(f"开始访问关键词首页{keyword}")
         page = await request_url(page, login_url)
-        for i in range(60):  # 下拉次数  10次300张图  15次左右遇到 //input[@value='显示更多搜索结果']
-            await page.evaluate('_ => {window.scrollBy(0, window.innerHeight);}')
-            await asyncio.sleep(2)
-            next_element = await page.xpath("//div[@jsname='i3y3Ic']")
-            if next_element:
-                signal_str = await (await next_element[0].getProperty("style")).jsonValue()
-                signal_str = str(signal_str)
-                if "display" in signal_str:
-                    print("继续下拉", i)
-                else:
-                    print("点击显示更多", signal_str)
-                    await page.hover("input[type='button']")
-                    await asyncio.sleep(0.5)
-                    await page.click("input[type='button']")
-                    await asyncio.sleep(5)
-
-        page = await click_right(page)
-        page = await save_pics(page, keyword, data_path)
+        # 下拉次数上限60，10次300张图，结果数连续几次不再增加时提前结束
+        page = await scroll_results(page)
+        page = await save_pics(page, writer)
         print(f"{keyword}图片保存结束，{datetime.datetime.now()}")
 
     except Exception as e:
         # print(e)
         traceback.print_exc(e)
     finally:
+        if blocked is not None:
+            print(f"{keyword}请求拦截统计:", blocked)
+        writer.close()
         await browser.close()
 
 
@@ -1,61 +1,72 @@
-import requests
-import json, os
-import time,datetime
-import random
-from lxml import html, etree
+import os, sys
+import datetime
+from lxml import etree
 import multi_download
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.manifest import ManifestWriter, manifest_path
+from common.ratelimit import get_limiter
+from common.transport import get_session
+from common.checkpoint import PageCheckpoint, checkpoint_path, run_pages
 
 
-def get_pic(keyword):
-    pic_url_set = set()
+def to_image_url(href):
+    return "https://image.shutterstock.com" + href.replace(href.split("-")[-2], "260nw") + ".jpg"
+
+
+def get_pic(keyword, data_path, workers=4):
+    """
+    首页取得总页数后，剩余的页由workers个线程分担
+    已完成的页记在断点文件中，中断后重新运行自动从断点继续
+    """
+    data_path = data_path + keyword + "/"
+    if not os.path.exists(data_path):
+        os.makedirs(data_path, exist_ok=True)
+    writer = ManifestWriter(manifest_path(data_path, "shutter", keyword), engine="shutter")
+    session = get_session(pool_size=workers)
     headers = {"User-Agent": "Mozilla/5.0 (Windows NT 10.0; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) "
                              "Chrome/51.0.2704.103 Safari/537.36",
                "content-type": "text/html; charset=utf-8",
                }
     first_url = f"https://www.shutterstock.com/search/{keyword}?image_type=photo"
 
-    re = requests.get(first_url, headers=headers)
+    get_limiter().wait(first_url)
+    re = session.get(first_url, headers=headers, timeout=(10, 15))
     datas = etree.HTML(re.text)
     total_page = datas.xpath("//div[@class='b_aE_c6506']//text()")
-    if total_page:
+    try:
         total_page = int(total_page[0].replace("of", "").replace(",", "").strip())
+    except (ValueError, IndexError):
+        print(f"无法获取总页数,设置默认值为1")
+        total_page = 1
     first_img_list = datas.xpath("//div[@id='content']//div[contains(@class,'z_g_63ded')]//a/@href")
-    for i in first_img_list:
-        new_i = i.replace(i.split("-")[-2], "260nw")
-        img_url = "https://image.shutterstock.com" + new_i + ".jpg"
-        pic_url_set.add(img_url)
-    print(f"开始访问关键词为{keyword}的butter页面,共有{total_page}页")
-    for i in range(3476, total_page+1):
-        try:
-            print(f"第{i}页,累计有{len(pic_url_set)}张图,共有{total_page}页")
-            url = f"https://www.shutterstock.com/search/{keyword}?image_type=photo&page={i}"
-            web_data = requests.get(url, headers=headers, timeout=(10, 15))
-            if web_data.status_code == 200:
-                datas = etree.HTML(web_data.text)
-                # print(datas, type(datas))
-                img_list = datas.xpath("//div[@id='content']//div[contains(@class,'z_g_63ded')]//a/@href")
-                for i in img_list:
-                    new_i = i.replace(i.split("-")[-2], "260nw")
-                    img_url = "https://image.shutterstock.com" + new_i + ".jpg"
-                    pic_url_set.add(img_url)
-                # print(len(pic_url_set), pic_url_set)
-            else:
-                print(f"返回状态异常：{web_data.status_code}")
-        except Exception as e:
-            print(e)
-        time.sleep(random.randint(1, 10)/10)
-        pic_dict = {"关键词": keyword, "图片数量": len(pic_url_set), "图片链接列表": list(pic_url_set)}
-        if not os.path.exists(data_path):
-            os.mkdir(data_path)
-        with open(data_path+f"pic_shutter4_{keyword}.txt", "w", encoding='utf-8') as f:
-            f.write(json.dumps(pic_dict, ensure_ascii=False))
-    print(f"图片保存完毕，共{len(pic_url_set)}张，{datetime.datetime.now()}")
+    writer.add([to_image_url(i) for i in first_img_list], page=1)
+    checkpoint = PageCheckpoint(checkpoint_path(data_path, "shutter", keyword), total_page)
+    checkpoint.mark(1)
+    pages = checkpoint.pending(start=2)
+    print(f"开始访问关键词为{keyword}的butter页面,共有{total_page}页,剩余{len(pages)}页")
+
+    def fetch_page(i):
+        url = f"https://www.shutterstock.com/search/{keyword}?image_type=photo&page={i}"
+        get_limiter().wait(url)
+        web_data = session.get(url, headers=headers, timeout=(10, 15))
+        if web_data.status_code != 200:
+            print(f"第{i}页返回状态异常：{web_data.status_code}")
+            return False
+        datas = etree.HTML(web_data.text)
+        img_list = datas.xpath("//div[@id='content']//div[contains(@class,'z_g_63ded')]//a/@href")
+        writer.add([to_image_url(href) for href in img_list], page=i)
+        print(f"第{i}页,累计有{len(writer)}张图,共有{total_page}页")
+        return True
+
+    run_pages(pages, fetch_page, checkpoint, workers=workers)
+    writer.close()
+    print(f"图片保存完毕，共{len(writer)}张，已完成{len(checkpoint)}/{total_page}页，{datetime.datetime.now()}")
 
 
 if __name__ == '__main__':
     keyword = "jojo"
-    data_path = "/home/weiziang/image-scraper/Fast-picture-crawler/download"
+    data_path = "/home/weiziang/image-scraper/Fast-picture-crawler/download/"
     keyword_list = ["jojo"]
     for word in keyword_list:
-        get_pic(word)
-    multi_download.main(data_path, keyword)
+        get_pic(word, data_path)
+        multi_download.main(data_path, word)
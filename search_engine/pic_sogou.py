@@ -1,44 +1,88 @@
-import requests
 import json
-import time
-import random
-import os
+import asyncio
+import os, sys
+import aiohttp
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.transport import get_session
+from common.manifest import ManifestWriter, manifest_path, iter_engine_urls
+from common.fetch import download_to
+from common.retry import RetryScheduler
+from common.collect import fetch_text, session_scope
 
 
-def get_sogou_pic(keyword, data_path):
+SOGOU_MODES = range(1, 5)
+SOGOU_PAGES = 79
+
+
+def sogou_page_url(keyword, mode, i):
+    # url = "http://pic.sogou.com/pics?query={}&policyType=1&mode=1&start={}&reqType=ajax&reqFrom=result&tn=0".format(keyword, 48*i)
+    return f"https://pic.sogou.com/api/pic/searchList?tagQSign=&forbidqc=&entityid=&query={keyword}&mode={mode}&st=&start={100*i}&xml_len=100"
+
+
+async def collect_mode(session, keyword, mode, writer, semaphore, retry, window):
+    """
+    按顺序每次并发取window页，逐页写入清单
+    某一页items为空，或没有这个mode本次运行新出现的picUrl时，停止这个mode
+    只看本mode本次见过的链接，不受清单中已有链接和其他mode结果的影响
+    """
+    mode_urls = set()
+    page = 1
+    while page <= SOGOU_PAGES:
+        batch = list(range(page, min(page + window, SOGOU_PAGES + 1)))
+        pages = await asyncio.gather(*(fetch_text(session, sogou_page_url(keyword, mode, i), semaphore, retry)
+                                       for i in batch))
+        for i, web_data in zip(batch, pages):
+            if web_data is None:
+                continue
+            try:
+                items = json.loads(web_data)["items"] or []
+            except Exception as e:
+                print(e, '解析出错', mode, i)
+                continue
+            if not items:
+                print(f"搜狗mode={mode}第{i}页没有结果，停止, 有{len(writer)}张图")
+                return
+            # 个别item没有picUrl时跳过，不影响整个mode
+            urls = [data.get("picUrl") for data in items if data.get("picUrl")]
+            writer.add(urls, page=i)
+            await writer.drain()
+            fresh = set(urls) - mode_urls
+            mode_urls |= fresh
+            if not fresh:
+                print(f"搜狗mode={mode}第{i}页没有新图，停止, 有{len(writer)}张图")
+                return
+        page += window
+    print(f"搜狗mode={mode}全部{SOGOU_PAGES}页爬取完成, 有{len(writer)}张图")
+
+
+async def get_sogou_pic_async(keyword, data_path, concurrency=8, session=None, shared=None):
+    """
+    4个mode并行翻页，连接池共用，同时在途的请求不超过concurrency，请求频率由pic.sogou.com的限速规则控制
+    每个请求都有超时，单个卡住的连接不会拖住整个关键词
+    session/shared: 和其他引擎共用的aiohttp会话和链接集合，不传时单独创建
+    """
     data_path = data_path + keyword + "/"
     if not os.path.exists(data_path):
         os.mkdir(data_path)
-    pic_url_set = set()
-    for i in range(1, 80):
-        try:
-            print(f"第{i}页,有{len(pic_url_set)}张图")
-            # url = "http://pic.sogou.com/pics?query={}&policyType=1&mode=1&start={}&reqType=ajax&reqFrom=result&tn=0".format(keyword, 48*i)
-            url_list = [f"https://pic.sogou.com/api/pic/searchList?tagQSign=&forbidqc=&entityid=&query={keyword}&mode={t}&st=&start={100*i}&xml_len=100" for t in range(1, 5)]
-            for url in url_list:
-                web_data = requests.get(url).text
-                datas = json.loads(web_data)
-                # print(datas)
-                for data in datas["items"]:
-                    pic_url_set.add(data["picUrl"])
-        except Exception as e:
-            print(e)
-        time.sleep(random.randint(1, 10)/10)
-    # print(pic_url_list)
-    pic_dict = {"关键词": keyword, "图片数量": len(pic_url_set), "图片链接列表": list(pic_url_set)}
-    with open(data_path+f"pic_sogou_{keyword}.txt", "w", encoding='utf-8') as f:
-        f.write(json.dumps(pic_dict, ensure_ascii=False))
+    semaphore = asyncio.Semaphore(concurrency)
+    retry = RetryScheduler(max_attempts=3, max_delay=10.0)
+    timeout = aiohttp.ClientTimeout(total=30, sock_connect=5, sock_read=10)
+    connector = None if session is not None else aiohttp.TCPConnector(limit=concurrency)
+    with ManifestWriter(manifest_path(data_path, "sogou", keyword), engine="sogou", shared=shared) as writer:
+        async with session_scope(session, connector=connector, timeout=timeout) as session:
+            await asyncio.gather(*(collect_mode(session, keyword, mode, writer, semaphore, retry, window=concurrency)
+                                   for mode in SOGOU_MODES))
+        print(f"搜狗爬取结束, 有{len(writer)}张图")
+        return len(writer)
+
+
+def get_sogou_pic(keyword, data_path, concurrency=8):
+    return asyncio.run(get_sogou_pic_async(keyword, data_path, concurrency))
 
 def down_load(dir_path, keyword_list):
     image_set = set()
     for keyword in keyword_list:
-        image_str = []
-        with open(dir_path+f"pic_sogou_{keyword}.txt", "r", encoding='utf-8') as f:
-            for line in f:
-                image_str.append(line)
-        image_dict = json.loads(image_str[0])
-        image_list = image_dict.get("图片链接列表")
-        image_set = image_set | set(image_list)
+        image_set.update(iter_engine_urls(dir_path, "sogou", keyword))
         print(len(image_set), keyword)
     num = 1
     # print(f'开始第{num}张图片下载,共有{len(image_set)}')
@@ -47,12 +91,7 @@ def down_load(dir_path, keyword_list):
         try:
             print(f'开始第{num}张图片下载,共有{len(image_set)}')
             file_path = dir_path + f"pic/sogou_{num}.jpg"
-            with open(file_path, 'wb') as handle:
-                response = requests.get(url=image_url)
-                for block in response.iter_content(1024):
-                    if not block:
-                        break
-                    handle.write(block)
+            download_to(image_url, file_path, session=get_session())
         except Exception as e:
             un_download_set.add(image_url)
             print(e, un_download_set)
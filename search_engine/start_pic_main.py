@@ -2,45 +2,238 @@
 import datetime
 import asyncio
 import os
-from pic_360 import get_360_pic
-from pic_bing import get_bing_pic
-from pic_sogou import get_sogou_pic
+import sys
+import threading
+from collections import deque
+from multiprocessing import Process, Queue
+import aiohttp
+from pic_360 import get_360_pic_async
+from pic_bing import get_bing_pic_async
+from pic_sogou import get_sogou_pic_async
 from pic_google_pp import normal_login as google_main
 from pic_baidu import normal_login as baidu_main
-from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
-from multi_download import main as download_main
+from browser_pool import BrowserPool
+from multi_download import main as download_main, download
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.manifest import set_sink, iter_dir_urls, manifest_sizes
+from common.urls import dedup_key
+from common.seenset import SeenSet, seen_path
 
+# 各引擎同时在途的请求数，浏览器引擎为同时打开的页面数，0表示不运行该引擎
+ENGINE_LIMITS = {"sogou": 8, "bing": 6, "360": 3, "baidu": 1, "google": 1}
+# 浏览器池的参数，多个关键词共用几个常驻的浏览器；None表示每个关键词单独启动浏览器
+# user_data_dir为浏览器用户数据的目录，None时每个浏览器用一个临时目录，关闭后删除
+BROWSER_POOL = {"size": 2, "max_pages": 50, "max_rss_mb": 2048, "user_data_dir": None}
+# 百度/谷歌页面的资源屏蔽，比如common.blocking.ResourcePolicy()屏蔽图片、视频、字体和统计脚本；None表示不屏蔽
+RESOURCE_POLICY = None
 
-def pp_main(task_count, keyword, data_path):
-    """cookie登录主流程"""
+_loop = None
+_pool = None
+
+
+def get_loop():
+    """所有关键词共用的事件循环，池中的浏览器绑定在它上面，不能每个关键词asyncio.run一次"""
+    global _loop
+    if _loop is None or _loop.is_closed():
+        _loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(_loop)
+    return _loop
+
+
+def get_pool():
+    global _pool
+    if _pool is None and BROWSER_POOL is not None:
+        _pool = BrowserPool(**BROWSER_POOL)
+    return _pool
+
+
+def close_pool():
+    """全部关键词采集完后关闭池中的浏览器"""
+    global _pool
+    if _pool is not None:
+        get_loop().run_until_complete(_pool.close())
+        _pool = None
+
+
+async def collect_all(keyword, data_path, limits=None, shared=None, pool=None, resource_policy=None):
+    """
+    在一个事件循环里同时运行所有采集：pyppeteer的百度/谷歌和aiohttp的搜狗/必应/360
+    http引擎共用一个连接池，所有引擎共用一个链接集合，一个引擎已采到的链接其他引擎不再写入清单
+    shared: 共用的SeenSet，不传时打开关键词目录下持久化的集合，结束时保存
+    pool: 百度/谷歌使用的browser_pool.BrowserPool，None时各自启动浏览器
+    resource_policy: 百度/谷歌页面的common.blocking.ResourcePolicy
+    返回去重后的链接数
+    """
+    limits = dict(ENGINE_LIMITS, **(limits or {}))
+    path = data_path + keyword + "/"
+    os.makedirs(path, exist_ok=True)
+    if shared is None:
+        with SeenSet(seen_path(path)) as shared:
+            return await collect_all(keyword, data_path, limits, shared, pool, resource_policy)
+    connector = aiohttp.TCPConnector(limit=sum(limits[engine] for engine in ("sogou", "bing", "360")) or 1)
+    timeout = aiohttp.ClientTimeout(total=30, sock_connect=5, sock_read=10)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        jobs = {
+            "sogou": lambda: get_sogou_pic_async(keyword, data_path, limits["sogou"], session=session, shared=shared),
+            "bing": lambda: get_bing_pic_async(keyword, data_path, limits["bing"], session=session, shared=shared),
+            "360": lambda: get_360_pic_async(keyword, data_path, limits["360"], session=session, shared=shared),
+            "baidu": lambda: baidu_main(asyncio.Semaphore(limits["baidu"]), keyword, data_path, shared=shared,
+                                        pool=pool, resource_policy=resource_policy),
+            "google": lambda: google_main(asyncio.Semaphore(limits["google"]), keyword, data_path, shared=shared,
+                                          pool=pool, resource_policy=resource_policy),
+        }
+        engines = [engine for engine in jobs if limits.get(engine)]
+        results = await asyncio.gather(*(jobs[engine]() for engine in engines), return_exceptions=True)
+    for engine, result in zip(engines, results):
+        if isinstance(result, Exception):
+            print(result, f"{engine}采集出错")
+    return len(shared)
+
+
+def collect_main(keyword, data_path, limits=None, shared=None):
+    """采集一个关键词"""
     start_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     print(f"开始时间为: 《{start_time}》")
-    loop = asyncio.get_event_loop()
-    executor = ProcessPoolExecutor(4)
-    loop.set_default_executor(executor)
-    # 设置并发数量
-    semaphore = asyncio.Semaphore(task_count)
-    task1 = [asyncio.ensure_future(baidu_main(semaphore=semaphore, keyword=keyword, data_path=data_path))]
-    task2 = [asyncio.ensure_future(google_main(semaphore=semaphore, keyword=keyword, data_path=data_path))]
-    tasks = task1 + task2
-    loop.run_until_complete(asyncio.wait(tasks))
+    total = get_loop().run_until_complete(collect_all(keyword, data_path, limits, shared, get_pool(),
+                                                                RESOURCE_POLICY))
     end_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    print(f"结束时间为：《{end_time}》")
+    print(f"结束时间为：《{end_time}》, 去重后共{total}个链接")
+
+
+class UrlPipe:
+    """
+    采集端到下载进程的有界队列，sink收到的每批新链接整批放入
+    清单只把共用集合里没有的链接交给sink，这里不再去重
+    放入队列由一个线程完成：事件循环中调用时只放进本进程的缓冲区，不阻塞，
+    缓冲的批数达到maxsize后采集协程在drain中等待；其他线程中调用时直接等到缓冲区有空位
+    采集端跟着下载进程变慢，链接不会在内存里越积越多
+    """
+
+    def __init__(self, maxsize=64):
+        self.queue = Queue(maxsize=maxsize)
+        self.maxsize = maxsize
+        self.total = 0
+        self._buffer = deque()
+        self._closed = False
+        self._cond = threading.Condition()
+        self._feeder = threading.Thread(target=self._feed, name="url_pipe", daemon=True)
+        self._feeder.start()
+
+    def _feed(self):
+        while True:
+            with self._cond:
+                while not self._buffer and not self._closed:
+                    self._cond.wait()
+                if not self._buffer:
+                    return
+                urls = self._buffer[0]
+            # 下载进程跟不上时只有这个线程等待
+            self.queue.put(urls)
+            with self._cond:
+                self._buffer.popleft()
+                self._cond.notify_all()
+
+    def _has_room(self):
+        return len(self._buffer) < self.maxsize
+
+    def wait_room(self, timeout=None):
+        """等到缓冲区有空位，返回是否等到"""
+        with self._cond:
+            return self._cond.wait_for(self._has_room, timeout)
+
+    def put(self, urls, block=True):
+        """block为False时不等待空位，由调用方之后drain"""
+        if not urls:
+            return
+        with self._cond:
+            if block:
+                self._cond.wait_for(self._has_room)
+            self.total += len(urls)
+            self._buffer.append(urls)
+            self._cond.notify_all()
+
+    def __call__(self, urls, engine):
+        """给ManifestWriter用的sink，事件循环中不阻塞"""
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            self.put(urls)
+        else:
+            self.put(urls, block=False)
+
+    async def drain(self):
+        """缓冲区满时在线程池中等待空位，事件循环照常运行"""
+        if not self._has_room():
+            await asyncio.get_running_loop().run_in_executor(None, self.wait_room)
+
+    def close(self):
+        """等缓冲区里的链接全部放入队列"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._feeder.join()
+
+
+def pipeline_main(keyword, data_path, pool_num=4, max_threads=16, queue_size=64, probe_policy=None, limits=None):
+    """
+    采集和下载同时进行：各引擎每采到一页，新链接去重后立刻交给下载进程，不用等全部采集结束
+    目录里以前采集过的链接由一个线程和采集同时放进队列，已下载完成的由台账跳过
+    采集和下载共用关键词目录下持久化的SeenSet，下次运行时已采集过的链接不会再次入队
+    队列满时各引擎在drain中等待，事件循环不被阻塞
+    """
+    path = data_path + keyword + "/"
+    os.makedirs(path, exist_ok=True)
+    pipe = UrlPipe(maxsize=queue_size)
+    process_list = [Process(target=download, args=(path, pipe.queue, i, keyword, max_threads, probe_policy))
+                    for i in range(pool_num)]
+    for p in process_list:
+        p.start()
+
+    shared = SeenSet(seen_path(path))
+
+    # 只读采集开始前清单里已有的内容，本次新写入的链接由sink入队，不会重复
+    sizes = manifest_sizes(path)
 
+    def feed_existing():
+        # 上次没下载完的也要重新入队，这里不按shared过滤，只把链接补进shared
+        batch = []
+        for url in iter_dir_urls(path, sizes):
+            shared.add(dedup_key(url))
+            batch.append(url)
+            if len(batch) >= 50:
+                pipe.put(batch)
+                batch = []
+        pipe.put(batch)
 
-def start_main(keyword, data_path):
-    with ProcessPoolExecutor(max_workers=4) as executor:
-        executor.submit(get_sogou_pic, keyword, data_path)
-        executor.submit(get_bing_pic, keyword, data_path)
-        executor.submit(get_360_pic, keyword, data_path)
+    # 已有链接很多时也不推迟采集，队列满时只有这个线程等待
+    feeder = threading.Thread(target=feed_existing, name="feed_existing", daemon=True)
+    set_sink(pipe)
+    feeder.start()
+    try:
+        collect_main(keyword, data_path, limits, shared)
+    finally:
+        set_sink(None)
+        feeder.join()
+        pipe.close()
+        shared.close()
+        for _ in process_list:
+            pipe.queue.put(None)
+        for p in process_list:
+            p.join()
+    print(f"{keyword}采集下载结束, 共{pipe.total}个链接, {datetime.datetime.now()}")
 
 
 if __name__ == '__main__':
     keyword_list = ['jojo']
 
     data_path = r"D:/joestar/"
+    # True为采集和下载同时进行，False为先全部采集再下载
+    pipelined = True
     for keyword in keyword_list:
-        pp_main(1, keyword, data_path)
-        start_main(keyword, data_path)
+        if pipelined:
+            pipeline_main(keyword, data_path)
+            continue
+        collect_main(keyword, data_path)
         # 开始下载图片
-        download_main(data_path, keyword)
\ No newline at end of file
+        download_main(data_path, keyword)
+    close_pool()
\ No newline at end of file
@@ -0,0 +1,104 @@
+"""
+测试共用的夹具：本地http服务器和合成图片
+测试不访问外网，下载相关的用例都请求本地服务器
+"""
+import os
+import sys
+import struct
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "search_engine"))
+
+
+def jpeg_bytes(width, height, size=2048):
+    """带SOF0帧头的合成JPEG，用0补足到size字节"""
+    sof = b"\xff\xc0" + struct.pack(">HBHHB", 11, 8, height, width, 1) + b"\x01\x11\x00"
+    data = b"\xff\xd8" + b"\xff\xe0" + struct.pack(">H", 16) + b"JFIF\x00" + bytes(9) + sof
+    return data + bytes(max(size - len(data) - 2, 0)) + b"\xff\xd9"
+
+
+def _parse_range(value, length):
+    """bytes=N- 或 bytes=N-M，返回(start, end)，end包含在内"""
+    start, _, end = value.split("=", 1)[1].partition("-")
+    return int(start), min(int(end), length - 1) if end else length - 1
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        path = urlsplit(self.path).path
+        self.server.requests.append((path, dict(self.headers)))
+        route = self.server.routes.get(path)
+        if route is None:
+            status, headers, body = 404, {}, b""
+        else:
+            status, headers, body = route(self.headers)
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class LocalServer:
+    def __init__(self, server):
+        self.server = server
+        self.routes = server.routes
+        self.requests = server.requests
+
+    def url(self, path):
+        return f"http://127.0.0.1:{self.server.server_port}{path}"
+
+    def route(self, path, handler):
+        """handler(request_headers)返回(状态码, 响应头, 响应体)"""
+        self.routes[path] = handler
+        return self.url(path)
+
+    def serve(self, path, body, etag=None, content_type="image/jpeg"):
+        """支持Range和If-Range的静态文件"""
+        def handler(request_headers):
+            headers = {"Content-Type": content_type, "Accept-Ranges": "bytes"}
+            if etag:
+                headers["ETag"] = etag
+            value = request_headers.get("Range")
+            if_range = request_headers.get("If-Range")
+            if not value or (if_range is not None and if_range != etag):
+                return 200, headers, body
+            start, end = _parse_range(value, len(body))
+            if start >= len(body):
+                return 416, dict(headers, **{"Content-Range": f"bytes */{len(body)}"}), b""
+            headers["Content-Range"] = f"bytes {start}-{end}/{len(body)}"
+            return 206, headers, body[start:end + 1]
+        return self.route(path, handler)
+
+    def headers_of(self, path):
+        """该路径收到的每个请求的请求头"""
+        return [headers for request_path, headers in self.requests if request_path == path]
+
+
+@pytest.fixture
+def http_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    server.daemon_threads = True
+    server.routes = {}
+    server.requests = []
+    thread = threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True)
+    thread.start()
+    yield LocalServer(server)
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def make_jpeg():
+    return jpeg_bytes
@@ -0,0 +1,108 @@
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from common.aimd import AIMDController, HostDispatcher, make_controller
+from common.ratelimit import HostRateLimiter, TokenBucket
+
+
+def test_full_host_does_not_hold_threads():
+    controller = AIMDController(initial=1, maximum=1)
+    release_slow = threading.Event()
+    fast_done = threading.Event()
+    finished = []
+
+    def run(url, payload):
+        if "slow" in url:
+            assert release_slow.wait(5)
+        else:
+            fast_done.set()
+        finished.append(url)
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        dispatcher = HostDispatcher(executor, run, controller=controller)
+        for i in range(5):
+            dispatcher.submit(f"http://slow.example/{i}.jpg")
+        dispatcher.submit("http://fast.example/0.jpg")
+        # 慢域名只占一个名额，其余4个排队，不占线程
+        assert fast_done.wait(5)
+        assert dispatcher.deferred == 4
+        release_slow.set()
+        dispatcher.join()
+    assert finished[0] == "http://fast.example/0.jpg"
+    assert finished[1:] == [f"http://slow.example/{i}.jpg" for i in range(5)]
+    assert controller.windows()["slow.example"]["in_flight"] == 0
+
+
+def test_errors_feed_back_and_reach_on_error():
+    controller = AIMDController(initial=4)
+    errors = []
+
+    class Throttled(Exception):
+        status = 429
+
+    def run(url, payload):
+        raise Throttled()
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        dispatcher = HostDispatcher(executor, run, lambda url, payload, e: errors.append((url, payload)),
+                                    controller=controller)
+        dispatcher.submit("http://a.example/1.jpg", "one")
+        dispatcher.join()
+    assert errors == [("http://a.example/1.jpg", "one")]
+    assert controller.windows()["a.example"]["window"] == 2
+
+
+def test_wait_below_counts_deferred_tasks():
+    controller = AIMDController(initial=1, maximum=1)
+    gate = threading.Event()
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        dispatcher = HostDispatcher(executor, lambda url, payload: gate.wait(5), controller=controller)
+        for i in range(3):
+            dispatcher.submit(f"http://a.example/{i}.jpg")
+        assert len(dispatcher) == 3
+        assert not dispatcher.wait_below(3, timeout=0.05)
+        gate.set()
+        dispatcher.join()
+        assert dispatcher.wait_below(1, timeout=0)
+
+
+def test_rate_limited_host_waits_outside_the_pool():
+    controller = AIMDController(initial=4, maximum=4)
+    limiter = HostRateLimiter(rules=[("paced.example", 10, 1)])
+    started = {}
+
+    def run(url, payload):
+        started[url] = time.monotonic()
+
+    begin = time.monotonic()
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        dispatcher = HostDispatcher(executor, run, controller=controller, limiter=limiter)
+        for i in range(3):
+            dispatcher.submit(f"http://paced.example/{i}.jpg")
+        dispatcher.submit("http://free.example/0.jpg")
+        dispatcher.join()
+    paced = [started[f"http://paced.example/{i}.jpg"] for i in range(3)]
+    # 唯一的线程没有停在限速上，不限速的域名不用等
+    assert started["http://free.example/0.jpg"] - begin < 0.05
+    assert paced[1] - paced[0] >= 0.08 and paced[2] - paced[1] >= 0.08
+    assert controller.windows()["paced.example"]["in_flight"] == 0
+
+
+def test_try_take_does_not_overdraw():
+    bucket = TokenBucket(rate=10, burst=1)
+    assert bucket.try_take() == 0
+    delay = bucket.try_take()
+    assert 0.05 < delay <= 0.1
+    # 没取到令牌时不透支，等够时间后就能取到
+    time.sleep(delay + 0.01)
+    assert bucket.try_take() == 0
+
+
+def test_make_controller_caps_window_at_per_host():
+    controller = make_controller(8)
+    assert (controller.initial, controller.maximum) == (2, 8)
+    for _ in range(200):
+        assert controller.try_acquire("a.example")
+        controller.release("a.example", latency=0.01)
+    assert controller.windows()["a.example"]["window"] == 8
+    assert make_controller(1).initial == 1
@@ -0,0 +1,47 @@
+import os
+from common.batch import PageDownloader
+from common.ledger import STATUS_FAILED
+
+
+class Progress:
+    def __init__(self):
+        self.n = 0
+
+    def update(self, n):
+        self.n += n
+
+
+def test_download_page_and_skip_done(tmp_path, http_server, make_jpeg):
+    tasks = [(http_server.serve(f"/{i}.jpg", make_jpeg(64, 64)), str(tmp_path / f"{i}.jpg")) for i in range(4)]
+    with PageDownloader(str(tmp_path), max_workers=2) as loader:
+        loader.progress = Progress()
+        assert loader.download_page(tasks) == 4
+        assert loader.download_page(tasks) == 4
+        assert loader.progress.n == 8
+    assert len([path for path, _ in http_server.requests]) == 4
+    assert all(os.path.exists(filename) for _, filename in tasks)
+
+
+def test_transient_failure_is_retried_by_finish(tmp_path, http_server, make_jpeg):
+    body = make_jpeg(64, 64)
+    calls = []
+
+    def flaky(request_headers):
+        calls.append(1)
+        return (500, {}, b"") if len(calls) == 1 else (200, {"Content-Type": "image/jpeg"}, body)
+
+    url = http_server.route("/flaky.jpg", flaky)
+    with PageDownloader(str(tmp_path), max_workers=2) as loader:
+        loader.retry.base_delay = 0.01
+        assert loader.download_page([(url, str(tmp_path / "flaky.jpg"))]) == 0
+        assert len(loader.retry) == 1
+        assert loader.finish() == 1
+    assert open(tmp_path / "flaky.jpg", "rb").read() == body
+
+
+def test_permanent_failure_goes_to_ledger(tmp_path, http_server):
+    url = http_server.url("/missing.jpg")
+    with PageDownloader(str(tmp_path), max_workers=2) as loader:
+        assert loader.download_page([(url, str(tmp_path / "missing.jpg"))]) == 0
+        assert not len(loader.retry)
+        assert loader.ledger.get(url)["status"] == STATUS_FAILED
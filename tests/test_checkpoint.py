@@ -0,0 +1,56 @@
+import json
+from common.checkpoint import PageCheckpoint, checkpoint_path, run_pages
+
+
+def test_mark_pending_and_reopen(tmp_path):
+    path = checkpoint_path(str(tmp_path), "123rf", "cat")
+    checkpoint = PageCheckpoint(path, 20, save_every=100, save_interval=1000)
+    for page in (1, 2, 8, 20):
+        checkpoint.mark(page)
+    assert len(checkpoint) == 4
+    assert checkpoint.pending(start=2) == [p for p in range(3, 20) if p != 8]
+    checkpoint.save()
+    reopened = PageCheckpoint(path, 20)
+    assert [p for p in range(1, 21) if reopened.done(p)] == [1, 2, 8, 20]
+
+
+def test_saves_after_save_every_marks(tmp_path):
+    path = str(tmp_path / "p.ckpt")
+    checkpoint = PageCheckpoint(path, 10, save_every=3, save_interval=1000)
+    checkpoint.mark(1)
+    checkpoint.mark(2)
+    assert not (tmp_path / "p.ckpt").exists()
+    checkpoint.mark(3)
+    assert PageCheckpoint(path, 10).pending() == list(range(4, 11))
+
+
+def test_total_pages_change_keeps_overlap(tmp_path):
+    path = str(tmp_path / "p.ckpt")
+    checkpoint = PageCheckpoint(path, 30)
+    checkpoint.mark(5)
+    checkpoint.mark(25)
+    checkpoint.save()
+    assert PageCheckpoint(path, 10).pending() == [p for p in range(1, 11) if p != 5]
+    assert PageCheckpoint(path, 40).done(25)
+
+
+def test_corrupt_file_starts_over(tmp_path):
+    path = tmp_path / "p.ckpt"
+    path.write_text("{not json", encoding="utf-8")
+    assert len(PageCheckpoint(str(path), 5)) == 0
+    path.write_text(json.dumps({"total_pages": 5}), encoding="utf-8")
+    assert len(PageCheckpoint(str(path), 5)) == 0
+
+
+def test_run_pages_marks_only_finished_pages(tmp_path):
+    path = str(tmp_path / "p.ckpt")
+    checkpoint = PageCheckpoint(path, 6, save_every=100, save_interval=1000)
+
+    def fetch_page(page):
+        if page == 3:
+            raise ValueError("boom")
+        return page != 4
+
+    assert run_pages(range(1, 7), fetch_page, checkpoint, workers=3) == 4
+    # 结束时保存断点，出错和返回False的页下次重新请求
+    assert PageCheckpoint(path, 6).pending() == [3, 4]
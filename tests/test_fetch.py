@@ -0,0 +1,123 @@
+import os
+import asyncio
+import hashlib
+import aiohttp
+from common.fetch import download_to, part_path_for, parse_content_range, response_validator, write_part_state, \
+    read_part_state, total_from_content_range
+from async_download import single_download
+
+BODY = bytes(range(256)) * 40
+
+
+def sha1_of(data):
+    return hashlib.sha1(data).hexdigest()
+
+
+def start_part(file_path, url, data, etag=None, total=None):
+    """模拟上次下载中断留下的.part"""
+    part_path = part_path_for(file_path, url)
+    with open(part_path, "wb") as f:
+        f.write(data)
+    write_part_state(part_path, {"ETag": etag} if etag else {}, total)
+    return part_path
+
+
+def async_download(file_path, url):
+    async def run():
+        async with aiohttp.ClientSession() as session:
+            return await single_download(session, file_path, url, aiohttp.ClientTimeout(total=10))
+    return asyncio.run(run())
+
+
+def test_parse_content_range():
+    assert parse_content_range("bytes 100-199/200") == (100, 200)
+    assert parse_content_range("bytes */200") == (None, 200)
+    assert parse_content_range("bytes 0-99/*") == (0, None)
+    assert parse_content_range(None) == (None, None)
+    assert total_from_content_range("bytes 5-9/10") == 10
+
+
+def test_response_validator_prefers_strong_etag():
+    assert response_validator({"ETag": '"abc"', "Last-Modified": "x"}) == '"abc"'
+    assert response_validator({"ETag": 'W/"abc"', "Last-Modified": "x"}) == "x"
+    assert response_validator({}) is None
+
+
+def test_fresh_download_cleans_up_part_files(tmp_path, http_server):
+    url = http_server.serve("/a.jpg", BODY, etag='"v1"')
+    file_path = str(tmp_path / "a.jpg")
+    size, sha1, status = download_to(url, file_path, buffer_size=1000)
+    assert (size, sha1, status) == (len(BODY), sha1_of(BODY), 200)
+    assert open(file_path, "rb").read() == BODY
+    assert os.listdir(tmp_path) == ["a.jpg"]
+
+
+def test_resume_sends_if_range_and_appends(tmp_path, http_server):
+    url = http_server.serve("/a.jpg", BODY, etag='"v1"')
+    file_path = str(tmp_path / "a.jpg")
+    start_part(file_path, url, BODY[:1000], etag='"v1"', total=len(BODY))
+    size, sha1, status = download_to(url, file_path)
+    request = http_server.headers_of("/a.jpg")[0]
+    assert request["Range"] == "bytes=1000-" and request["If-Range"] == '"v1"'
+    assert (size, sha1, status) == (len(BODY), sha1_of(BODY), 206)
+    assert open(file_path, "rb").read() == BODY
+
+
+def test_changed_origin_restarts_from_zero(tmp_path, http_server):
+    url = http_server.serve("/a.jpg", BODY, etag='"v2"')
+    file_path = str(tmp_path / "a.jpg")
+    start_part(file_path, url, b"old" * 300, etag='"v1"')
+    size, sha1, status = download_to(url, file_path)
+    assert (size, sha1, status) == (len(BODY), sha1_of(BODY), 200)
+    assert open(file_path, "rb").read() == BODY
+
+
+def test_416_with_complete_part_only_renames(tmp_path, http_server):
+    url = http_server.serve("/a.jpg", BODY)
+    file_path = str(tmp_path / "a.jpg")
+    start_part(file_path, url, BODY)
+    assert download_to(url, file_path) == (len(BODY), sha1_of(BODY), 416)
+    assert open(file_path, "rb").read() == BODY
+
+
+def test_stale_part_after_416_retries_without_range(tmp_path, http_server):
+    url = http_server.serve("/a.jpg", BODY)
+    file_path = str(tmp_path / "a.jpg")
+    start_part(file_path, url, BODY + b"stale")
+    assert download_to(url, file_path) == (len(BODY), sha1_of(BODY), 200)
+    requests_seen = http_server.headers_of("/a.jpg")
+    assert "Range" in requests_seen[0] and "Range" not in requests_seen[1]
+    assert open(file_path, "rb").read() == BODY
+
+
+def test_206_with_wrong_start_restarts(tmp_path, http_server):
+    def handler(request_headers):
+        if request_headers.get("Range"):
+            return 206, {"Content-Range": f"bytes 0-{len(BODY) - 1}/{len(BODY)}"}, BODY
+        return 200, {}, BODY
+    url = http_server.route("/a.jpg", handler)
+    file_path = str(tmp_path / "a.jpg")
+    start_part(file_path, url, BODY[:500])
+    assert download_to(url, file_path) == (len(BODY), sha1_of(BODY), 200)
+    assert open(file_path, "rb").read() == BODY
+
+
+def test_206_with_different_total_restarts(tmp_path, http_server):
+    url = http_server.serve("/a.jpg", BODY)
+    file_path = str(tmp_path / "a.jpg")
+    part_path = start_part(file_path, url, BODY[:500], total=len(BODY) + 1)
+    assert download_to(url, file_path)[2] == 200
+    assert open(file_path, "rb").read() == BODY
+    assert not os.path.exists(part_path) and read_part_state(part_path) == {}
+
+
+def test_async_resume_and_restart(tmp_path, http_server):
+    url = http_server.serve("/a.jpg", BODY, etag='"v1"')
+    file_path = str(tmp_path / "a.jpg")
+    start_part(file_path, url, BODY[:1000], etag='"v1"', total=len(BODY))
+    assert async_download(file_path, url) == (len(BODY), sha1_of(BODY), 206)
+    os.remove(file_path)
+    start_part(file_path, url, BODY + b"stale")
+    assert async_download(file_path, url) == (len(BODY), sha1_of(BODY), 200)
+    assert open(file_path, "rb").read() == BODY
+    assert os.listdir(tmp_path) == ["a.jpg"]
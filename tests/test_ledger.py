@@ -0,0 +1,37 @@
+from common.ledger import DownloadLedger, STATUS_DONE, STATUS_FAILED, STATUS_SKIPPED
+
+
+def test_record_is_keyed_by_canonical_url(tmp_path):
+    with DownloadLedger(str(tmp_path / "ledger.db")) as ledger:
+        ledger.record("HTTPS://Example.com:443/a.jpg#top", STATUS_FAILED, http_status=404)
+        row = ledger.get("https://example.com/a.jpg")
+    assert row["status"] == STATUS_FAILED
+    assert row["http_status"] == 404
+
+
+def test_records_survive_reopen(tmp_path):
+    path = str(tmp_path / "ledger.db")
+    image = tmp_path / "a.jpg"
+    image.write_bytes(b"x")
+    with DownloadLedger(path, batch_size=1000) as ledger:
+        ledger.record("https://example.com/a.jpg", STATUS_DONE, 1, "sha", str(image), 200)
+    with DownloadLedger(path) as ledger:
+        assert ledger.is_done("https://example.com/a.jpg")
+        assert ledger.stats() == {STATUS_DONE: 1}
+
+
+def test_done_requires_file_on_disk(tmp_path):
+    with DownloadLedger(str(tmp_path / "ledger.db")) as ledger:
+        ledger.record("https://example.com/a.jpg", STATUS_DONE, 1, "sha", str(tmp_path / "missing.jpg"), 200)
+        assert not ledger.is_done("https://example.com/a.jpg")
+        assert not ledger.settled("https://example.com/a.jpg")
+
+
+def test_skipped_and_failed_urls(tmp_path):
+    with DownloadLedger(str(tmp_path / "ledger.db")) as ledger:
+        ledger.record("https://example.com/small.jpg", STATUS_SKIPPED, size=10)
+        ledger.record("https://example.com/broken.jpg", STATUS_FAILED, http_status=500)
+        assert ledger.settled("https://example.com/small.jpg")
+        assert not ledger.settled("https://example.com/broken.jpg")
+        assert ledger.get("https://example.com/unknown.jpg") is None
+        assert ledger.stats() == {STATUS_SKIPPED: 1, STATUS_FAILED: 1}
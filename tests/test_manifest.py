@@ -0,0 +1,70 @@
+import asyncio
+from common.manifest import ManifestWriter, manifest_path, iter_dir_urls, manifest_sizes
+from common.seenset import SeenSet
+
+
+def test_dir_urls_read_up_to_snapshot(tmp_path):
+    path = str(tmp_path)
+    with ManifestWriter(manifest_path(path, "bing", "cat"), engine="bing") as writer:
+        writer.add(["http://a.com/1.jpg", "http://a.com/2.jpg"], page=1)
+    sizes = manifest_sizes(path)
+    with ManifestWriter(manifest_path(path, "bing", "cat"), engine="bing") as writer:
+        writer.add(["http://a.com/3.jpg"], page=2)
+    with ManifestWriter(manifest_path(path, "sogou", "cat"), engine="sogou") as writer:
+        writer.add(["http://b.com/1.jpg"], page=1)
+    # 快照之后追加的链接和新建的清单都不读
+    assert list(iter_dir_urls(path, sizes)) == ["http://a.com/1.jpg", "http://a.com/2.jpg"]
+    assert len(list(iter_dir_urls(path))) == 4
+
+
+def test_shared_set_hands_each_url_to_one_sink(tmp_path):
+    shared = SeenSet()
+    sunk = []
+    sink = lambda urls, engine: sunk.extend(urls)
+    with ManifestWriter(manifest_path(str(tmp_path), "bing", "cat"), engine="bing", sink=sink, shared=shared) as bing, \
+            ManifestWriter(manifest_path(str(tmp_path), "360", "cat"), engine="360", sink=sink, shared=shared) as so:
+        assert bing.add(["http://a.com/1.jpg", "https://a.com/2.jpg?utm_source=x"]) == \
+            ["http://a.com/1.jpg", "https://a.com/2.jpg?utm_source=x"]
+        # 其他引擎采到的链接仍算本引擎的新链接，但不再写入清单和交给sink
+        assert so.add(["https://a.com/1.jpg", "http://a.com/3.jpg"]) == ["https://a.com/1.jpg", "http://a.com/3.jpg"]
+        assert so.duplicates == 1
+    assert sunk == ["http://a.com/1.jpg", "https://a.com/2.jpg?utm_source=x", "http://a.com/3.jpg"]
+
+
+def test_drain_awaits_sink_drain(tmp_path):
+    class Sink:
+        def __init__(self):
+            self.urls = []
+            self.drained = 0
+
+        def __call__(self, urls, engine):
+            self.urls.extend(urls)
+
+        async def drain(self):
+            self.drained += 1
+
+    sink = Sink()
+
+    async def run():
+        with ManifestWriter(manifest_path(str(tmp_path), "bing", "cat"), engine="bing", sink=sink) as writer:
+            writer.add(["http://a.com/1.jpg"])
+            await writer.drain()
+        # 没有drain的sink直接返回
+        with ManifestWriter(manifest_path(str(tmp_path), "360", "cat"), engine="360", sink=print) as writer:
+            await writer.drain()
+
+    asyncio.run(run())
+    assert sink.urls == ["http://a.com/1.jpg"] and sink.drained == 1
+
+
+def test_close_reports_cross_engine_duplicates(tmp_path, capsys):
+    shared = SeenSet()
+    with ManifestWriter(manifest_path(str(tmp_path), "bing", "cat"), engine="bing", shared=shared) as bing:
+        bing.add(["http://a.com/1.jpg"])
+    writer = ManifestWriter(manifest_path(str(tmp_path), "360", "cat"), engine="360", shared=shared)
+    writer.add(["http://a.com/1.jpg", "http://a.com/2.jpg"])
+    writer.close()
+    writer.close()
+    out = capsys.readouterr().out
+    assert "360: 其他引擎已采集过、未写入清单的链接1个" in out
+    assert out.count("360:") == 1
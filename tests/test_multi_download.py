@@ -0,0 +1,38 @@
+import os
+import queue
+from multi_download import list_split, download
+from common.ledger import DownloadLedger, ledger_path, STATUS_DONE
+
+
+def test_list_split_spreads_remainder_over_first_parts():
+    assert list_split(list(range(7)), 3) == [[0, 1, 2], [3, 4], [5, 6]]
+
+
+def test_list_split_drops_empty_parts():
+    assert list_split([1, 2], 4) == [[1], [2]]
+    assert list_split([], 3) == []
+
+
+def test_download_drains_batches_until_none(tmp_path, http_server, make_jpeg):
+    urls = [http_server.serve(f"/{i}.jpg", make_jpeg(64, 64)) for i in range(5)]
+    dir_path = str(tmp_path) + "/"
+    url_queue = queue.Queue()
+    url_queue.put(urls[:3])
+    url_queue.put(urls[3:])
+    url_queue.put(None)
+    download(dir_path, url_queue, 0, "kw", max_threads=2)
+    assert len(os.listdir(dir_path + "pic")) == 5
+    with DownloadLedger(ledger_path(dir_path)) as ledger:
+        assert all(ledger.get(url)["status"] == STATUS_DONE for url in urls)
+
+
+def test_download_skips_settled_urls(tmp_path, http_server, make_jpeg):
+    url = http_server.serve("/a.jpg", make_jpeg(64, 64))
+    dir_path = str(tmp_path) + "/"
+    for _ in range(2):
+        url_queue = queue.Queue()
+        url_queue.put([url])
+        url_queue.put(None)
+        download(dir_path, url_queue, 0, "kw", max_threads=2)
+    assert len(http_server.headers_of("/a.jpg")) == 1
+    assert len(os.listdir(dir_path + "pic")) == 1
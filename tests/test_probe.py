@@ -0,0 +1,70 @@
+import os
+import struct
+import asyncio
+import aiohttp
+from common.probe import sniff, image_size, ProbePolicy, probe, probe_async
+from common.fetch import part_path_for, read_part_state, download_to
+
+
+def png_bytes(width, height):
+    return b"\x89PNG\r\n\x1a\n" + struct.pack(">I", 13) + b"IHDR" + struct.pack(">II", width, height) + bytes(20)
+
+
+def test_sniff_formats():
+    assert sniff(b"GIF89a" + bytes(10)) == "gif"
+    assert sniff(b"RIFF\x00\x00\x00\x00WEBP") == "webp"
+    assert sniff(b"<html>") is None
+
+
+def test_image_size_parsers(make_jpeg):
+    assert image_size(make_jpeg(640, 480)) == ("jpeg", 640, 480)
+    assert image_size(png_bytes(300, 200)) == ("png", 300, 200)
+    assert image_size(b"GIF89a" + struct.pack("<HH", 32, 16)) == ("gif", 32, 16)
+    bmp = b"BM" + bytes(16) + struct.pack("<ii", 100, -50)
+    assert image_size(bmp) == ("bmp", 100, 50)
+    vp8x = b"RIFF" + bytes(4) + b"WEBPVP8X" + bytes(8) + (99).to_bytes(3, "little") + (49).to_bytes(3, "little")
+    assert image_size(vp8x) == ("webp", 100, 50)
+
+
+def test_jpeg_size_after_app_segment_is_found(make_jpeg):
+    # 帧头在一段较长的APP1之后
+    data = make_jpeg(800, 600)
+    app1 = b"\xff\xe1" + struct.pack(">H", 1002) + bytes(1000)
+    assert image_size(data[:2] + app1 + data[2:]) == ("jpeg", 800, 600)
+
+
+def test_policy_check(make_jpeg):
+    policy = ProbePolicy(min_width=256, min_height=256, max_bytes=10000)
+    assert policy.check(206, "text/html; charset=utf-8", b"", None).reason == "content-type"
+    assert policy.check(206, "image/jpeg", b"garbage", None).reason == "not-image"
+    assert policy.check(206, "image/jpeg", make_jpeg(100, 100), 2048).reason == "too-small"
+    assert policy.check(206, "image/jpeg", make_jpeg(512, 512), 20000).reason == "too-large"
+    assert policy.check(206, "image/jpeg", make_jpeg(512, 512), 2048).ok
+    assert policy.request_headers({"A": "1"}) == {"A": "1", "Range": f"bytes=0-{policy.probe_bytes - 1}"}
+
+
+def test_probe_keeps_head_for_resume(tmp_path, http_server, make_jpeg):
+    body = make_jpeg(512, 512, size=64 * 1024)
+    url = http_server.serve("/a.jpg", body, etag='"v1"')
+    file_path = str(tmp_path / "a.jpg")
+    part_path = part_path_for(file_path, url)
+    result = probe(url, ProbePolicy(min_width=256, min_height=256), part_path=part_path)
+    assert result.ok and (result.width, result.height, result.size) == (512, 512, len(body))
+    assert os.path.getsize(part_path) == 16 * 1024
+    assert read_part_state(part_path) == {"validator": '"v1"', "total": len(body)}
+    download_to(url, file_path)
+    assert http_server.headers_of("/a.jpg")[1]["Range"] == f"bytes={16 * 1024}-"
+    assert open(file_path, "rb").read() == body
+
+
+def test_probe_async_rejects_small_images(tmp_path, http_server, make_jpeg):
+    url = http_server.serve("/small.jpg", make_jpeg(64, 64))
+    part_path = str(tmp_path / ".small.part")
+
+    async def run():
+        async with aiohttp.ClientSession() as session:
+            return await probe_async(session, url, ProbePolicy(min_width=256, min_height=256), part_path=part_path)
+
+    result = asyncio.run(run())
+    assert not result.ok and result.reason == "too-small"
+    assert not os.path.exists(part_path)
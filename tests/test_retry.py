@@ -0,0 +1,67 @@
+import time
+from common.retry import RetryScheduler, classify, status_of, retry_after, PERMANENT, TRANSIENT, THROTTLED
+
+
+class HttpError(Exception):
+    def __init__(self, status, headers=None):
+        self.status = status
+        self.headers = headers or {}
+
+
+class InvalidURL(Exception):
+    pass
+
+
+def test_classify_by_status():
+    assert classify(status=404) == PERMANENT
+    assert classify(status=416) == PERMANENT
+    assert classify(status=429) == THROTTLED
+    assert classify(status=503) == THROTTLED
+    assert classify(status=500) == TRANSIENT
+    assert classify(status=408) == TRANSIENT
+
+
+def test_classify_by_exception():
+    assert classify(HttpError(403)) == PERMANENT
+    assert classify(InvalidURL()) == PERMANENT
+    assert classify(TimeoutError()) == TRANSIENT
+    assert status_of(HttpError(502)) == 502
+    assert status_of(ValueError()) is None
+
+
+def test_retry_after_seconds_only():
+    assert retry_after(HttpError(429, {"Retry-After": "7"})) == 7.0
+    assert retry_after(HttpError(429, {"Retry-After": "Wed, 21 Oct 2015 07:28:00 GMT"})) is None
+
+
+def test_backoff_is_jittered_within_half_to_full():
+    retry = RetryScheduler(base_delay=1.0, max_delay=60.0)
+    for attempt in range(1, 5):
+        delay = retry.backoff(TRANSIENT, attempt)
+        full = 2 ** (attempt - 1)
+        assert full / 2 <= delay <= full
+    assert retry.backoff(THROTTLED, 1, HttpError(429, {"Retry-After": "120"})) == 60.0
+
+
+def test_schedule_gives_up_after_max_attempts():
+    retry = RetryScheduler(max_attempts=3, base_delay=0.001)
+    assert retry.schedule("u", HttpError(500))[1] is not None
+    assert retry.schedule("u", HttpError(500))[1] is not None
+    assert retry.schedule("u", HttpError(500)) == (TRANSIENT, None)
+    assert retry.schedule("v", HttpError(404)) == (PERMANENT, None)
+
+
+def test_pop_due_in_deadline_order_with_payload():
+    retry = RetryScheduler(base_delay=0.001, max_delay=0.002)
+    retry.schedule("a", HttpError(500), payload="a.jpg")
+    retry.schedule("b", HttpError(500), payload="b.jpg")
+    time.sleep(0.01)
+    assert sorted(retry.pop_all_due()) == [("a", "a.jpg"), ("b", "b.jpg")]
+    assert retry.pop_due() is None and retry.next_delay() is None
+
+
+def test_forget_resets_attempts():
+    retry = RetryScheduler(max_attempts=2, base_delay=0.001)
+    retry.schedule("u", HttpError(500))
+    retry.forget("u")
+    assert retry.schedule("u", HttpError(500))[1] is not None
@@ -0,0 +1,80 @@
+import os
+from common.seenset import SeenSet, BloomFilter, seen_path, string_hash
+
+
+def urls(start, stop):
+    return [f"//a.com/{i}.jpg" for i in range(start, stop)]
+
+
+def test_add_and_contains():
+    seen = SeenSet()
+    assert seen.add("//a.com/1.jpg")
+    assert not seen.add("//a.com/1.jpg")
+    assert "//a.com/1.jpg" in seen and "//a.com/2.jpg" not in seen
+    assert len(seen) == 1
+
+
+def test_merge_keeps_members_sorted(tmp_path):
+    seen = SeenSet(merge_min=8)
+    seen.update(urls(0, 50))
+    # 积累到merge_min后归并进有序数组，剩下的还在小集合里
+    assert len(seen._base) >= 40 and len(seen._pending) < 16
+    assert list(seen._base) == sorted(seen._base)
+    assert all(url in seen for url in urls(0, 50))
+    assert not any(url in seen for url in urls(50, 100))
+    assert len(seen) == 50
+
+
+def test_persist_and_reopen_with_bloom_file(tmp_path):
+    path = seen_path(str(tmp_path))
+    with SeenSet(path, capacity=256, merge_min=16) as seen:
+        seen.update(urls(0, 100))
+    assert os.path.getsize(path) == 100 * 8
+    assert os.path.exists(path + ".bloom")
+    with SeenSet(path, capacity=256) as reopened:
+        assert len(reopened) == 100
+        assert reopened._bloom.capacity == 256
+        assert all(url in reopened for url in urls(0, 100))
+        assert reopened.add("//a.com/new.jpg")
+    with SeenSet(path) as reopened:
+        assert len(reopened) == 101 and "//a.com/new.jpg" in reopened
+
+
+def test_stale_bloom_file_is_rebuilt(tmp_path):
+    path = str(tmp_path / "seen.idx")
+    with SeenSet(path, capacity=256) as seen:
+        seen.update(urls(0, 10))
+    bloom = open(path + ".bloom", "rb").read()
+    with SeenSet(path, capacity=256) as seen:
+        seen.update(urls(10, 20))
+    # 布隆过滤器文件和数组对不上时按数组重建
+    open(path + ".bloom", "wb").write(bloom)
+    with SeenSet(path, capacity=256) as seen:
+        assert all(url in seen for url in urls(0, 20))
+
+
+def test_update_from_another_set():
+    first = SeenSet(merge_min=4)
+    first.update(urls(0, 10))
+    second = SeenSet()
+    second.update(first)
+    assert len(second) == 10
+    assert sorted(second) == sorted(string_hash(url) for url in urls(0, 10))
+
+
+def test_bloom_grows_past_capacity():
+    seen = SeenSet(capacity=64, merge_min=32)
+    seen.update(urls(0, 500))
+    seen.save()
+    assert seen._bloom.capacity >= 500
+    assert all(url in seen for url in urls(0, 500))
+
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = BloomFilter(1000)
+    values = [string_hash(url) for url in urls(0, 1000)]
+    for value in values:
+        bloom.add(value)
+    assert all(value in bloom for value in values)
+    false_positives = sum(string_hash(url) in bloom for url in urls(1000, 11000))
+    assert false_positives < 500
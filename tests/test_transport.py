@@ -0,0 +1,15 @@
+from common.transport import get_session
+
+
+def test_larger_pool_keeps_the_same_session(http_server):
+    url = http_server.serve("/a.jpg", b"data")
+    session = get_session(pool_size=2)
+    resized = get_session(pool_size=64)
+    assert resized is session
+    assert session.get_adapter(url)._pool_maxsize >= 64
+    assert session.get(url, timeout=5).content == b"data"
+
+
+def test_smaller_pool_request_keeps_current_adapter():
+    adapter = get_session(pool_size=32).get_adapter("https://example.com/")
+    assert get_session(pool_size=4).get_adapter("https://example.com/") is adapter
@@ -0,0 +1,35 @@
+from common.urls import canonical_url, dedup_key
+
+
+def test_canonical_url():
+    assert canonical_url(" HTTPS://Example.COM:443/a/B.jpg?x=1#top ") == "https://example.com/a/B.jpg?x=1"
+    assert canonical_url("http://example.com:8080") == "http://example.com:8080/"
+
+
+def test_scheme_utm_and_param_order_ignored():
+    assert dedup_key("http://a.com/1.jpg?b=2&a=1") == dedup_key("https://a.com/1.jpg?a=1&b=2&utm_source=feed")
+
+
+def test_params_outside_host_rules_are_kept():
+    # src/from/ts在不认识的域名上可能决定返回哪张图
+    assert dedup_key("http://a.com/proxy?src=a.jpg") != dedup_key("http://a.com/proxy?src=b.jpg")
+    assert dedup_key("http://a.com/img?from=1") != dedup_key("http://a.com/img")
+    assert dedup_key("http://a.com/img?ts=1") != dedup_key("http://a.com/img?ts=2")
+
+
+def test_engine_thumbnails_unified():
+    assert dedup_key("https://tse3-mm.cn.bing.net/th?id=OIP.abc&w=300&h=200&c=7&rs=1&pid=ImgDetMain") == \
+        dedup_key("https://tse1.mm.bing.net/th?id=OIP.abc")
+    assert dedup_key("https://p0.ssl.qhimgs1.com/sdr/400__/t01abc.jpg") == dedup_key("http://p2.qhimg.com/t01abc.jpg")
+    assert dedup_key("https://img1.baidu.com/it/u=1,2&fm=253&fmt=auto?w=500&h=281&fr=x") == \
+        dedup_key("https://img2.baidu.com/it/u=1,2&fm=26")
+    assert dedup_key("https://encrypted-tbn0.gstatic.com/images?q=tbn:abc&usqp=CAU") == \
+        dedup_key("https://encrypted-tbn2.gstatic.com/images?q=tbn:abc")
+    assert dedup_key("https://tse1.mm.bing.net/th?id=OIP.abc") != dedup_key("https://tse1.mm.bing.net/th?id=OIP.def")
+
+
+def test_size_suffix_only_on_known_hosts():
+    assert dedup_key("https://blog.com/wp-content/uploads/2020/01/cat-300x200.jpg") == \
+        dedup_key("https://blog.com/wp-content/uploads/2020/01/cat.jpg")
+    assert dedup_key("https://i0.wp.com/blog.com/cat-640x480.png") == dedup_key("https://i0.wp.com/blog.com/cat.png")
+    assert dedup_key("https://cdn.example.com/banner-1920x1080.jpg") != dedup_key("https://cdn.example.com/banner.jpg")